@@ -1,6 +1,20 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .db_connection import register_connection
+        register_connection()
+
+        if settings.SYMBOLS_FILE_REQUIRED and not os.path.isfile(settings.SYMBOLS_FILE):
+            raise ImproperlyConfigured(
+                f"Symbol master not found at {settings.SYMBOLS_FILE}: mount it (see docker-compose.yml) "
+                "or set SYMBOLS_FILE"
+            )
@@ -0,0 +1,131 @@
+"""
+Walk-forward backtest of the prediction model (manage.py backtest_predictions).
+
+At every cutoff date the model only sees the bars up to the cutoff (through
+the `history` keyword of predict, or `histories` of predict_batch), and its
+predictions are scored against the closes that followed. Models are trained
+from scratch at each cutoff, bypassing the model registry.
+
+The bars come straight from the memory-mapped price store. The cutoff
+positions of a ticker are found with one searchsorted, and all of its
+windows are scored together: the predictions of every cutoff are stacked
+into one (windows, horizon) array and matched to the actual closes by date.
+A naive forecast (the close at the cutoff, repeated) is scored alongside as
+a baseline.
+"""
+import numpy as np
+
+from .forecaster import _accepts
+from .price_store import bars_to_frame, price_store
+
+
+def walk_forward_cutoffs(start, end, step):
+    """Every `step`-th business day from `start` to `end`, as datetime64[D]."""
+    start = np.busday_offset(np.datetime64(start, 'D'), 0, roll='forward')
+    count = np.busday_count(start, np.datetime64(end, 'D') + 1)
+    return np.busday_offset(start, np.arange(0, max(count, 0), step))
+
+
+def stack_windows(outputs, horizon=None):
+    """
+    Stack per-cutoff (predictions, dates) into a (windows, horizon) float
+    array and a matching datetime64[D] array, padding shorter forecasts with
+    NaN / NaT.
+    """
+    horizon = horizon or max((len(predictions) for predictions, _ in outputs), default=0)
+    predicted = np.full((len(outputs), horizon), np.nan)
+    dates = np.full((len(outputs), horizon), np.datetime64('NaT'), dtype='datetime64[D]')
+    for row, (predictions, window_dates) in enumerate(outputs):
+        length = min(len(predictions), horizon)
+        predicted[row, :length] = np.asarray(predictions, dtype=np.float64)[:length]
+        dates[row, :length] = np.asarray(window_dates, dtype='datetime64[D]')[:length]
+    return predicted, dates
+
+
+def score_windows(predicted, predicted_dates, actual_dates, actual_close):
+    """
+    MAPE in percent of each window (row) against the actual closes. Dates
+    without a close (holidays, the future, padding) are left out; windows
+    with no close at all come back as NaN.
+    """
+    positions = np.searchsorted(actual_dates, predicted_dates)
+    clipped = np.minimum(positions, len(actual_dates) - 1)
+    matched = (positions < len(actual_dates)) & (actual_dates[clipped] == predicted_dates)
+    actual = actual_close[clipped]
+    errors = np.where(matched, np.abs(predicted - actual) / np.abs(actual), 0.0)
+    counts = matched.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, errors.sum(axis=1) / counts * 100, np.nan)
+
+
+def backtest_tickers(tickers, cutoffs, min_history):
+    """
+    Backtest a chunk of tickers over `cutoffs` (runs in a pool worker).
+    Returns a dict of ticker -> per-ticker summary.
+    """
+    from .ml_model import PredictSuperCode
+
+    predict_batch = getattr(PredictSuperCode, 'predict_batch', None)
+    if predict_batch is not None and not _accepts(predict_batch, 'histories'):
+        predict_batch = None
+
+    bars = {}
+    positions = {}
+    for ticker in tickers:
+        ticker_bars = price_store.read(ticker)
+        if ticker_bars is None or len(ticker_bars) <= min_history:
+            continue
+        bars[ticker] = ticker_bars
+        # Number of bars up to and including each cutoff
+        positions[ticker] = np.searchsorted(ticker_bars['date'], cutoffs, side='right')
+
+    outputs = {ticker: [] for ticker in bars}
+    closes_at_cutoff = {ticker: [] for ticker in bars}
+    errors = {ticker: 0 for ticker in tickers}
+    for i in range(len(cutoffs)):
+        # Enough history to train on, and at least one later close to score against
+        eligible = [
+            ticker for ticker in bars
+            if min_history <= positions[ticker][i] < len(bars[ticker])
+        ]
+        if not eligible:
+            continue
+        histories = {ticker: bars_to_frame(bars[ticker][:positions[ticker][i]]) for ticker in eligible}
+
+        results = {}
+        if predict_batch is not None:
+            try:
+                results = dict(zip(eligible, predict_batch(eligible, histories=histories)))
+            except Exception:
+                # Fall back to one ticker at a time to find the one that fails
+                results = {}
+        for ticker in eligible:
+            if ticker not in results:
+                try:
+                    results[ticker] = PredictSuperCode.predict(ticker, history=histories[ticker])
+                except Exception:
+                    errors[ticker] += 1
+                    continue
+            predictions, dates, _ = results[ticker]
+            outputs[ticker].append((predictions, dates))
+            closes_at_cutoff[ticker].append(bars[ticker]['adj_close'][positions[ticker][i] - 1])
+
+    summaries = {}
+    for ticker in tickers:
+        if not outputs.get(ticker):
+            summaries[ticker] = {'windows': 0, 'mape': None, 'naive_mape': None, 'errors': errors[ticker]}
+            continue
+        predicted, predicted_dates = stack_windows(outputs[ticker])
+        naive = np.broadcast_to(np.asarray(closes_at_cutoff[ticker])[:, None], predicted.shape)
+        # Adjusted like the histories the models were given
+        actual_dates, actual_close = bars[ticker]['date'], bars[ticker]['adj_close']
+        mape = score_windows(predicted, predicted_dates, actual_dates, actual_close)
+        naive_mape = score_windows(naive, predicted_dates, actual_dates, actual_close)
+        scored = ~np.isnan(mape)
+        summaries[ticker] = {
+            'windows': int(scored.sum()),
+            'mape': float(mape[scored].mean()) if scored.any() else None,
+            'naive_mape': float(naive_mape[scored].mean()) if scored.any() else None,
+            'errors': errors[ticker],
+        }
+    return summaries
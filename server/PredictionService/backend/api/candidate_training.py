@@ -0,0 +1,229 @@
+"""
+Parallel training of the candidate models of one ticker.
+
+The model module prepares the ticker's dataset once (see the prepare and
+train_candidate hooks in api.forecaster). Its NumPy arrays are copied into
+shared memory blocks, and each candidate trains in its own process of a
+short-lived pool, on read-only views of those blocks instead of a pickled
+copy per process.
+
+A scoreboard in shared memory holds the best validation MAPE each candidate
+has reached so far. After every epoch a candidate asks should_stop(epoch,
+val_mape), which tells it to stop and return its best model so far:
+
+- once the ticker's time budget (MODEL_TRAINING_BUDGET) has run out,
+- or when, after MODEL_CANDIDATE_MIN_EPOCHS, its validation MAPE is more
+  than MODEL_CANDIDATE_PRUNE_RATIO times the best candidate's (pruned).
+
+Candidates that ignore the budget are abandoned ABANDON_GRACE seconds after
+it and the ticker goes on with the ones that finished.
+
+Inside a pool worker (the compute pool, run_prediction_jobs, prewarm), whose
+pool already has a process per core, the candidates are trained one after
+the other in the worker instead, sharing the same budget.
+"""
+import logging
+import multiprocessing
+import sys
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from django.conf import settings
+
+from .compute_pool import init_worker, pool_context
+from .metrics import MODEL_CANDIDATES
+from .prediction_progress import report_progress
+
+logger = logging.getLogger(__name__)
+
+# Seconds past the budget to wait for candidates to reach their next epoch end
+ABANDON_GRACE = 30
+
+# Only the creating process may unlink the blocks (Python 3.13+ can say so)
+_ATTACH_KWARGS = {'track': False} if sys.version_info >= (3, 13) else {}
+
+
+class SharedDataset:
+    """
+    A dataset dict with its NumPy arrays moved to shared memory. `spec` is
+    what the workers get: block names, shapes and dtypes for the arrays, the
+    value itself for anything else.
+    """
+
+    def __init__(self, dataset):
+        self._blocks = []
+        self.spec = {}
+        for name, value in dataset.items():
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                block = SharedMemory(create=True, size=max(value.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+                self.spec[name] = ('array', block.name, value.shape, value.dtype.str)
+            else:
+                self.spec[name] = ('value', value)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach(spec):
+    """Rebuild a SharedDataset's dict in a worker. Returns (dataset, blocks)."""
+    dataset = {}
+    blocks = []
+    for name, entry in spec.items():
+        if entry[0] == 'array':
+            _, block_name, shape, dtype = entry
+            block = SharedMemory(name=block_name, **_ATTACH_KWARGS)
+            blocks.append(block)
+            array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+            # Shared by every candidate: copy before modifying
+            array.flags.writeable = False
+            dataset[name] = array
+        else:
+            dataset[name] = entry[1]
+    return dataset, blocks
+
+
+def _close(blocks):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # The model still holds a view of the block; it goes away with the process
+            pass
+
+
+def training_workers(candidates):
+    """Processes to train `candidates` with, 1 meaning in this process."""
+    if multiprocessing.parent_process() is not None:
+        # Already one of a pool's workers: a pool per worker would run cores squared processes
+        return 1
+    return max(min(len(candidates), settings.MODEL_TRAINING_WORKERS), 1)
+
+
+def train_candidates(ticker, dataset, candidates):
+    """
+    Train every candidate of `candidates` on `dataset`, in parallel unless
+    training_workers() says otherwise.
+
+    Returns (predictions, dates, mape_values, artifacts) like the train hook:
+    the predictions of the candidate with the best validation MAPE, the MAPE
+    of every candidate that finished and their artifacts by candidate.
+    """
+    deadline = time.time() + settings.MODEL_TRAINING_BUDGET
+    workers = training_workers(candidates)
+    if workers == 1:
+        results = _train_sequentially(ticker, dataset, candidates, deadline)
+    else:
+        results = _train_in_pool(ticker, dataset, candidates, deadline, workers)
+
+    if not results:
+        raise RuntimeError(f"No candidate model finished training for {ticker}")
+    best = min(results, key=lambda candidate: results[candidate][2])
+    predictions, dates = results[best][:2]
+    mape_values = [result[2] for result in results.values()]
+    artifacts = {candidate: result[3] for candidate, result in results.items()}
+    return predictions, dates, mape_values, artifacts
+
+
+def _train_sequentially(ticker, dataset, candidates, deadline):
+    # Read-only like the shared blocks the pool workers get
+    dataset = {name: _read_only(value) for name, value in dataset.items()}
+    scores = np.full(len(candidates), np.inf)
+    results = {}
+    for slot, candidate in enumerate(candidates):
+        try:
+            result, outcome = _run_candidate(ticker, candidate, slot, dataset, scores, deadline)
+            results[candidate] = result
+        except Exception as e:
+            logger.warning("Training the %s candidate of %s failed: %s", candidate, ticker, e)
+            outcome = 'failed'
+        MODEL_CANDIDATES.labels(outcome=outcome).inc()
+    return results
+
+
+def _read_only(value):
+    if not isinstance(value, np.ndarray):
+        return value
+    view = value.view()
+    view.flags.writeable = False
+    return view
+
+
+def _train_in_pool(ticker, dataset, candidates, deadline, workers):
+    shared = SharedDataset(dataset)
+    scoreboard = SharedMemory(create=True, size=8 * len(candidates))
+    scores = np.ndarray(len(candidates), np.float64, buffer=scoreboard.buf)
+    scores[:] = np.inf
+    pool = pool_context().Pool(processes=workers, initializer=init_worker)
+    results = {}
+    try:
+        pending = {
+            candidate: pool.apply_async(
+                _train_candidate, (ticker, candidate, slot, shared.spec, scoreboard.name, deadline))
+            for slot, candidate in enumerate(candidates)
+        }
+        for candidate, pending_result in pending.items():
+            try:
+                result, outcome = pending_result.get(timeout=max(deadline + ABANDON_GRACE - time.time(), 0))
+                results[candidate] = result
+            except multiprocessing.TimeoutError:
+                logger.warning("Abandoned %s candidate of %s past the training budget", candidate, ticker)
+                outcome = 'abandoned'
+            except Exception as e:
+                logger.warning("Training the %s candidate of %s failed: %s", candidate, ticker, e)
+                outcome = 'failed'
+            MODEL_CANDIDATES.labels(outcome=outcome).inc()
+    finally:
+        # Also stops whatever is still running after the grace period
+        pool.terminate()
+        pool.join()
+        del scores
+        scoreboard.close()
+        scoreboard.unlink()
+        shared.close()
+    return results
+
+
+def _train_candidate(ticker, candidate, slot, spec, scoreboard_name, deadline):
+    # Runs in a pool worker
+    dataset, blocks = attach(spec)
+    scoreboard = SharedMemory(name=scoreboard_name, **_ATTACH_KWARGS)
+    scores = np.ndarray(len(scoreboard.buf) // 8, np.float64, buffer=scoreboard.buf)
+    try:
+        return _run_candidate(ticker, candidate, slot, dataset, scores, deadline)
+    finally:
+        del dataset, scores
+        _close(blocks + [scoreboard])
+
+
+def _run_candidate(ticker, candidate, slot, dataset, scores, deadline):
+    """Train one candidate, reporting its best validation MAPE in scores[slot]. Returns (result, outcome)."""
+    from .forecaster import _accepts
+    from .ml_model import PredictSuperCode
+
+    train_candidate = PredictSuperCode.train_candidate
+    stopped = []
+
+    def should_stop(epoch, val_mape):
+        # Only this candidate writes its slot
+        scores[slot] = min(scores[slot], val_mape)
+        if time.time() >= deadline:
+            stopped.append('time_budget')
+        elif epoch >= settings.MODEL_CANDIDATE_MIN_EPOCHS and \
+                scores[slot] > scores.min() * settings.MODEL_CANDIDATE_PRUNE_RATIO:
+            stopped.append('pruned')
+        return bool(stopped)
+
+    kwargs = {}
+    if _accepts(train_candidate, 'progress'):
+        kwargs['progress'] = lambda event, **data: report_progress(ticker, event, **{'candidate': candidate, **data})
+    result = train_candidate(ticker, candidate, dataset, should_stop, **kwargs)
+    scores[slot] = min(scores[slot], result[2])
+    report_progress(ticker, 'candidate_done', candidate=candidate, mape=float(result[2]))
+    return result, stopped[0] if stopped else 'completed'
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Imported once by the fork server instead of by every pool worker (missing ones are skipped)
+PRELOADED_MODULES = ['numpy', 'pandas', 'torch', 'sklearn', 'yfinance']
+
+
+def pool_context():
+    """
+    Start method for prediction pools. Workers are forked from a fork server
+    that has already imported the ML libraries, so each one starts in a
+    fraction of a second and shares those pages. Like spawn, nothing of the
+    parent (threads, Mongo/Redis clients) is inherited. Falls back to spawn
+    where forkserver is not available.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(PRELOADED_MODULES)
+    return context
+
+
+class ComputePoolSaturated(Exception):
+    """The prediction pool already has as many jobs as it is allowed to queue."""
+
+
+def init_worker():
+    # Spawned workers start from scratch, settings are needed by the model registry and price store
+    import django
+    django.setup()
+    # One prediction per core: keep each worker's torch from spawning a thread per core as well
+    from .inference import set_torch_threads
+    set_torch_threads()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        _mark_metrics_dead_on_exit()
+
+
+def _mark_metrics_dead_on_exit():
+    """
+    Remove this worker's live gauge files from PROMETHEUS_MULTIPROC_DIR when
+    it exits, so /metrics stops reporting it. Runs from multiprocessing's
+    exit finalizers, also when the pool is terminated (SIGTERM).
+    """
+    from prometheus_client import multiprocess
+
+    multiprocessing.util.Finalize(None, multiprocess.mark_process_dead, args=(os.getpid(),), exitpriority=0)
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+
+def _exit_on_sigterm(signum, frame):
+    # Unwind instead of dying on the signal, so the exit finalizers run
+    raise SystemExit(128 + signum)
+
+
+def compute_prediction(ticker):
+    from .forecaster import predict
+    from .prediction_cache import build_prediction_result
+    return build_prediction_result(*predict(ticker))
+
+
+def compute_predictions(tickers):
+    """Results of predict_many() ready for the cache, with its per-ticker errors."""
+    from .forecaster import predict_many
+    from .prediction_cache import build_prediction_result
+    outputs, errors = predict_many(tickers)
+    return {ticker: build_prediction_result(*output) for ticker, output in outputs.items()}, errors
+
+
+class BoundedComputePool:
+    """
+    Process pool for CPU-heavy predictions with a cap on queued + running
+    jobs, so a burst of cache misses is turned away instead of piling up
+    behind the workers.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def saturated(self):
+        return self._pending >= self.max_pending
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=pool_context(),
+                initializer=init_worker,
+            )
+        return self._executor
+
+    async def run(self, fn, *args, cost=1):
+        """
+        Run fn(*args) in the pool, raising ComputePoolSaturated if it is full.
+        A job predicting several tickers takes `cost` pending slots (at most
+        all of them), so batches count for the work they queue.
+
+        If a worker died (OOM kill, segfault), the jobs it broke fail with
+        BrokenProcessPool and the next call starts a new pool.
+        """
+        cost = min(cost, self.max_pending)
+        with self._lock:
+            if self._pending + cost > self.max_pending:
+                raise ComputePoolSaturated()
+            self._pending += cost
+            executor = self._get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        finally:
+            with self._lock:
+                self._pending -= cost
+
+    def _discard(self, executor):
+        with self._lock:
+            # Jobs failing together on the same broken pool only replace it once
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logger.warning("A prediction pool worker died, starting a new pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ConcurrencyLimit:
+    """Non-blocking cap on concurrent requests of one kind (e.g. cache lookups)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._active >= self.limit:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+
+compute_pool = BoundedComputePool(
+    max_workers=settings.PREDICTION_COMPUTE_WORKERS,
+    max_pending=settings.PREDICTION_COMPUTE_MAX_PENDING,
+)
+cache_lookup_limit = ConcurrencyLimit(settings.PREDICTION_CACHE_MAX_CONCURRENCY)
@@ -1,6 +1,51 @@
-import pymongo
+"""
+The MongoDB client of this process.
+
+mongoengine documents and direct pymongo access share one pooled
+MongoClient. It is registered with mongoengine when the app is loaded but
+only created on first use, so importing settings or starting a process
+that never touches MongoDB does not connect (or resolve a mongodb+srv
+URI). Pool sizes come from settings.MONGO_CLIENT_OPTIONS.
+"""
+import logging
+
+import mongoengine
 from django.conf import settings
+from mongoengine.connection import DEFAULT_CONNECTION_NAME, get_connection
+
+logger = logging.getLogger(__name__)
+
+
+def register_connection():
+    """Called from ApiConfig.ready(); does not create the client."""
+    mongoengine.register_connection(
+        DEFAULT_CONNECTION_NAME,
+        host=settings.CONNECTION_STRING,
+        **settings.MONGO_CLIENT_OPTIONS,
+    )
+
+
+def get_client():
+    # mongoengine creates the client on the first call and returns the same one afterwards
+    return get_connection(DEFAULT_CONNECTION_NAME)
+
+
+def get_db():
+    return get_client()[settings.DB_NAME]
+
+
+def get_collection(name):
+    return get_db()[name]
 
-client = pymongo.MongoClient(settings.CONNECTION_STRING)
-db = client["test"]
 
+def ensure_indexes():
+    """
+    Create the unique user_id index of user_prediction (declared on
+    models.UserPrediction) that the upserts by user_id rely on. Idempotent;
+    called by the commands that write the collection when they start.
+    """
+    try:
+        get_collection('user_prediction').create_index('user_id', unique=True)
+    except Exception as e:
+        # e.g. duplicate user_ids already stored: keep running, the next start retries
+        logger.error("Failed to create the user_prediction indexes: %s", e)
@@ -0,0 +1,325 @@
+"""
+Thin adapter around api.ml_model.PredictSuperCode.
+
+The views and management commands go through this module instead of calling
+the model code directly, so optional capabilities of the model module can be
+picked up when they exist and fall back to plain predict(ticker) otherwise.
+
+Any of the functions below (including predict itself) that declares a
+`history` keyword argument is given the ticker's price history from the
+local price store (api.price_store) instead of downloading it. Batch hooks
+get `histories`, a dict of ticker -> history.
+
+Functions declaring a `prices` keyword argument get the same bars without
+the DataFrame: a (dates, buffer) tuple where buffer is a fresh float32
+array of shape (bars, 6) with the columns of api.windowing.PRICE_FIELDS,
+theirs to scale in place and cut into windows with api.windowing.
+
+Likewise single-ticker functions declaring a `progress` keyword argument get
+a callback to report what they are doing, e.g. from their training loop:
+progress('training', candidate='lstm', epoch=3, epochs=50) and
+progress('candidate_done', candidate='lstm', mape=0.031). Events are
+streamed to clients of /api/v1/prediction/stream/ (api.prediction_progress).
+
+Optional hooks looked up on PredictSuperCode:
+
+    predict_batch(tickers)
+        Run several tickers through one batched forward pass over stacked
+        tensors. Must return a list of (predictions, dates, mape_values)
+        tuples in the same order as `tickers`.
+
+    train(ticker)
+        Fit the candidate models like predict() does, but also hand back what
+        is needed to rebuild them: returns (predictions, dates, mape_values,
+        artifacts) where artifacts maps model type -> dict of state_dict,
+        scaler parameters and config (see api.model_store.ModelRegistry).
+
+    prepare(ticker) and train_candidate(ticker, candidate, dataset, should_stop)
+        Used instead of train() for full retrains when both exist, so the
+        candidate models train in parallel (api.candidate_training).
+        prepare() preprocesses the ticker once and returns (dataset,
+        candidates): a dict whose NumPy arrays are shared with the training
+        processes read-only, and the list of candidate names.
+        train_candidate() fits one candidate, calling should_stop(epoch,
+        val_mape) after each epoch and returning early with its best model
+        when that is true. Returns (predictions, dates, mape, artifact).
+
+    fine_tune(ticker, artifacts, since)
+        Resume from the weights and scaler state in `artifacts` (trained on
+        data up to the date `since`) and train for a few epochs on the bars
+        added after it. Returns the same tuple as train(). If it declares an
+        `epochs` keyword argument it gets settings.MODEL_FINE_TUNE_EPOCHS.
+
+    forecast(ticker, artifacts)
+        Rebuild the models from `artifacts` and run only the forward pass.
+        Returns (predictions, dates, mape_values). If it declares a `models`
+        keyword argument it is given exported models to run instead (see
+        build_models), as a dict of model type -> callable taking and
+        returning tensors; types missing from the dict run eagerly.
+
+    build_models(ticker, artifacts)
+        Rebuild the eager nn.Modules from `artifacts`, for export under
+        settings.PREDICTION_INFERENCE_MODE. Returns a dict of model type ->
+        (module, validation inputs, validation targets), the inputs being
+        one batch tensor of the module's single input.
+
+With settings.PREDICTION_GLOBAL_MODEL on, tickers covered by the
+cross-ticker model (api.global_model) are predicted by it and never reach
+the hooks above.
+"""
+import functools
+import inspect
+import logging
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+
+from . import candidate_training, inference
+from .market_calendar import last_close_date
+from .global_model import global_model_loader
+from .ml_model import PredictSuperCode
+from .model_store import model_registry
+from .metrics import MODEL_TRAININGS, stage
+from .prediction_progress import report_progress
+from .price_store import price_store
+from .windowing import price_buffer
+
+logger = logging.getLogger(__name__)
+
+# Predictions also run in the server process when it is not using the compute pool
+inference.set_torch_threads()
+
+
+def _accepts(fn, argument):
+    return argument in inspect.signature(fn).parameters
+
+
+def _history(ticker):
+    with stage('data_fetch'):
+        history = price_store.history(ticker)
+    report_progress(ticker, 'data_loaded', bars=0 if history is None else len(history))
+    return history
+
+
+def _prices(ticker):
+    with stage('data_fetch'):
+        bars = price_store.bars(ticker)
+        prices = None if bars is None else (np.asarray(bars['date']), price_buffer(bars))
+    report_progress(ticker, 'data_loaded', bars=0 if bars is None else len(bars))
+    return prices
+
+
+def _call(fn, ticker, *args, **kwargs):
+    if _accepts(fn, 'history'):
+        kwargs['history'] = _history(ticker)
+    if _accepts(fn, 'prices'):
+        kwargs['prices'] = _prices(ticker)
+    if _accepts(fn, 'progress'):
+        kwargs['progress'] = functools.partial(report_progress, ticker)
+    return fn(ticker, *args, **kwargs)
+
+
+def predict(ticker):
+    """
+    Predict one ticker, reusing the models trained on the same data cutoff
+    date when the model module supports the train/forecast hooks.
+    """
+    global_model = _global_model()
+    if global_model is not None and global_model.covers(ticker):
+        history = _history(ticker)
+        with stage('inference'):
+            result = global_model.predict({ticker: history}).get(ticker)
+        if result is not None:
+            return result
+
+    train = getattr(PredictSuperCode, 'train', None) or _train_candidates_hook()
+    forecast = getattr(PredictSuperCode, 'forecast', None)
+    if train is None or forecast is None:
+        # Data fetch, training and inference all happen inside predict()
+        with stage('predict'):
+            return _call(PredictSuperCode.predict, ticker)
+
+    cutoff = last_close_date()
+    with stage('model_load'):
+        artifacts = model_registry.load(ticker, cutoff)
+    if artifacts is not None:
+        report_progress(ticker, 'model_loaded', cutoff=cutoff.isoformat())
+        models = _exported_models(ticker, cutoff, artifacts)
+        kwargs = {'models': models} if models else {}
+        with stage('inference'):
+            return _call(forecast, ticker, artifacts, **kwargs)
+
+    predictions, dates, mape_values, artifacts, training = _train(ticker, cutoff, train)
+    model_registry.save(ticker, cutoff, artifacts, training)
+    # Export now so the next forecast from these artifacts runs the optimized models
+    with stage('export'):
+        _exported_models(ticker, cutoff, artifacts)
+    return predictions, dates, mape_values
+
+
+def _train(ticker, cutoff, train):
+    """
+    Fine-tune the newest earlier models of the ticker when the model module
+    has a fine_tune hook, falling back to a full retrain when there are none,
+    when the last full retrain is MODEL_FULL_RETRAIN_DAYS old or when the
+    fine-tuned validation MAPE is more than MODEL_FINE_TUNE_MAX_MAPE_INCREASE
+    worse than the last full retrain's.
+
+    Returns train()'s result plus the training record stored with the models.
+    """
+    fine_tune = getattr(PredictSuperCode, 'fine_tune', None)
+    previous = model_registry.latest(ticker, before=cutoff) if fine_tune is not None else None
+    reason = 'no_previous_model'
+    if previous is not None:
+        previous_cutoff, previous_artifacts, previous_training = previous
+        full_retrain_cutoff = previous_training.get('full_retrain_cutoff')
+        baseline_mape = previous_training.get('full_retrain_mape')
+        if full_retrain_cutoff is None or baseline_mape is None:
+            reason = 'no_training_record'
+        elif (cutoff - date.fromisoformat(full_retrain_cutoff)).days >= settings.MODEL_FULL_RETRAIN_DAYS:
+            reason = 'schedule'
+        else:
+            kwargs = {'epochs': settings.MODEL_FINE_TUNE_EPOCHS} if _accepts(fine_tune, 'epochs') else {}
+            report_progress(ticker, 'training_started', kind='fine_tune')
+            with stage('fine_tune'):
+                predictions, dates, mape_values, artifacts = _call(
+                    fine_tune, ticker, previous_artifacts, previous_cutoff, **kwargs)
+            mape = min(mape_values)
+            if mape <= baseline_mape * (1 + settings.MODEL_FINE_TUNE_MAX_MAPE_INCREASE):
+                MODEL_TRAININGS.labels(kind='fine_tune', reason='new_bars').inc()
+                training = {**previous_training, 'kind': 'fine_tune', 'mape': mape}
+                return predictions, dates, mape_values, artifacts, training
+            reason = 'mape_degraded'
+            logger.info(
+                "Fine-tuned %s MAPE %.4f is worse than the last full retrain's %.4f, retraining",
+                ticker, mape, baseline_mape
+            )
+
+    report_progress(ticker, 'training_started', kind='full')
+    with stage('training'):
+        predictions, dates, mape_values, artifacts = _call(_train_candidates_hook() or train, ticker)
+    MODEL_TRAININGS.labels(kind='full', reason=reason).inc()
+    mape = min(mape_values)
+    training = {
+        'kind': 'full',
+        'mape': mape,
+        'full_retrain_cutoff': cutoff.isoformat(),
+        'full_retrain_mape': mape,
+    }
+    return predictions, dates, mape_values, artifacts, training
+
+
+def _train_candidates_hook():
+    """A train() running the candidates in parallel, if the model module has the hooks for it."""
+    prepare = getattr(PredictSuperCode, 'prepare', None)
+    if prepare is None or getattr(PredictSuperCode, 'train_candidate', None) is None:
+        return None
+
+    def train(ticker):
+        with stage('data_prep'):
+            dataset, candidates = _call(prepare, ticker)
+        return candidate_training.train_candidates(ticker, dataset, candidates)
+    return train
+
+
+def _exported_models(ticker, cutoff, artifacts):
+    """
+    The models of `artifacts` exported for settings.PREDICTION_INFERENCE_MODE,
+    exporting them on first use. Returns None when running eagerly.
+    """
+    mode = settings.PREDICTION_INFERENCE_MODE
+    build_models = getattr(PredictSuperCode, 'build_models', None)
+    if mode == 'eager' or build_models is None or not _accepts(PredictSuperCode.forecast, 'models'):
+        return None
+
+    models = {}
+    built = None
+    for model_type in artifacts:
+        model = model_registry.load_exported(ticker, cutoff, model_type, mode)
+        if model is None and not model_registry.export_rejected(ticker, cutoff, model_type, mode):
+            if built is None:
+                built = build_models(ticker, artifacts)
+            if model_type in built:
+                model = _export(ticker, cutoff, model_type, mode, *built[model_type])
+        if model is not None:
+            models[model_type] = model
+    return models
+
+
+def _export(ticker, cutoff, model_type, mode, module, inputs, targets):
+    try:
+        data = inference.export(module, inputs, mode)
+        model = inference.load(data, mode)
+        eager_mape, exported_mape = inference.check_accuracy(module, model, inputs, targets, mode)
+    except ImportError as e:
+        # e.g. onnxruntime is not installed, keep serving eagerly without giving up on the export
+        logger.warning("Cannot export %s %s model for %s: %s", model_type, mode, ticker, e)
+        return None
+    except Exception as e:
+        logger.warning("Rejected %s %s model for %s: %s", model_type, mode, ticker, e)
+        model_registry.reject_export(ticker, cutoff, model_type, mode, str(e))
+        return None
+
+    logger.info(
+        "Exported %s %s model for %s (MAPE %.3f%%, eager %.3f%%)",
+        model_type, mode, ticker, exported_mape, eager_mape
+    )
+    model_registry.save_exported(ticker, cutoff, model_type, mode, data, model)
+    return model
+
+
+def _global_model():
+    if not settings.PREDICTION_GLOBAL_MODEL:
+        return None
+    return global_model_loader.current()
+
+
+def predict_many(tickers):
+    """
+    Predict several tickers at once.
+
+    Returns (outputs, errors): outputs maps ticker -> (predictions, dates,
+    mape_values) and errors maps ticker -> error message, so one bad symbol
+    does not fail the whole batch.
+    """
+    outputs = {}
+    errors = {}
+    if not tickers:
+        return outputs, errors
+
+    global_model = _global_model()
+    if global_model is not None:
+        covered = [ticker for ticker in tickers if global_model.covers(ticker)]
+        if covered:
+            try:
+                histories = {ticker: _history(ticker) for ticker in covered}
+                with stage('inference'):
+                    outputs.update(global_model.predict(histories))
+            except Exception as e:
+                logger.warning("Global model prediction failed, falling back to the per-ticker models: %s", e)
+            tickers = [ticker for ticker in tickers if ticker not in outputs]
+            if not tickers:
+                return outputs, errors
+
+    predict_batch = getattr(PredictSuperCode, 'predict_batch', None)
+    if predict_batch is not None:
+        try:
+            if _accepts(predict_batch, 'histories'):
+                histories = {ticker: _history(ticker) for ticker in tickers}
+                with stage('inference'):
+                    outputs.update(zip(tickers, predict_batch(list(tickers), histories=histories)))
+                return outputs, errors
+            with stage('inference'):
+                outputs.update(zip(tickers, predict_batch(list(tickers))))
+            return outputs, errors
+        except Exception as e:
+            # Fall back to per-ticker predictions so we can tell which symbol failed
+            logger.warning("Batched prediction failed, falling back to per-ticker predictions: %s", e)
+
+    for ticker in tickers:
+        try:
+            outputs[ticker] = predict(ticker)
+        except Exception as e:
+            errors[ticker] = str(e)
+    return outputs, errors
@@ -0,0 +1,296 @@
+"""
+Cross-ticker global model (settings.PREDICTION_GLOBAL_MODEL).
+
+Instead of a model per ticker, one network is trained over many tickers at
+once (manage.py train_global_model) and serves every ticker it was trained
+on, a whole batch of them in one forward pass. Rarely requested tickers then
+cost a forward pass instead of a training run.
+
+Each ticker's log closes are standardised with its own mean and standard
+deviation (computed on the training data and stored with the model), and
+the network gets a learned embedding of the ticker next to the price
+window. Windows are fed relative to their last value and the network
+predicts the change over the next `horizon` business days, so the same
+weights fit tickers trading at very different prices.
+
+The model is stored in the model registry under the GLOBAL_MODEL_KEY
+pseudo-ticker with the per-ticker scalers and validation MAPEs, and served
+with the same (predictions, dates, mape_values) contract as predict().
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import torch
+from django.conf import settings
+
+from .market_calendar import last_close_date
+from .model_store import model_registry
+from .windowing import sliding_windows
+
+logger = logging.getLogger(__name__)
+
+# Registry "ticker" the global model is stored under; real tickers never start with an underscore
+GLOBAL_MODEL_KEY = '_global'
+MODEL_TYPE = 'global'
+
+
+class GlobalForecaster(torch.nn.Module):
+    """LSTM over a window of standardised log closes, with a ticker embedding joined to its last state."""
+
+    def __init__(self, num_tickers, embedding_dim, hidden_size, num_layers, horizon):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(num_tickers, embedding_dim)
+        self.lstm = torch.nn.LSTM(1, hidden_size, num_layers, batch_first=True)
+        self.head = torch.nn.Sequential(
+            torch.nn.Linear(hidden_size + embedding_dim, hidden_size),
+            torch.nn.ReLU(),
+            torch.nn.Linear(hidden_size, horizon),
+        )
+
+    def forward(self, windows, ticker_ids):
+        outputs, _ = self.lstm(windows.unsqueeze(-1))
+        return self.head(torch.cat([outputs[:, -1], self.embedding(ticker_ids)], dim=1))
+
+
+def standardize(closes):
+    """Standardised log closes of a ticker, with the (mean, std) used."""
+    logs = np.log(np.asarray(closes, dtype=np.float64))
+    mean, std = logs.mean(), logs.std()
+    std = std if std > 0 else 1.0
+    return ((logs - mean) / std).astype(np.float32), mean, std
+
+
+def fit(bars_by_ticker, lookback=None, horizon=None, epochs=20, batch_size=512, validation_windows=None,
+        max_history=2520, embedding_dim=8, hidden_size=64, num_layers=1, learning_rate=1e-3, patience=3,
+        seed=0, progress=None):
+    """
+    Train the global model on a dict of ticker -> structured array of bars
+    (see api.price_store). The last `validation_windows` windows of every
+    ticker (default: `horizon`) are held out to pick the best epoch and
+    measure each ticker's MAPE; tickers with too few bars are left out.
+
+    Returns the artifact to store in the model registry.
+    """
+    lookback = lookback or settings.GLOBAL_MODEL_LOOKBACK
+    horizon = horizon or settings.GLOBAL_MODEL_HORIZON
+    validation_windows = validation_windows or horizon
+    length = lookback + horizon
+    min_bars = length + horizon + validation_windows
+
+    tickers, means, stds = [], [], []
+    segments, train_starts, val_starts, train_ids, val_ids = [], [], [], [], []
+    offset = 0
+    for ticker, bars in bars_by_ticker.items():
+        # Adjusted closes, like the Close column predict() gets
+        closes = bars['adj_close'][-max_history:] if max_history else bars['adj_close']
+        if len(closes) < min_bars or not np.all(closes > 0):
+            continue
+        scaled, mean, std = standardize(closes)
+        ticker_id = len(tickers)
+        tickers.append(ticker)
+        means.append(mean)
+        stds.append(std)
+        segments.append(scaled)
+
+        # Window i covers scaled[i:i + length]; validation targets never overlap training ones
+        count = len(scaled) - length + 1
+        val_first = count - validation_windows
+        train_count = val_first - horizon
+        train_starts.append(offset + np.arange(train_count))
+        val_starts.append(offset + np.arange(val_first, count))
+        train_ids.append(np.full(train_count, ticker_id))
+        val_ids.append(np.full(validation_windows, ticker_id))
+        offset += len(scaled)
+
+    if not tickers:
+        raise ValueError(f"No ticker has the {min_bars} bars needed to train the global model")
+
+    series = np.concatenate(segments)
+    # Every window of the concatenated series as a view; only chosen starts are ever copied, one batch at a time
+    windows, _ = sliding_windows(series[:, None], length)
+    windows = windows[:, :, 0]
+    train_starts, train_ids = np.concatenate(train_starts), np.concatenate(train_ids)
+    val_starts, val_ids = np.concatenate(val_starts), np.concatenate(val_ids)
+
+    config = {
+        'lookback': lookback,
+        'horizon': horizon,
+        'embedding_dim': embedding_dim,
+        'hidden_size': hidden_size,
+        'num_layers': num_layers,
+    }
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    model = GlobalForecaster(len(tickers), embedding_dim, hidden_size, num_layers, horizon)
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    loss_fn = torch.nn.MSELoss()
+
+    def batch(starts, ids):
+        chosen = windows[starts]
+        last = chosen[:, lookback - 1:lookback]
+        return (
+            torch.from_numpy(chosen[:, :lookback] - last),
+            torch.from_numpy(ids),
+            torch.from_numpy(chosen[:, lookback:] - last),
+        )
+
+    def validate():
+        model.eval()
+        losses, predicted = [], []
+        with torch.no_grad():
+            for i in range(0, len(val_starts), batch_size):
+                inputs, ids, targets = batch(val_starts[i:i + batch_size], val_ids[i:i + batch_size])
+                outputs = model(inputs, ids)
+                losses.append(loss_fn(outputs, targets).item() * len(ids))
+                predicted.append(outputs.numpy())
+        model.train()
+        return sum(losses) / len(val_starts), np.concatenate(predicted)
+
+    best_loss, best_state, best_predicted, stale = np.inf, None, None, 0
+    for epoch in range(1, epochs + 1):
+        order = rng.permutation(len(train_starts))
+        for i in range(0, len(order), batch_size):
+            chosen = order[i:i + batch_size]
+            inputs, ids, targets = batch(train_starts[chosen], train_ids[chosen])
+            optimizer.zero_grad()
+            loss = loss_fn(model(inputs, ids), targets)
+            loss.backward()
+            optimizer.step()
+
+        val_loss, predicted = validate()
+        if progress is not None:
+            progress(epoch, epochs, val_loss)
+        if val_loss < best_loss:
+            best_loss, stale = val_loss, 0
+            best_state = {name: value.detach().clone() for name, value in model.state_dict().items()}
+            best_predicted = predicted
+        else:
+            stale += 1
+            if stale >= patience:
+                break
+
+    means, stds = np.array(means), np.array(stds)
+    mapes = _validation_mapes(windows, val_starts, val_ids, best_predicted, lookback, means, stds, len(tickers))
+    return {
+        'state_dict': best_state,
+        'tickers': tickers,
+        'mean': torch.from_numpy(means),
+        'std': torch.from_numpy(stds),
+        'mape': torch.from_numpy(mapes),
+        'config': config,
+    }
+
+
+def _validation_mapes(windows, starts, ids, predicted, lookback, means, stds, num_tickers):
+    """MAPE (as a fraction, like predict()'s mape_values) of each ticker's validation windows, in prices."""
+    windows = windows[starts].astype(np.float64)
+    last = windows[:, lookback - 1:lookback]
+    mean, std = means[ids][:, None], stds[ids][:, None]
+    actual = np.exp(windows[:, lookback:] * std + mean)
+    forecast = np.exp((predicted + last) * std + mean)
+    errors = np.abs(forecast - actual) / actual
+    return np.bincount(ids, errors.mean(axis=1), minlength=num_tickers) / np.bincount(ids, minlength=num_tickers)
+
+
+class GlobalModel:
+    """A trained global model ready to predict the tickers it was trained on."""
+
+    def __init__(self, cutoff, artifact):
+        self.cutoff = cutoff
+        config = artifact['config']
+        self.lookback = config['lookback']
+        self.horizon = config['horizon']
+        self.ticker_ids = {ticker: i for i, ticker in enumerate(artifact['tickers'])}
+        self.means = artifact['mean'].numpy()
+        self.stds = artifact['std'].numpy()
+        self.mapes = artifact['mape'].numpy()
+        self.module = GlobalForecaster(
+            len(self.ticker_ids), config['embedding_dim'], config['hidden_size'], config['num_layers'], self.horizon)
+        self.module.load_state_dict(artifact['state_dict'])
+        self.module.eval()
+
+    def covers(self, ticker):
+        return ticker in self.ticker_ids
+
+    def predict(self, histories):
+        """
+        Predict a dict of ticker -> price history (DataFrame with a Close
+        column, as given to predict()) in one forward pass. Returns a dict of
+        ticker -> (predictions, dates, mape_values) for the tickers this
+        model covers and has enough history for; the others are left out.
+        """
+        tickers, windows = [], []
+        for ticker, history in histories.items():
+            if not self.covers(ticker) or history is None or len(history) < self.lookback:
+                continue
+            ticker_id = self.ticker_ids[ticker]
+            closes = history['Close'].to_numpy(dtype=np.float64)[-self.lookback:]
+            if not np.all(closes > 0):
+                continue
+            tickers.append(ticker)
+            windows.append((np.log(closes) - self.means[ticker_id]) / self.stds[ticker_id])
+        if not tickers:
+            return {}
+
+        windows = np.array(windows, dtype=np.float32)
+        last = windows[:, -1:]
+        ids = np.array([self.ticker_ids[ticker] for ticker in tickers])
+        with torch.inference_mode():
+            changes = self.module(torch.from_numpy(windows - last), torch.from_numpy(ids)).numpy()
+
+        scaled = changes.astype(np.float64) + last
+        prices = np.exp(scaled * self.stds[ids][:, None] + self.means[ids][:, None])
+        results = {}
+        for row, ticker in enumerate(tickers):
+            last_date = histories[ticker].index[-1]
+            dates = pd.bdate_range(last_date + pd.Timedelta(days=1), periods=self.horizon)
+            results[ticker] = (prices[row], dates, [float(self.mapes[ids[row]])])
+        return results
+
+
+class GlobalModelLoader:
+    """
+    The newest global model in the registry, loaded once per process. The
+    registry is checked again at most every `check_interval` seconds so a
+    retrained model is picked up without a restart. Models trained more than
+    settings.GLOBAL_MODEL_MAX_AGE_DAYS before the last close are not served.
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._model = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                    self._checked_at = now
+                    self._load()
+        return self._model
+
+    def _load(self):
+        cutoff = last_close_date()
+        latest = model_registry.latest(GLOBAL_MODEL_KEY, before=cutoff + timedelta(days=1))
+        if latest is None or (cutoff - latest[0]).days > settings.GLOBAL_MODEL_MAX_AGE_DAYS:
+            self._model = None
+            return
+        model_cutoff, artifacts, _ = latest
+        if self._model is not None and self._model.cutoff == model_cutoff:
+            return
+        try:
+            self._model = GlobalModel(model_cutoff, artifacts[MODEL_TYPE])
+        except Exception as e:
+            logger.warning("Cannot load the global model trained on %s: %s", model_cutoff, e)
+            self._model = None
+            return
+        logger.info("Loaded the global model trained on %s (%d tickers)", model_cutoff, len(self._model.ticker_ids))
+
+
+global_model_loader = GlobalModelLoader(check_interval=60)
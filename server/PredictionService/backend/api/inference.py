@@ -0,0 +1,133 @@
+"""
+Optimized CPU inference for the prediction models.
+
+A trained model (an nn.Module rebuilt from its registry artifact) can be
+exported as
+
+    torchscript  traced and frozen TorchScript
+    quantized    dynamic int8 quantization of its LSTM/GRU/Linear layers, then traced
+    onnx         ONNX graph run by onnxruntime (needs the optional onnx and onnxruntime packages)
+
+Every export is checked against the eager model on the validation window:
+if its MAPE is more than PREDICTION_EXPORT_MAX_MAPE_DRIFT percentage points
+away from the eager model's, it is rejected and the eager model is used.
+"""
+import io
+import os
+import warnings
+
+import numpy as np
+import torch
+from django.conf import settings
+
+INFERENCE_MODES = ('eager', 'torchscript', 'quantized', 'onnx')
+
+# Layers replaced by their int8 counterparts in quantized mode
+QUANTIZED_LAYERS = {torch.nn.LSTM, torch.nn.GRU, torch.nn.Linear}
+
+
+class AccuracyDriftError(Exception):
+    """An exported model's error is too far from the eager model's."""
+
+    def __init__(self, mode, eager_mape, exported_mape):
+        self.mode = mode
+        self.eager_mape = eager_mape
+        self.exported_mape = exported_mape
+        super().__init__(
+            f"{mode} model MAPE {exported_mape:.3f}% drifts from eager MAPE {eager_mape:.3f}%"
+        )
+
+
+def set_torch_threads(num_threads=None):
+    """Limit torch's intra-op threads for this process (settings.TORCH_NUM_THREADS)."""
+    num_threads = num_threads or settings.TORCH_NUM_THREADS
+    if num_threads and torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+
+
+def mape(predictions, targets):
+    """Mean absolute percentage error, in percent."""
+    predictions = _to_numpy(predictions).reshape(-1)
+    targets = _to_numpy(targets).reshape(-1)
+    return float(np.mean(np.abs((targets - predictions) / targets)) * 100)
+
+
+def export(module, example_inputs, mode):
+    """
+    Export an eager module for `mode`. Returns the serialized model as bytes,
+    to be stored in the model registry and loaded with load().
+    """
+    module = module.eval()
+    if mode == 'onnx':
+        buffer = io.BytesIO()
+        torch.onnx.export(
+            module, (example_inputs,), buffer,
+            input_names=['input'], output_names=['output'],
+            dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+            dynamo=False,
+        )
+        return buffer.getvalue()
+
+    if mode == 'quantized':
+        module = torch.ao.quantization.quantize_dynamic(module, QUANTIZED_LAYERS, dtype=torch.qint8)
+    elif mode != 'torchscript':
+        raise ValueError(f"Unknown inference mode: {mode}")
+
+    with warnings.catch_warnings(), torch.inference_mode():
+        # torch.jit is deprecated upstream but still the only CPU format loadable without the model code
+        warnings.simplefilter('ignore', FutureWarning)
+        traced = torch.jit.trace(module, example_inputs)
+        if mode == 'torchscript':
+            traced = torch.jit.freeze(traced)
+        buffer = io.BytesIO()
+        torch.jit.save(traced, buffer)
+    return buffer.getvalue()
+
+
+def load(data, mode):
+    """Rebuild a callable model from export() bytes."""
+    if mode == 'onnx':
+        return OnnxModel(data)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        return torch.jit.load(io.BytesIO(data), map_location='cpu').eval()
+
+
+def check_accuracy(eager, exported, inputs, targets, mode, max_drift=None):
+    """
+    Compare the exported model with the eager one on a validation window.
+    Returns (eager_mape, exported_mape), raising AccuracyDriftError when the
+    difference is over max_drift percentage points.
+    """
+    if max_drift is None:
+        max_drift = settings.PREDICTION_EXPORT_MAX_MAPE_DRIFT
+    with torch.inference_mode():
+        eager_mape = mape(eager.eval()(inputs), targets)
+        exported_mape = mape(exported(inputs), targets)
+    if abs(exported_mape - eager_mape) > max_drift:
+        raise AccuracyDriftError(mode, eager_mape, exported_mape)
+    return eager_mape, exported_mape
+
+
+class OnnxModel:
+    """onnxruntime session with the call signature of a single-input nn.Module."""
+
+    def __init__(self, data):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = settings.TORCH_NUM_THREADS or os.cpu_count()
+        self.session = onnxruntime.InferenceSession(data, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, inputs):
+        outputs = self.session.run(None, {'input': _to_numpy(inputs).astype(np.float32)})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+
+def _to_numpy(values):
+    if isinstance(values, torch.Tensor):
+        return values.detach().cpu().numpy()
+    return np.asarray(values)
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_INVALIDATION_CHANNEL = 'prediction_cache_invalidate'
+
+
+class LocalCache:
+    """
+    Per-process LRU in front of a shared store (Redis, MongoDB).
+
+    Whoever changes an entry in the shared store publishes its key on
+    `channel` and every process drops its copy; entries also expire after
+    `ttl` seconds in case a message was missed. To keep a value read just
+    before an invalidation from being cached after it, read generation()
+    before reading the store and pass it to set(): the value is dropped if
+    its key was invalidated in between, while fills of other keys go ahead.
+    """
+
+    def __init__(self, channel, max_size, ttl):
+        self.channel = channel
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; generation() is its value when a read started
+        self._generation = 0
+        # Key -> generation of its last invalidation, oldest first, at most max_size of them
+        self._invalidated = OrderedDict()
+        # Generation of the last clear() or of the newest invalidation dropped from _invalidated
+        self._forgotten = 0
+        self._subscriber_pid = None
+
+    def get(self, key):
+        if not self.max_size:
+            return None
+        self._ensure_subscribed()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self):
+        return self._generation
+
+    def set(self, key, value, generation=None):
+        if not self.max_size:
+            return
+        self._ensure_subscribed()
+        with self._lock:
+            if generation is not None and (
+                    generation < self._forgotten or generation < self._invalidated.get(key, 0)):
+                # Invalidated while the value was being read, it may be outdated
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                # Fills that started before a forgotten invalidation are dropped, whatever their key
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._forgotten = self._generation
+            self._invalidated.clear()
+            self._entries.clear()
+
+    def publish_invalidation(self, keys):
+        """Tell every process (this one included) to drop its copy of `keys`."""
+        if not keys:
+            return
+        try:
+            get_redis_connection('default').publish(self.channel, json.dumps([str(key) for key in keys]))
+        except Exception as e:
+            logger.warning("Failed to publish an invalidation on %s: %s", self.channel, e)
+
+    def _ensure_subscribed(self):
+        # One listener thread per process; checked by pid so forked children start their own
+        if self._subscriber_pid == os.getpid():
+            return
+        with self._lock:
+            if self._subscriber_pid == os.getpid():
+                return
+            self._subscriber_pid = os.getpid()
+            # Whatever a parent process cached was never covered by this process' listener
+            self._entries.clear()
+        threading.Thread(target=self._listen, name=f'{self.channel}-listener', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not subscribed is lost, start from scratch
+                self.clear()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.invalidate(json.loads(message['data']))
+            except Exception as e:
+                logger.warning("Invalidation listener of %s failed, resubscribing: %s", self.channel, e)
+                self.clear()
+                time.sleep(1)
+
+
+class LocalPredictionCache(LocalCache):
+    """
+    Decoded prediction results by ticker. Entries remember the Redis key
+    they were read under, so a new model version or market close misses
+    here as it does in Redis. The writer of a prediction publishes the
+    ticker (api.prediction_cache.set_cached_predictions).
+    """
+
+    def get(self, ticker, cache_key):
+        entry = super().get(ticker)
+        if entry is None or entry[0] != cache_key:
+            return None
+        # Callers may add fields (e.g. the stale flag), never to the shared copy
+        return dict(entry[1])
+
+    def set(self, ticker, cache_key, result, generation=None):
+        super().set(ticker, (cache_key, result), generation)
+
+
+local_prediction_cache = LocalPredictionCache(
+    PREDICTION_INVALIDATION_CHANNEL,
+    max_size=settings.PREDICTION_LOCAL_CACHE_SIZE,
+    ttl=settings.PREDICTION_LOCAL_CACHE_TTL,
+)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+
+from api.price_store import price_store
+from api.symbols import add_universe_arguments, universe_from_options
+
+
+class Command(BaseCommand):
+    help = 'Download missing daily bars for a list of symbols into the local price store'
+
+    def add_arguments(self, parser):
+        add_universe_arguments(parser)
+        parser.add_argument('--full', action='store_true',
+                            help='Re-download the whole history instead of appending (e.g. after a bad download)')
+        # Downloads are network-bound, threads are enough
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent downloads')
+
+    def handle(self, *args, **options):
+        tickers = universe_from_options(options, stderr=self.stderr)
+        self.stdout.write(f"Backfilling {len(tickers)} tickers into {price_store.root}")
+
+        started = time.monotonic()
+        bars = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(price_store.refresh, ticker, options['full']): ticker for ticker in tickers}
+            for completed, future in enumerate(as_completed(futures), start=1):
+                ticker = futures[future]
+                try:
+                    bars += future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Failed to backfill {ticker}: {e}")
+                if completed % 100 == 0:
+                    self.stdout.write(f"Backfilled {completed}/{len(tickers)} tickers")
+
+        self.stdout.write(
+            f"Backfill finished: {len(tickers) - failed} ok, {failed} failed, "
+            f"{bars} new bars in {time.monotonic() - started:.1f}s"
+        )
@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from api.backtest import backtest_tickers, walk_forward_cutoffs
+from api.compute_pool import init_worker, pool_context
+from api.market_calendar import last_close_date
+from api.symbols import add_universe_arguments, universe_from_options
+
+
+class Command(BaseCommand):
+    help = 'Walk-forward backtest of the prediction model over the symbol universe, from the local price store'
+
+    def add_arguments(self, parser):
+        add_universe_arguments(parser, top=0)
+        parser.add_argument('--start', type=date.fromisoformat, help='First cutoff date (default: one year before --end)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last cutoff date (default: the last close)')
+        parser.add_argument('--step', type=int, default=21, help='Business days between cutoffs')
+        parser.add_argument('--min-history', type=int, default=250, help='Bars a ticker needs before its first cutoff')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--chunk-size', type=int, default=16,
+                            help='Tickers per task, predicted together at each cutoff when the model supports batches')
+        parser.add_argument('--output', help='Write per-ticker results and the summary as JSON to this file')
+
+    def handle(self, *args, **options):
+        # The model code imports torch, only pay for it when running
+        from api.forecaster import _accepts
+        from api.ml_model import PredictSuperCode
+
+        if not _accepts(PredictSuperCode.predict, 'history'):
+            raise CommandError("Backtests need a model whose predict() takes a history keyword argument")
+
+        end = options['end'] or last_close_date()
+        start = options['start'] or end - timedelta(days=365)
+        cutoffs = walk_forward_cutoffs(start, end, options['step'])
+        tickers = universe_from_options(options, stderr=self.stderr)
+        if not tickers or not len(cutoffs):
+            raise CommandError("Nothing to backtest: no tickers or no cutoff dates in range")
+
+        chunks = [tickers[i:i + options['chunk_size']] for i in range(0, len(tickers), options['chunk_size'])]
+        self.stdout.write(
+            f"Backtesting {len(tickers)} tickers at {len(cutoffs)} cutoffs from {cutoffs[0]} to {cutoffs[-1]} "
+            f"with {options['workers']} workers"
+        )
+
+        started = time.monotonic()
+        results = {}
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=pool_context(), initializer=init_worker) as executor:
+            futures = {
+                executor.submit(backtest_tickers, chunk, cutoffs, options['min_history']): chunk
+                for chunk in chunks
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                try:
+                    results.update(future.result())
+                except Exception as e:
+                    failed += len(futures[future])
+                    self.stderr.write(f"Failed to backtest {', '.join(futures[future])}: {e}")
+                if completed % 10 == 0:
+                    self.stdout.write(f"Backtested {completed}/{len(chunks)} chunks")
+        elapsed = time.monotonic() - started
+
+        summary = self._summarize(results, elapsed, failed)
+        self.stdout.write(
+            f"Backtest finished: {summary['tickers_scored']} tickers, {summary['windows']} windows in {elapsed:.1f}s "
+            f"({summary['windows_per_s']:.2f} windows/s, {summary['tickers_per_s']:.2f} tickers/s)\n"
+            f"MAPE mean {summary['mape_mean']}%, median {summary['mape_median']}% "
+            f"(naive {summary['naive_mape_mean']}%)"
+        )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'cutoffs': [str(cutoff) for cutoff in cutoffs],
+                    'summary': summary,
+                    'tickers': results,
+                }, f, indent=2)
+
+    def _summarize(self, results, elapsed, failed):
+        scored = {ticker: result for ticker, result in results.items() if result['mape'] is not None}
+        mapes = np.array([result['mape'] for result in scored.values()])
+        naive = np.array([result['naive_mape'] for result in scored.values()])
+        windows = sum(result['windows'] for result in scored.values())
+
+        def rounded(values, reduce):
+            return round(float(reduce(values)), 3) if len(values) else None
+
+        return {
+            'tickers': len(results) + failed,
+            'tickers_scored': len(scored),
+            'tickers_failed': failed,
+            'windows': windows,
+            'prediction_errors': sum(result['errors'] for result in results.values()),
+            'wall_time_s': round(elapsed, 3),
+            'windows_per_s': round(windows / elapsed, 2) if elapsed else 0.0,
+            'tickers_per_s': round(len(results) / elapsed, 2) if elapsed else 0.0,
+            'mape_mean': rounded(mapes, np.mean),
+            'mape_median': rounded(mapes, np.median),
+            'naive_mape_mean': rounded(naive, np.mean),
+        }
@@ -1,119 +1,183 @@
 from django.core.management.base import BaseCommand
-from confluent_kafka import Consumer, KafkaError
+from confluent_kafka import Consumer, KafkaError, TopicPartition
+from pymongo import UpdateOne
 import json
+import logging
+import time
 from datetime import datetime
 
 from django.conf import settings
 
+from api.db_connection import ensure_indexes, get_collection
+from api.metrics import KAFKA_BATCH_SECONDS, KAFKA_BATCH_SIZE, KAFKA_LAG, KAFKA_MESSAGES
 from api.models import UserPrediction, SubscriptionDetails, PredictionUsage
+from api.subscription_cache import invalidate_user_predictions
 
-user_prediction_collection = settings.DB['user_prediction']
+logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Consume Kafka messages from prediction topic'
 
-    
-    def handle(self, *args, **kwargs):
-        self.stdout.write("Starting Kafka consumer...")
-        self.stdout.write(f"Using Kafka bootstrap servers: {settings.KAFKA_BOOTSTRAP_SERVERS}")
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Maximum number of messages written per bulk_write')
+        parser.add_argument('--batch-timeout', type=float, default=1.0,
+                            help='Seconds to wait for a batch to fill up')
+        parser.add_argument('--report-interval', type=float, default=30.0,
+                            help='Seconds between throughput / lag reports')
+
+    def handle(self, *args, **options):
+        logger.info("Starting Kafka consumer, bootstrap servers: %s", settings.KAFKA_BOOTSTRAP_SERVERS)
         conf = {
             'bootstrap.servers': settings.KAFKA_BOOTSTRAP_SERVERS,
             'group.id': settings.KAFKA_CONSUMER_GROUP_ID,
-            'auto.offset.reset': 'earliest'
+            'auto.offset.reset': 'earliest',
+            # Offsets are committed only once a batch is written to MongoDB
+            'enable.auto.commit': False,
         }
 
+        ensure_indexes()
         consumer = Consumer(conf)
         topic = settings.KAFKA_PREDICTION_TOPIC
 
         consumer.subscribe([topic])
-        
-        self.stdout.write(f'Started consuming topic: {topic}')
+
+        logger.info("Started consuming topic: %s", topic)
+
+        batch_size = options['batch_size']
+        report_interval = options['report_interval']
+        processed = 0
+        batches = 0
+        last_report = time.monotonic()
 
         try:
             while True:
-                msg = consumer.poll(1.0)  
-                if msg is None:
-                    continue
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        # End of partition event
-                        continue
-                    else:
-                        self.stderr.write(f"Error: {msg.error()}")
-                        break
-                
-                message_value = msg.value().decode('utf-8')
-                data = json.loads(message_value)
-
-                user_id = data.get('userId')
-                subscription_plan_id = data.get('subscriptionPlanId', None)
-                start_date = data.get('startDate')
-                end_date = data.get('endDate')
-                subscription_plan_type = data.get('subscriptionPlanType')
-
-                self.stdout.write(f"Received message for user_id: {user_id}, subscription_plan_id: {subscription_plan_id}")
-                # Validate required fields
-                if not all([user_id, subscription_plan_id, start_date, end_date, subscription_plan_type]):
-                    self.stderr.write("Missing required fields in the message")
-                    continue
-                # Convert dates from string to datetime if necessary
-                try:
-                    start_date = datetime.fromisoformat(start_date)
-                    end_date = datetime.fromisoformat(end_date)
-                except ValueError as e:
-                    self.stderr.write(f"Invalid date format: {e}")
-                    continue
-                # Ensure subscription_plan_type is valid
-                if subscription_plan_type not in ['free', 'premium']:
-                    self.stderr.write(f"Invalid subscription plan type: {subscription_plan_type}")
+                messages = consumer.consume(num_messages=batch_size, timeout=options['batch_timeout'])
+                if not messages:
                     continue
 
-                self.stdout.write(f"Processing user_id: {user_id}, subscription_plan_id: {subscription_plan_id}, start_date: {start_date}, end_date: {end_date}, subscription_plan_type: {subscription_plan_type}")
-
-                # Store the data in the UserPrediction model
-                subscription_details_instance = SubscriptionDetails(
-                    subscription_plan_id = subscription_plan_id,
-                    subscription_plan_type = subscription_plan_type,
-                    start_date = start_date,
-                    end_date = end_date,
-                    daily_limit = -1 if subscription_plan_type == 'premium' else 5
+                batch_started = time.monotonic()
+                # Later events for the same user override earlier ones, so keep only the last one
+                latest_by_user = {}
+                fatal_error = None
+                for msg in messages:
+                    if msg.error():
+                        if msg.error().code() == KafkaError._PARTITION_EOF:
+                            # End of partition event
+                            continue
+                        fatal_error = msg.error()
+                        break
+                    subscription = self._parse_message(msg)
+                    if subscription is not None:
+                        latest_by_user[subscription['user_id']] = subscription
+
+                if fatal_error is not None:
+                    # Nothing from this batch is committed, it is re-read after a restart
+                    logger.error("Kafka error: %s", fatal_error)
+                    break
+
+                if latest_by_user:
+                    self._write_batch(latest_by_user.values())
+                    # API workers drop their cached plan of these users
+                    invalidate_user_predictions(list(latest_by_user))
+                consumer.commit(asynchronous=False)
+
+                batch_seconds = time.monotonic() - batch_started
+                processed += len(messages)
+                batches += 1
+                KAFKA_MESSAGES.inc(len(messages))
+                KAFKA_BATCH_SIZE.observe(len(messages))
+                KAFKA_BATCH_SECONDS.observe(batch_seconds)
+                logger.debug(
+                    "Wrote batch of %d messages (%d users) in %.1fms",
+                    len(messages), len(latest_by_user), batch_seconds * 1000
                 )
 
-                user_prediction = user_prediction_collection.find_one({'user_id': user_id})
-
-                self.stdout.write(f"UserPrediction found: {user_prediction}")
-                if user_prediction:
-                    # Update existing UserPrediction
-                    self.stdout.write(f"Updating UserPrediction for user_id: {user_id}")
-                    user_prediction_collection.update_one(
-                        {'user_id': user_id},
-                        {'$set': {
-                            'subscription_details': subscription_details_instance.to_mongo(),
-                            'updated_at': datetime.now()
-                        }}
+                elapsed = time.monotonic() - last_report
+                if elapsed >= report_interval:
+                    lag = self._lag(consumer)
+                    KAFKA_LAG.set(lag)
+                    logger.info(
+                        "Consumed %d messages in %d batches (%.1f msg/s), lag: %d",
+                        processed, batches, processed / elapsed, lag
                     )
-                else:
-                    # Create new UserPrediction
-                    self.stdout.write(f"Creating new UserPrediction for user_id: {user_id}")
-                    prediction_usage = PredictionUsage()
-                    user_prediction_collection.insert_one({
-                        'user_id': user_id,
-                        'prediction_usage': prediction_usage.to_mongo(),
-                        'subscription_details': subscription_details_instance.to_mongo(),
-                        'created_at': datetime.now(),
-                        'updated_at': datetime.now()
-                    })
-
-                
-                # Log the creation or update of the UserPrediction
-                self.stdout.write(f"UserPrediction created or updated for user_id: {user_id}")
-
-                # Process the data - e.g., create or update a Django model
-                self.stdout.write(f"Received message: {data}")
+                    processed = 0
+                    batches = 0
+                    last_report = time.monotonic()
 
         except KeyboardInterrupt:
-            self.stdout.write("Stopping consumer...")
+            logger.info("Stopping consumer...")
         finally:
             consumer.close()
-            self.stdout.write("Consumer closed.")
-        
+            logger.info("Consumer closed.")
+
+    def _parse_message(self, msg):
+        try:
+            data = json.loads(msg.value().decode('utf-8'))
+        except ValueError as e:
+            logger.warning("Invalid message at offset %s: %s", msg.offset(), e)
+            return None
+
+        user_id = data.get('userId')
+        subscription_plan_id = data.get('subscriptionPlanId', None)
+        start_date = data.get('startDate')
+        end_date = data.get('endDate')
+        subscription_plan_type = data.get('subscriptionPlanType')
+
+        # Validate required fields
+        if not all([user_id, subscription_plan_id, start_date, end_date, subscription_plan_type]):
+            logger.warning("Missing required fields in the message at offset %s", msg.offset())
+            return None
+        # Convert dates from string to datetime if necessary
+        try:
+            start_date = datetime.fromisoformat(start_date)
+            end_date = datetime.fromisoformat(end_date)
+        except ValueError as e:
+            logger.warning("Invalid date format: %s", e)
+            return None
+        # Ensure subscription_plan_type is valid
+        if subscription_plan_type not in ['free', 'premium']:
+            logger.warning("Invalid subscription plan type: %s", subscription_plan_type)
+            return None
+
+        subscription_details_instance = SubscriptionDetails(
+            subscription_plan_id = subscription_plan_id,
+            subscription_plan_type = subscription_plan_type,
+            start_date = start_date,
+            end_date = end_date,
+            daily_limit = -1 if subscription_plan_type == 'premium' else 5
+        )
+        return {
+            'user_id': user_id,
+            'subscription_details': subscription_details_instance.to_mongo(),
+        }
+
+    def _write_batch(self, subscriptions):
+        now = datetime.now()
+        get_collection('user_prediction').bulk_write([
+            UpdateOne(
+                {'user_id': subscription['user_id']},
+                {
+                    '$set': {
+                        'subscription_details': subscription['subscription_details'],
+                        'updated_at': now
+                    },
+                    # Only new UserPredictions start with empty usage
+                    '$setOnInsert': {
+                        'prediction_usage': PredictionUsage().to_mongo(),
+                        'created_at': now
+                    }
+                },
+                upsert=True
+            )
+            for subscription in subscriptions
+        ], ordered=False)
+
+    def _lag(self, consumer):
+        # Messages left between our position and the end of each assigned partition
+        lag = 0
+        for position in consumer.position(consumer.assignment()):
+            _, high = consumer.get_watermark_offsets(TopicPartition(position.topic, position.partition), timeout=5)
+            if position.offset >= 0 and high >= 0:
+                lag += high - position.offset
+        return lag
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+import time
+
+from api.db_connection import ensure_indexes, get_collection
+from api.quota import quota_ledger
+
+
+class Command(BaseCommand):
+    help = 'Write prediction quota usage counted in Redis back to MongoDB'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between flushes')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users written per bulk_write')
+        parser.add_argument('--once', action='store_true', help='Flush once and exit')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Starting quota usage flusher...")
+        ensure_indexes()
+        try:
+            while True:
+                try:
+                    flushed = quota_ledger.flush(get_collection('user_prediction'), batch_size=options['batch_size'])
+                    if flushed:
+                        self.stdout.write(f"Flushed quota usage for {flushed} users")
+                except Exception as e:
+                    self.stderr.write(f"Failed to flush quota usage: {e}")
+                    if options['once']:
+                        raise
+
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping quota usage flusher...")
+        finally:
+            # Do not lose the last interval's usage on shutdown
+            if not options['once']:
+                quota_ledger.flush(get_collection('user_prediction'), batch_size=options['batch_size'])
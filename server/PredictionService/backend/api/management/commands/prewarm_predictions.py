@@ -0,0 +1,123 @@
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from api.compute_pool import compute_prediction, init_worker, pool_context
+from api.market_calendar import is_session
+from api.prediction_cache import get_cached_predictions, set_cached_predictions
+from api.symbols import add_universe_arguments, universe_from_options
+
+
+class Command(BaseCommand):
+    help = 'Precompute predictions for the hot symbol universe and write them to the prediction cache'
+
+    def add_arguments(self, parser):
+        add_universe_arguments(parser)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--skip-cached', action='store_true', help='Skip tickers that already have a cached prediction')
+        parser.add_argument('--checkpoint', default=settings.PREWARM_CHECKPOINT_FILE, help='Progress file used by --resume')
+        parser.add_argument('--resume', action='store_true', help="Skip tickers already done in today's checkpoint")
+        parser.add_argument('--daily-at', metavar='HH:MM',
+                            help='Keep running and pre-warm every weekday at this UTC time (after market close)')
+
+    def handle(self, *args, **options):
+        if not options['daily_at']:
+            self._run(options)
+            return
+
+        try:
+            run_at = datetime.strptime(options['daily_at'], '%H:%M').time()
+        except ValueError:
+            raise CommandError(f"Invalid --daily-at time: {options['daily_at']}")
+
+        while True:
+            next_run = self._next_run(run_at)
+            self.stdout.write(f"Next pre-warm run at {next_run.isoformat()}")
+            time.sleep(max(0, (next_run - datetime.now(timezone.utc)).total_seconds()))
+            try:
+                self._run(options)
+            except Exception as e:
+                self.stderr.write(f"Pre-warm run failed: {e}")
+
+    def _next_run(self, run_at):
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=run_at.hour, minute=run_at.minute, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        # No session (weekend or exchange holiday), nothing new to predict
+        while not is_session(next_run.date()):
+            next_run += timedelta(days=1)
+        return next_run
+
+    def _run(self, options):
+        run_date = datetime.now(timezone.utc).date().isoformat()
+        tickers = universe_from_options(options, stderr=self.stderr)
+
+        checkpoint = self._load_checkpoint(options['checkpoint'], run_date) if options['resume'] else None
+        if checkpoint is None:
+            checkpoint = {'run_date': run_date, 'done': [], 'failed': {}}
+        done = set(checkpoint['done'])
+        tickers = [ticker for ticker in tickers if ticker not in done]
+
+        if options['skip_cached']:
+            cached = get_cached_predictions(tickers)
+            tickers = [ticker for ticker in tickers if ticker not in cached]
+
+        self.stdout.write(f"Pre-warming {len(tickers)} tickers with {options['workers']} workers ({len(done)} already done)")
+        if not tickers:
+            return
+
+        started = time.monotonic()
+        completed = 0
+        failed = 0
+        context = pool_context()
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=context, initializer=init_worker) as executor:
+            futures = {executor.submit(compute_prediction, ticker): ticker for ticker in tickers}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, str(e)
+                completed += 1
+                if error is None:
+                    set_cached_predictions({ticker: result})
+                    checkpoint['done'].append(ticker)
+                    checkpoint['failed'].pop(ticker, None)
+                else:
+                    self.stderr.write(f"Failed to pre-warm {ticker}: {error}")
+                    failed += 1
+                    checkpoint['failed'][ticker] = error
+                self._save_checkpoint(options['checkpoint'], checkpoint)
+
+                if completed % 50 == 0:
+                    self.stdout.write(f"Pre-warmed {completed}/{len(tickers)} tickers")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Pre-warm finished: {completed - failed} ok, {failed} failed "
+            f"in {elapsed:.1f}s ({completed / elapsed:.2f} tickers/s)"
+        )
+
+    def _load_checkpoint(self, path, run_date):
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # A checkpoint from an earlier day is for older market data, start over
+        if checkpoint.get('run_date') != run_date:
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, path, checkpoint):
+        # Write-then-rename so an interrupted run never leaves a truncated checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+
+from django.conf import settings
+
+from api.compute_pool import compute_prediction, init_worker, pool_context
+from api.prediction_cache import get_cached_prediction, set_cached_predictions
+from api.prediction_jobs import prediction_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run queued prediction jobs (POST /api/v1/prediction/jobs/), premium users first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.PREDICTION_JOB_WORKERS,
+                            help='Number of worker processes')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        logger.info("Running prediction jobs with %d workers", workers)
+
+        context = pool_context()
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as executor:
+            try:
+                while True:
+                    # Only take jobs off the queue when a worker is free, so a premium job
+                    # queued later still overtakes free jobs that are waiting
+                    while len(in_flight) < workers:
+                        job = prediction_jobs.pop(timeout=0.1 if in_flight else 1)
+                        if job is None:
+                            break
+                        job_id, ticker = job
+                        cached_result = get_cached_prediction(ticker)
+                        if cached_result:
+                            prediction_jobs.finish(job_id, ticker, result=cached_result)
+                            continue
+                        in_flight[executor.submit(compute_prediction, ticker)] = job
+
+                    if not in_flight:
+                        continue
+                    done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id, ticker = in_flight.pop(future)
+                        self._finish(future, job_id, ticker)
+            except KeyboardInterrupt:
+                logger.info("Stopping, waiting for %d running jobs...", len(in_flight))
+                for future in list(in_flight):
+                    job_id, ticker = in_flight.pop(future)
+                    self._finish(future, job_id, ticker)
+
+    def _finish(self, future, job_id, ticker):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning("Prediction job %s for %s failed: %s", job_id, ticker, e)
+            prediction_jobs.finish(job_id, ticker, error=str(e))
+            return
+        set_cached_predictions({ticker: result})
+        prediction_jobs.finish(job_id, ticker, result=result)
+        logger.info("Prediction job %s for %s done", job_id, ticker)
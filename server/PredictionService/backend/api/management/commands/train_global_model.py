@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+import numpy as np
+
+from api.global_model import GLOBAL_MODEL_KEY, MODEL_TYPE, fit
+from api.market_calendar import last_close_date
+from api.model_store import model_registry
+from api.price_store import price_store
+from api.symbols import add_universe_arguments, universe_from_options
+
+
+class Command(BaseCommand):
+    help = 'Train the cross-ticker global model on the local price store (run after backfill_prices)'
+
+    def add_arguments(self, parser):
+        add_universe_arguments(parser)
+        parser.add_argument('--epochs', type=int, default=20, help='Most epochs, training stops earlier once validation stalls')
+        parser.add_argument('--batch-size', type=int, default=512, help='Windows per training batch')
+        parser.add_argument('--max-history', type=int, default=2520, help='Most recent bars used per ticker (0 for all)')
+
+    def handle(self, *args, **options):
+        tickers = universe_from_options(options, stderr=self.stderr)
+        cutoff = last_close_date()
+        # Memory-mapped, only the bars up to the cutoff are read
+        bars_by_ticker = {}
+        for ticker in tickers:
+            bars = price_store.read(ticker)
+            if bars is not None:
+                bars_by_ticker[ticker] = bars[:np.searchsorted(bars['date'], np.datetime64(cutoff), side='right')]
+        if not bars_by_ticker:
+            raise CommandError("None of the tickers is in the price store, run backfill_prices first")
+
+        self.stdout.write(f"Training the global model on {len(bars_by_ticker)} tickers up to {cutoff}")
+        started = time.monotonic()
+
+        def progress(epoch, epochs, val_loss):
+            self.stdout.write(f"Epoch {epoch}/{epochs}: validation loss {val_loss:.5f}")
+
+        try:
+            artifact = fit(
+                bars_by_ticker,
+                epochs=options['epochs'],
+                batch_size=options['batch_size'],
+                max_history=options['max_history'],
+                progress=progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        mapes = artifact['mape'].numpy()
+        model_registry.save(GLOBAL_MODEL_KEY, cutoff, {MODEL_TYPE: artifact}, {
+            'kind': 'global',
+            'tickers': len(artifact['tickers']),
+            'mape': float(np.median(mapes)),
+            'training_s': round(elapsed, 1),
+        })
+        self.stdout.write(
+            f"Global model trained on {len(artifact['tickers'])} tickers in {elapsed:.1f}s, "
+            f"validation MAPE median {np.median(mapes) * 100:.2f}%, mean {mapes.mean() * 100:.2f}%"
+        )
@@ -0,0 +1,78 @@
+"""
+NYSE trading sessions from the exchange calendar of pandas_market_calendars,
+so exchange holidays are not sessions and early closes (e.g. the day after
+Thanksgiving) count from their real time. Closes are taken in
+America/New_York and converted to UTC, which handles daylight saving time.
+"""
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+EXCHANGE = 'XNYS'
+# Sessions are loaded this far around the dates asked about and extended when needed
+SCHEDULE_MARGIN = timedelta(days=366)
+# Longer than any market closure (weekend plus holidays, or an exceptional closure)
+MAX_SESSION_GAP = timedelta(days=14)
+
+
+class MarketCalendar:
+    """Session dates and UTC close times of one exchange, loaded lazily and kept in memory."""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        # (first date, last date, session dates, session closes), replaced as a whole when extended
+        self._schedule = None
+        self._lock = threading.Lock()
+
+    def sessions(self, start, end):
+        """(dates, closes) of a loaded schedule covering at least `start` to `end`."""
+        schedule = self._schedule
+        if schedule is None or start < schedule[0] or end > schedule[1]:
+            with self._lock:
+                schedule = self._schedule
+                if schedule is None or start < schedule[0] or end > schedule[1]:
+                    first = min(start, schedule[0]) if schedule else start
+                    last = max(end, schedule[1]) if schedule else end
+                    schedule = self._load(first - SCHEDULE_MARGIN, last + SCHEDULE_MARGIN)
+                    self._schedule = schedule
+        return schedule[2], schedule[3]
+
+    def _load(self, start, end):
+        import pandas_market_calendars as mcal
+
+        schedule = mcal.get_calendar(self.exchange).schedule(start_date=start, end_date=end, tz='UTC')
+        dates = [day.date() for day in schedule.index]
+        closes = [close.to_pydatetime().astimezone(timezone.utc) for close in schedule['market_close']]
+        return start, end, dates, closes
+
+    def last_close_date(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        dates, closes = self.sessions(now.date() - MAX_SESSION_GAP, now.date() + timedelta(days=1))
+        return dates[bisect_right(closes, now) - 1]
+
+    def next_close_after(self, day):
+        dates, closes = self.sessions(day, day + MAX_SESSION_GAP)
+        return closes[bisect_right(dates, day)]
+
+    def is_session(self, day):
+        dates, _ = self.sessions(day, day)
+        position = bisect_right(dates, day) - 1
+        return position >= 0 and dates[position] == day
+
+
+market_calendar = MarketCalendar(EXCHANGE)
+
+
+def last_close_date(now=None):
+    """Date of the most recent completed trading session (holidays and weekends skipped)."""
+    return market_calendar.last_close_date(now)
+
+
+def next_close_after(day):
+    """UTC datetime of the first session close after the session of `day`."""
+    return market_calendar.next_close_after(day)
+
+
+def is_session(day):
+    """Whether the exchange trades on `day`."""
+    return market_calendar.is_session(day)
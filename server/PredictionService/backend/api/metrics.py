@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Set PROMETHEUS_MULTIPROC_DIR so the uvicorn workers, the prediction pool and
+# the management commands all report through the same /metrics endpoint.
+
+STAGE_SECONDS = Histogram(
+    'prediction_stage_seconds',
+    'Time spent in each stage of serving a prediction',
+    ['stage'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+# tier is 'local' (the per-process LRU) or 'redis', so hit ratios can be computed per tier
+CACHE_LOOKUPS = Counter('prediction_cache_lookups_total', 'Prediction cache lookups', ['tier', 'result'])
+SUBSCRIPTION_LOOKUPS = Counter('subscription_cache_lookups_total', 'Plan check lookups of the per-process subscription cache', ['result'])
+UNKNOWN_TICKERS = Counter('prediction_unknown_tickers_total', 'Requested tickers missing from the symbol master')
+QUOTA_REJECTIONS = Counter('prediction_quota_rejections_total', 'Requests rejected by the quota check', ['reason'])
+SINGLE_FLIGHT = Counter('prediction_single_flight_total', 'How prediction cache misses were resolved', ['outcome'])
+OVERLOAD_REJECTIONS = Counter('prediction_overload_rejections_total', 'Requests turned away with 503', ['reason'])
+PREDICTION_JOBS = Counter('prediction_jobs_total', 'Prediction jobs by the status they reached', ['status'])
+MODEL_TRAININGS = Counter('prediction_model_trainings_total', 'Models fine-tuned or retrained from scratch',
+                          ['kind', 'reason'])
+# completed, pruned, time_budget, abandoned or failed (api/candidate_training.py)
+MODEL_CANDIDATES = Counter('prediction_model_candidates_total', 'Candidate models trained in parallel', ['outcome'])
+
+KAFKA_MESSAGES = Counter('kafka_consumer_messages_total', 'Subscription messages consumed')
+KAFKA_BATCH_SECONDS = Histogram('kafka_consumer_batch_seconds', 'Time to process and commit one consumed batch')
+KAFKA_BATCH_SIZE = Histogram('kafka_consumer_batch_size', 'Messages per consumed batch',
+                             buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 5000))
+KAFKA_LAG = Gauge('kafka_consumer_lag', 'Messages left to consume across assigned partitions',
+                  multiprocess_mode='max')
+
+# Stage durations of the current request, turned into a Server-Timing header by the middleware
+_request_timings = ContextVar('request_timings', default=None)
+
+
+def start_request_timings():
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.labels(stage=name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def server_timing_header(timings):
+    # A stage can run more than once per request (e.g. serialization), report the total
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0) + seconds
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
@@ -0,0 +1,26 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import server_timing_header, start_request_timings
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Expose the stage timings recorded while handling a request as a Server-Timing header."""
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = start_request_timings()
+            response = await get_response(request)
+            if timings:
+                response['Server-Timing'] = server_timing_header(timings)
+            return response
+    else:
+        def middleware(request):
+            timings = start_request_timings()
+            response = get_response(request)
+            if timings:
+                response['Server-Timing'] = server_timing_header(timings)
+            return response
+
+    return middleware
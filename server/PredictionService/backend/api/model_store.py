@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+
+import torch
+from django.conf import settings
+
+from . import inference
+
+
+class ModelRegistry:
+    """
+    On-disk store of trained prediction models, with a bounded in-process
+    LRU of the artifacts already loaded by this worker.
+
+    Artifacts live at <root>/<ticker>/<cutoff date>/<model type>.pt. Each one
+    is a dict holding the model's state_dict, its scaler parameters and any
+    other values needed to rebuild it, made of tensors and plain Python
+    types so it can be loaded with weights_only=True.
+
+    Exported versions of a model (see api.inference) sit next to it as
+    <model type>.<mode>.ts or .onnx, and <model type>.<mode>.rejected marks
+    an export that failed the accuracy guard so it is not retried.
+    training.json records how the models were trained (full retrain or
+    fine-tune, see api.forecaster).
+
+    A cutoff's models are written to a hidden temporary directory renamed
+    into place, so a concurrent reader sees either the whole set or none
+    of it.
+    """
+
+    def __init__(self, root, max_loaded, keep_cutoffs):
+        self.root = Path(root)
+        self.max_loaded = max_loaded
+        self.keep_cutoffs = keep_cutoffs
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def artifact_dir(self, ticker, cutoff):
+        return self.root / ticker / cutoff.isoformat()
+
+    def save(self, ticker, cutoff, artifacts, training=None):
+        """
+        Store a dict of model type -> artifact for the given data cutoff date,
+        with an optional JSON-serializable dict describing the training run.
+        """
+        artifact_dir = self.artifact_dir(ticker, cutoff)
+        artifact_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{artifact_dir.name}.", dir=artifact_dir.parent))
+        try:
+            if training is not None:
+                (tmp_dir / 'training.json').write_text(json.dumps(training))
+            for model_type, artifact in artifacts.items():
+                torch.save(artifact, tmp_dir / f"{model_type}.pt")
+            self._move_into_place(tmp_dir, artifact_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self._forget(ticker, cutoff)
+        for model_type, artifact in artifacts.items():
+            self._remember((ticker, cutoff, model_type), artifact)
+        self._prune(ticker)
+
+    @staticmethod
+    def _move_into_place(tmp_dir, artifact_dir):
+        try:
+            os.rename(tmp_dir, artifact_dir)
+            return
+        except OSError:
+            pass
+        # Models trained again for the same cutoff replace the old set, exports included
+        old_dir = tmp_dir.with_name(f"{tmp_dir.name}.old")
+        try:
+            os.rename(artifact_dir, old_dir)
+            os.rename(tmp_dir, artifact_dir)
+        except OSError:
+            # Another process saved the same cutoff meanwhile, its set is as good as ours
+            pass
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def load_training(self, ticker, cutoff):
+        try:
+            return json.loads((self.artifact_dir(ticker, cutoff) / 'training.json').read_text())
+        except FileNotFoundError:
+            return {}
+
+    def latest(self, ticker, before):
+        """
+        (cutoff, artifacts, training) of the newest models trained on data
+        before `before`, or None.
+        """
+        for path in reversed(self._cutoff_dirs(ticker)):
+            cutoff = date.fromisoformat(path.name)
+            if cutoff >= before:
+                continue
+            artifacts = self.load(ticker, cutoff)
+            if artifacts is not None:
+                return cutoff, artifacts, self.load_training(ticker, cutoff)
+        return None
+
+    def exported_path(self, ticker, cutoff, model_type, mode):
+        suffix = 'onnx' if mode == 'onnx' else f"{mode}.ts"
+        return self.artifact_dir(ticker, cutoff) / f"{model_type}.{suffix}"
+
+    def save_exported(self, ticker, cutoff, model_type, mode, data, model):
+        """Store the bytes returned by inference.export() and keep `model`, loaded from them."""
+        path = self.exported_path(ticker, cutoff, model_type, mode)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self._remember((ticker, cutoff, model_type, mode), model)
+
+    def load_exported(self, ticker, cutoff, model_type, mode):
+        """The exported model ready to call, or None if it was not exported yet."""
+        key = (ticker, cutoff, model_type, mode)
+        with self._lock:
+            model = self._loaded.get(key)
+            if model is not None:
+                self._loaded.move_to_end(key)
+                return model
+        try:
+            data = self.exported_path(ticker, cutoff, model_type, mode).read_bytes()
+        except FileNotFoundError:
+            return None
+        model = inference.load(data, mode)
+        self._remember(key, model)
+        return model
+
+    def reject_export(self, ticker, cutoff, model_type, mode, reason):
+        path = self.artifact_dir(ticker, cutoff) / f"{model_type}.{mode}.rejected"
+        path.write_text(reason)
+
+    def export_rejected(self, ticker, cutoff, model_type, mode):
+        return (self.artifact_dir(ticker, cutoff) / f"{model_type}.{mode}.rejected").exists()
+
+    def load(self, ticker, cutoff):
+        """
+        Return the dict of model type -> artifact trained on data up to
+        `cutoff`, or None if there is no artifact for that date.
+        """
+        artifact_dir = self.artifact_dir(ticker, cutoff)
+        if not artifact_dir.is_dir():
+            return None
+
+        artifacts = {}
+        for path in artifact_dir.glob('*.pt'):
+            model_type = path.stem
+            key = (ticker, cutoff, model_type)
+            with self._lock:
+                artifact = self._loaded.get(key)
+                if artifact is not None:
+                    self._loaded.move_to_end(key)
+            if artifact is None:
+                try:
+                    artifact = torch.load(path, map_location='cpu', weights_only=True)
+                except FileNotFoundError:
+                    # Pruned by another process while we were listing the directory
+                    return None
+                self._remember(key, artifact)
+            artifacts[model_type] = artifact
+        return artifacts or None
+
+    def _remember(self, key, artifact):
+        with self._lock:
+            self._loaded[key] = artifact
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+    def _forget(self, ticker, cutoff):
+        with self._lock:
+            for key in [key for key in self._loaded if key[:2] == (ticker, cutoff)]:
+                del self._loaded[key]
+
+    def _cutoff_dirs(self, ticker):
+        """The cutoff directories of the ticker, oldest first, without the ones being written."""
+        ticker_dir = self.root / ticker
+        if not ticker_dir.is_dir():
+            return []
+        return sorted(path for path in ticker_dir.iterdir() if path.is_dir() and not path.name.startswith('.'))
+
+    def _prune(self, ticker):
+        # Only the newest few cutoffs are useful, older models are never served again
+        for path in self._cutoff_dirs(ticker)[:-self.keep_cutoffs]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+model_registry = ModelRegistry(
+    settings.MODEL_REGISTRY_DIR,
+    max_loaded=settings.MODEL_REGISTRY_CACHE_SIZE,
+    keep_cutoffs=settings.MODEL_REGISTRY_KEEP_CUTOFFS,
+)
@@ -0,0 +1,472 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from .local_cache import local_prediction_cache
+from .market_calendar import last_close_date, next_close_after
+from .metrics import CACHE_LOOKUPS, SINGLE_FLIGHT, stage
+from .prediction_codec import PredictionDecodeError, decode_prediction, encode_prediction
+from .prediction_jobs import prediction_jobs
+
+logger = logging.getLogger(__name__)
+
+# Fresh entries expire at the next market close after their data cutoff, when
+# a new bar makes them outdated. Stale copies stay much longer, so a ticker
+# seen before is answered straight away while it is refreshed in the background.
+STALE_PREDICTION_CACHE_TIMEOUT = 60 * 60 * 24 * 30  # 30 days
+
+SINGLE_FLIGHT_METRICS_KEY = 'prediction_single_flight_metrics'
+# Sorted set of ticker -> number of prediction requests, used to pick what to pre-warm
+PREDICTION_REQUESTS_KEY = 'prediction_request_counts'
+
+
+class PredictionPendingError(Exception):
+    """Another worker is computing this prediction and did not finish in time."""
+
+
+def prediction_cache_key(ticker, cutoff=None):
+    # A new model version or a new close gets new keys, old entries just expire
+    cutoff = cutoff or last_close_date()
+    return f"prediction_{settings.PREDICTION_MODEL_VERSION}_{cutoff.isoformat()}_{ticker}"
+
+
+def stale_prediction_cache_key(ticker):
+    # Not versioned: an older prediction is still better than none while the new one is computed
+    return f"stale_prediction_{ticker}"
+
+
+def prediction_lock_key(ticker):
+    return f"lock_prediction_{ticker}"
+
+
+def prediction_cache_timeout(cutoff, now=None):
+    """Seconds until the entry for `cutoff` is superseded by the next close."""
+    now = now or datetime.now(timezone.utc)
+    return max(int((next_close_after(cutoff) - now).total_seconds()), 1)
+
+
+def build_prediction_result(predictions, dates, mape_values):
+    """
+    Turn the raw output of predict() (NumPy array, DatetimeIndex, list of
+    candidate MAPEs) into the JSON-serializable payload returned by the API.
+    """
+    with stage('serialization'):
+        return {
+            "predictions": predictions.tolist(),
+            "dates": dates.strftime('%Y-%m-%d').tolist(),
+            "mape_values": min(mape_values) * 100
+        }
+
+
+def encode_result(result):
+    return encode_prediction(result, compress=settings.PREDICTION_CACHE_COMPRESS)
+
+
+def decode_result(data):
+    """The result stored in a cache value, or None if there is none we can read."""
+    if data is None:
+        return None
+    try:
+        return decode_prediction(data)
+    except PredictionDecodeError as e:
+        logger.warning("Ignoring undecodable cached prediction: %s", e)
+        return None
+
+
+def _cache_get(key):
+    return decode_result(cache.get(key))
+
+
+def _local_get(ticker, cache_key):
+    result = local_prediction_cache.get(ticker, cache_key)
+    CACHE_LOOKUPS.labels(tier='local', result='hit' if result is not None else 'miss').inc()
+    return result
+
+
+def _redis_get(ticker, cache_key):
+    generation = local_prediction_cache.generation()
+    result = _cache_get(cache_key)
+    CACHE_LOOKUPS.labels(tier='redis', result='hit' if result else 'miss').inc()
+    if result:
+        local_prediction_cache.set(ticker, cache_key, result, generation)
+    return result
+
+
+def get_cached_prediction(ticker):
+    """
+    The cached prediction for `ticker`, or None. Hot tickers are answered
+    from this process' LRU (api.local_cache) without going to Redis.
+    """
+    cache_key = prediction_cache_key(ticker)
+    return _local_get(ticker, cache_key) or _redis_get(ticker, cache_key)
+
+
+async def aget_cached_prediction(ticker):
+    cache_key = prediction_cache_key(ticker)
+    # Local hits are answered without a hop to a worker thread
+    result = _local_get(ticker, cache_key)
+    if result:
+        return result
+    return await sync_to_async(_redis_get, thread_sensitive=False)(ticker, cache_key)
+
+
+def get_cached_predictions(tickers):
+    """
+    Fetch the cached predictions for several tickers, from the local LRU
+    and then from Redis in one round trip (django-redis turns get_many into
+    a single MGET). Returns a dict of ticker -> result for the tickers that
+    were cached.
+    """
+    cutoff = last_close_date()
+    keys = {ticker: prediction_cache_key(ticker, cutoff) for ticker in tickers}
+    cached = {}
+    for ticker, cache_key in keys.items():
+        result = _local_get(ticker, cache_key)
+        if result:
+            cached[ticker] = result
+
+    remote_keys = {cache_key: ticker for ticker, cache_key in keys.items() if ticker not in cached}
+    if remote_keys:
+        generation = local_prediction_cache.generation()
+        remote = {remote_keys[key]: decode_result(data) for key, data in cache.get_many(list(remote_keys)).items()}
+        remote = {ticker: result for ticker, result in remote.items() if result is not None}
+        CACHE_LOOKUPS.labels(tier='redis', result='hit').inc(len(remote))
+        CACHE_LOOKUPS.labels(tier='redis', result='miss').inc(len(remote_keys) - len(remote))
+        for ticker, result in remote.items():
+            local_prediction_cache.set(ticker, keys[ticker], result, generation)
+        cached.update(remote)
+    return cached
+
+
+def set_cached_predictions(results):
+    """Store a dict of ticker -> result, pipelined into one round trip."""
+    if not results:
+        return
+    cutoff = last_close_date()
+    encoded = {ticker: encode_result(result) for ticker, result in results.items()}
+    cache.set_many(
+        {prediction_cache_key(ticker, cutoff): data for ticker, data in encoded.items()},
+        timeout=prediction_cache_timeout(cutoff)
+    )
+    cache.set_many(
+        {stale_prediction_cache_key(ticker): data for ticker, data in encoded.items()},
+        timeout=STALE_PREDICTION_CACHE_TIMEOUT
+    )
+    # Other processes may hold the previous prediction in their local LRU
+    local_prediction_cache.publish_invalidation(list(results))
+
+
+def get_stale_predictions(tickers):
+    """
+    The last predictions of tickers without a fresh one, flagged as stale,
+    queueing a background refresh for each (stale-while-revalidate).
+    """
+    if not tickers:
+        return {}
+    keys = {stale_prediction_cache_key(ticker): ticker for ticker in tickers}
+    stale = {keys[key]: decode_result(data) for key, data in cache.get_many(list(keys)).items()}
+    stale = {ticker: result for ticker, result in stale.items() if result is not None}
+    for ticker in stale:
+        _refresh_in_background(ticker)
+    return {ticker: _flag_stale(result) for ticker, result in stale.items()}
+
+
+async def aget_stale_prediction(ticker):
+    stale = await sync_to_async(get_stale_predictions, thread_sensitive=False)([ticker])
+    return stale.get(ticker)
+
+
+def _flag_stale(result):
+    return {**result, "stale": True}
+
+
+def _refresh_in_background(ticker):
+    # Run by manage.py run_prediction_jobs; deduplicated per ticker by the job queue
+    try:
+        prediction_jobs.enqueue(ticker)
+    except Exception as e:
+        logger.warning("Failed to queue a refresh of %s: %s", ticker, e)
+
+
+def get_or_compute_prediction(ticker, compute):
+    """
+    Return the cached prediction for `ticker`, computing it with
+    compute(ticker) on a miss.
+
+    If the fresh entry is gone but an older prediction is cached, that one
+    is returned at once, flagged with "stale": true, and a refresh is queued
+    in the background. Only tickers never predicted before (or not for
+    STALE_PREDICTION_CACHE_TIMEOUT) are computed while the caller waits.
+
+    Those misses are coalesced across processes: only the worker holding the
+    Redis lock for the ticker runs compute(), everybody else waits for it to
+    fill the cache. Raises PredictionPendingError if the wait times out.
+    """
+    cache_key = prediction_cache_key(ticker)
+    with stage('cache_lookup'):
+        result = get_cached_prediction(ticker)
+    if result:
+        return result
+
+    stale_result = _cache_get(stale_prediction_cache_key(ticker))
+    if stale_result:
+        _refresh_in_background(ticker)
+        _record_single_flight('stale_served')
+        return _flag_stale(stale_result)
+
+    lock = cache.lock(prediction_lock_key(ticker), timeout=settings.PREDICTION_LOCK_TIMEOUT)
+    deadline = time.monotonic() + settings.PREDICTION_LOCK_WAIT_TIMEOUT
+
+    while True:
+        if lock.acquire(blocking=False):
+            try:
+                # Another worker may have filled the cache between our get and the lock
+                result = _cache_get(cache_key)
+                if result:
+                    _record_single_flight('coalesced')
+                    return result
+                result = compute(ticker)
+                set_cached_predictions({ticker: result})
+                _record_single_flight('computed')
+                return result
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    # The lock expired while we were computing
+                    pass
+
+        if time.monotonic() >= deadline:
+            _record_single_flight('wait_timeout')
+            raise PredictionPendingError(f"Prediction for {ticker} is still being computed")
+
+        time.sleep(settings.PREDICTION_LOCK_POLL_INTERVAL)
+        result = _cache_get(cache_key)
+        if result:
+            _record_single_flight('coalesced')
+            return result
+        # If the lock holder failed, the next iteration takes the lock over
+
+
+async def aget_or_compute_prediction(ticker, compute):
+    """
+    Async counterpart of get_or_compute_prediction() for the ASGI view.
+    `compute` is a coroutine function; Redis calls run in worker threads and
+    waiting for another worker's result does not block the event loop.
+    """
+    # thread_sensitive=False: Redis calls may run in parallel threads, not one shared one
+    cache_get = sync_to_async(_cache_get, thread_sensitive=False)
+
+    cache_key = prediction_cache_key(ticker)
+    result = await aget_cached_prediction(ticker)
+    if result:
+        return result
+
+    stale_result = await cache_get(stale_prediction_cache_key(ticker))
+    if stale_result:
+        await sync_to_async(_refresh_in_background, thread_sensitive=False)(ticker)
+        await _arecord_single_flight('stale_served')
+        return _flag_stale(stale_result)
+
+    # Not thread-local: acquire and release may run on different worker threads
+    lock = cache.lock(prediction_lock_key(ticker), timeout=settings.PREDICTION_LOCK_TIMEOUT, thread_local=False)
+    deadline = time.monotonic() + settings.PREDICTION_LOCK_WAIT_TIMEOUT
+
+    while True:
+        if await sync_to_async(lock.acquire, thread_sensitive=False)(blocking=False):
+            try:
+                result = await cache_get(cache_key)
+                if result:
+                    await _arecord_single_flight('coalesced')
+                    return result
+                result = await compute(ticker)
+                await sync_to_async(set_cached_predictions, thread_sensitive=False)({ticker: result})
+                await _arecord_single_flight('computed')
+                return result
+            finally:
+                try:
+                    await sync_to_async(lock.release, thread_sensitive=False)()
+                except LockError:
+                    pass
+
+        if time.monotonic() >= deadline:
+            await _arecord_single_flight('wait_timeout')
+            raise PredictionPendingError(f"Prediction for {ticker} is still being computed")
+
+        await asyncio.sleep(settings.PREDICTION_LOCK_POLL_INTERVAL)
+        result = await cache_get(cache_key)
+        if result:
+            await _arecord_single_flight('coalesced')
+            return result
+
+
+def _cache_get_many(tickers):
+    """Fresh cached results of `tickers` from Redis, in one round trip."""
+    cutoff = last_close_date()
+    keys = {prediction_cache_key(ticker, cutoff): ticker for ticker in tickers}
+    cached = {keys[key]: decode_result(data) for key, data in cache.get_many(list(keys)).items()}
+    return {ticker: result for ticker, result in cached.items() if result is not None}
+
+
+def _acquire_locks(tickers, thread_local=True):
+    """The compute locks of `tickers` this worker could take, by ticker."""
+    locks = {}
+    for ticker in tickers:
+        lock = cache.lock(prediction_lock_key(ticker), timeout=settings.PREDICTION_LOCK_TIMEOUT,
+                          thread_local=thread_local)
+        if lock.acquire(blocking=False):
+            locks[ticker] = lock
+    return locks
+
+
+def _release_locks(locks):
+    for lock in locks.values():
+        try:
+            lock.release()
+        except LockError:
+            # The lock expired while we were computing
+            pass
+
+
+def _wait_timeouts(tickers):
+    _record_single_flight('wait_timeout', len(tickers))
+    return {ticker: f"Prediction for {ticker} is still being computed" for ticker in tickers}
+
+
+def get_or_compute_predictions(tickers, compute):
+    """
+    Batch counterpart of get_or_compute_prediction() for tickers with
+    neither a fresh nor a stale cached result (see get_cached_predictions()
+    and get_stale_predictions()). compute(tickers) returns (results, errors)
+    like api.compute_pool.compute_predictions().
+
+    The misses are coalesced per ticker with the same Redis locks: this
+    worker computes, in one compute() call, only the tickers whose lock it
+    takes and waits for the others. Tickers still being computed elsewhere
+    when the wait times out are returned in the errors.
+    Returns (results, errors).
+    """
+    results, errors = {}, {}
+    pending = list(tickers)
+    deadline = time.monotonic() + settings.PREDICTION_LOCK_WAIT_TIMEOUT
+
+    while pending:
+        locks = _acquire_locks(pending)
+        if locks:
+            try:
+                # Another worker may have filled the cache between our lookup and the locks
+                cached = _cache_get_many(list(locks))
+                _record_single_flight('coalesced', len(cached))
+                results.update(cached)
+                missing = [ticker for ticker in locks if ticker not in cached]
+                if missing:
+                    computed, failed = compute(missing)
+                    set_cached_predictions(computed)
+                    _record_single_flight('computed', len(computed))
+                    results.update(computed)
+                    errors.update(failed)
+            finally:
+                _release_locks(locks)
+            pending = [ticker for ticker in pending if ticker not in locks]
+            if not pending:
+                break
+
+        if time.monotonic() >= deadline:
+            errors.update(_wait_timeouts(pending))
+            break
+
+        time.sleep(settings.PREDICTION_LOCK_POLL_INTERVAL)
+        cached = _cache_get_many(pending)
+        _record_single_flight('coalesced', len(cached))
+        results.update(cached)
+        # Tickers whose lock holder failed are taken over on the next iteration
+        pending = [ticker for ticker in pending if ticker not in cached]
+
+    return results, errors
+
+
+async def aget_or_compute_predictions(tickers, compute):
+    """
+    Async counterpart of get_or_compute_predictions() for the ASGI batch
+    view; `compute` is a coroutine function.
+    """
+    cache_get_many = sync_to_async(_cache_get_many, thread_sensitive=False)
+    results, errors = {}, {}
+    pending = list(tickers)
+    deadline = time.monotonic() + settings.PREDICTION_LOCK_WAIT_TIMEOUT
+
+    while pending:
+        # Not thread-local: acquire and release may run on different worker threads
+        locks = await sync_to_async(_acquire_locks, thread_sensitive=False)(pending, thread_local=False)
+        if locks:
+            try:
+                cached = await cache_get_many(list(locks))
+                await _arecord_single_flight('coalesced', len(cached))
+                results.update(cached)
+                missing = [ticker for ticker in locks if ticker not in cached]
+                if missing:
+                    computed, failed = await compute(missing)
+                    await sync_to_async(set_cached_predictions, thread_sensitive=False)(computed)
+                    await _arecord_single_flight('computed', len(computed))
+                    results.update(computed)
+                    errors.update(failed)
+            finally:
+                await sync_to_async(_release_locks, thread_sensitive=False)(locks)
+            pending = [ticker for ticker in pending if ticker not in locks]
+            if not pending:
+                break
+
+        if time.monotonic() >= deadline:
+            errors.update(await sync_to_async(_wait_timeouts, thread_sensitive=False)(pending))
+            break
+
+        await asyncio.sleep(settings.PREDICTION_LOCK_POLL_INTERVAL)
+        cached = await cache_get_many(pending)
+        await _arecord_single_flight('coalesced', len(cached))
+        results.update(cached)
+        pending = [ticker for ticker in pending if ticker not in cached]
+
+    return results, errors
+
+
+def _record_single_flight(outcome, count=1):
+    if not count:
+        return
+    SINGLE_FLIGHT.labels(outcome=outcome).inc(count)
+    try:
+        get_redis_connection('default').hincrby(SINGLE_FLIGHT_METRICS_KEY, outcome, count)
+    except Exception as e:
+        logger.warning("Failed to record single-flight metric %s: %s", outcome, e)
+
+
+async def _arecord_single_flight(outcome, count=1):
+    await sync_to_async(_record_single_flight, thread_sensitive=False)(outcome, count)
+
+
+def get_single_flight_metrics():
+    """Counts of computed / coalesced / stale_served / wait_timeout misses across all workers."""
+    metrics = get_redis_connection('default').hgetall(SINGLE_FLIGHT_METRICS_KEY)
+    return {key.decode(): int(value) for key, value in metrics.items()}
+
+
+def record_prediction_requests(tickers):
+    """Count requests per ticker so the pre-warm job can find the hot symbols."""
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for ticker in tickers:
+            pipe.zincrby(PREDICTION_REQUESTS_KEY, 1, ticker)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to record prediction requests: %s", e)
+
+
+def get_most_requested_tickers(count):
+    tickers = get_redis_connection('default').zrevrange(PREDICTION_REQUESTS_KEY, 0, count - 1)
+    return [ticker.decode() for ticker in tickers]
@@ -0,0 +1,108 @@
+"""
+Compact binary encoding of cached prediction results.
+
+A result ({"predictions": [...], "dates": ['%Y-%m-%d', ...], "mape_values": x})
+is stored as a fixed header followed by the predictions as float32 and the
+dates as uint16 offsets from the first date, counted in business days (or
+in calendar days if some date falls on a weekend). The body can be
+zlib-compressed. Anything that does not decode (an older format, a
+truncated value) is treated as a cache miss by the caller.
+"""
+import functools
+import struct
+import zlib
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+FLAG_ZLIB = 1
+FLAG_CALENDAR_DAYS = 2
+
+# format version, flags, first date (days since epoch), number of predictions, mape_values
+HEADER = struct.Struct('<BBiId')
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+# float32 holds about 7-8 significant digits, printing more only shows noise
+SIGNIFICANT_DIGITS = 8
+
+
+class PredictionDecodeError(ValueError):
+    """The cached bytes are not a prediction result in the current format."""
+
+
+def encode_prediction(result, compress=False):
+    predictions = np.asarray(result['predictions'], dtype='<f4')
+    dates = np.asarray(result['dates'], dtype='datetime64[D]')
+    if len(dates) != len(predictions):
+        raise ValueError("predictions and dates must have the same length")
+
+    flags = 0
+    start = dates[0] if len(dates) else EPOCH
+    if len(dates) and np.is_busday(dates).all():
+        offsets = np.busday_count(start, dates)
+    else:
+        flags |= FLAG_CALENDAR_DAYS
+        offsets = (dates - start).astype(np.int64)
+    if len(offsets) and (offsets.min() < 0 or offsets.max() > np.iinfo(np.uint16).max):
+        raise ValueError("dates must be sorted and span less than 65536 days")
+
+    body = predictions.tobytes() + offsets.astype('<u2').tobytes()
+    if compress:
+        flags |= FLAG_ZLIB
+        body = zlib.compress(body)
+    header = HEADER.pack(FORMAT_VERSION, flags, int((start - EPOCH).astype(np.int64)), len(predictions),
+                         float(result['mape_values']))
+    return header + body
+
+
+def decode_prediction(data):
+    if not isinstance(data, (bytes, bytearray, memoryview)) or len(data) < HEADER.size:
+        raise PredictionDecodeError("not an encoded prediction")
+    version, flags, start_days, count, mape = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise PredictionDecodeError(f"unknown prediction format version {version}")
+
+    body = bytes(data[HEADER.size:])
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise PredictionDecodeError(str(e))
+    if len(body) != count * 6:
+        raise PredictionDecodeError("truncated prediction")
+
+    predictions = np.frombuffer(body, dtype='<f4', count=count)
+    offsets = body[count * 4:]
+    return {
+        "predictions": _round_significant(predictions),
+        # A new list each time, the cached one must not be modified
+        "dates": list(_date_strings(start_days, bool(flags & FLAG_CALENDAR_DAYS), offsets)),
+        "mape_values": mape,
+    }
+
+
+def _round_significant(values):
+    # So 101.23 comes back as 101.23 rather than 101.2300033569336
+    values = values.astype(np.float64)
+    with np.errstate(divide='ignore'):
+        exponents = SIGNIFICANT_DIGITS - 1 - np.floor(np.log10(np.abs(values)))
+    exponents = np.where(np.isfinite(exponents), exponents, 0)
+    # Integer times or divided by an exact power of ten, so the result is the closest double to the decimal
+    scale = 10.0 ** np.abs(exponents)
+    return np.where(
+        exponents >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale
+    ).tolist()
+
+
+@functools.lru_cache(maxsize=256)
+def _date_strings(start_days, calendar_days, offsets):
+    # Every ticker predicted at the same cutoff has the same dates, so this is nearly always a hit
+    offsets = np.frombuffer(offsets, dtype='<u2').astype(np.int64)
+    start = EPOCH + np.timedelta64(start_days, 'D')
+    if calendar_days:
+        dates = start + offsets.astype('timedelta64[D]')
+    else:
+        dates = np.busday_offset(start, offsets)
+    return tuple(np.datetime_as_string(dates, unit='D').tolist())
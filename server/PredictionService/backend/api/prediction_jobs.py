@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .metrics import PREDICTION_JOBS
+
+logger = logging.getLogger(__name__)
+
+# Job ids by score: premium jobs sort before all free ones, then oldest first
+JOB_QUEUE_KEY = 'prediction_job_queue'
+PREMIUM_PRIORITY = 0
+FREE_PRIORITY = 1
+# Bigger than any enqueue timestamp, so the priority always wins over the age
+PRIORITY_BAND = 10 ** 10
+
+# Creates the job unless the ticker already has a queued or running one.
+# KEYS[1] ticker -> job id, KEYS[2] queue, KEYS[3] new job hash
+# ARGV: job id, ticker, score, now, job ttl, dedup timeout
+ENQUEUE_JOB_SCRIPT = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    -- A premium request moves an already queued free job forward
+    redis.call('ZADD', KEYS[2], 'XX', 'LT', ARGV[3], existing)
+    return {existing, 0}
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[6])
+redis.call('HSET', KEYS[3], 'ticker', ARGV[2], 'status', 'queued', 'created_at', ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+return {ARGV[1], 1}
+"""
+
+
+def job_key(job_id):
+    return f"prediction_job:{job_id}"
+
+
+def ticker_job_key(ticker):
+    return f"prediction_job_ticker:{ticker}"
+
+
+def job_done_channel(job_id):
+    return f"prediction_job_done:{job_id}"
+
+
+class PredictionJobQueue:
+    """
+    Prediction jobs kept in Redis, run by `manage.py run_prediction_jobs`.
+
+    A job is a hash holding the ticker, its status (queued, running, done or
+    failed) and, once finished, the prediction result or error. There is at
+    most one queued or running job per ticker; enqueueing the ticker again
+    returns the existing job. Finished jobs are announced on a pub/sub
+    channel so long-polling clients wake up straight away.
+    """
+
+    def __init__(self):
+        self._enqueue_script = None
+
+    @property
+    def redis(self):
+        return get_redis_connection('default')
+
+    def enqueue(self, ticker, premium=False):
+        """Returns (job_id, created)."""
+        if self._enqueue_script is None:
+            self._enqueue_script = self.redis.register_script(ENQUEUE_JOB_SCRIPT)
+        now = time.time()
+        priority = PREMIUM_PRIORITY if premium else FREE_PRIORITY
+        job_id = uuid.uuid4().hex
+        job_id, created = self._enqueue_script(
+            keys=[ticker_job_key(ticker), JOB_QUEUE_KEY, job_key(job_id)],
+            # The ticker stays deduplicated for at most the prediction lock timeout, in case a worker dies
+            args=[job_id, ticker, priority * PRIORITY_BAND + now, now,
+                  settings.PREDICTION_JOB_TTL, settings.PREDICTION_LOCK_TIMEOUT],
+        )
+        if created:
+            PREDICTION_JOBS.labels(status='queued').inc()
+        return _decode(job_id), bool(created)
+
+    def pop(self, timeout=1):
+        """
+        Take the highest-priority job off the queue and mark it running.
+        Returns (job_id, ticker), or None if nothing was queued within `timeout` seconds.
+        """
+        popped = self.redis.bzpopmin(JOB_QUEUE_KEY, timeout=timeout)
+        if not popped:
+            return None
+        job_id = _decode(popped[1])
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(job_key(job_id), 'ticker')
+        pipe.hset(job_key(job_id), mapping={'status': 'running', 'started_at': time.time()})
+        ticker, _ = pipe.execute()
+        if ticker is None:
+            # The job hash expired while it was queued
+            self.redis.delete(job_key(job_id))
+            return None
+        return job_id, _decode(ticker)
+
+    def finish(self, job_id, ticker, result=None, error=None):
+        status = 'failed' if error is not None else 'done'
+        fields = {'status': status, 'finished_at': time.time()}
+        if error is not None:
+            fields['error'] = error
+        else:
+            fields['result'] = json.dumps(result)
+
+        redis = self.redis
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(job_key(job_id), mapping=fields)
+        pipe.expire(job_key(job_id), settings.PREDICTION_JOB_TTL)
+        pipe.execute()
+        # Later requests for the ticker start a new job (or hit the prediction cache)
+        if _decode(redis.get(ticker_job_key(ticker))) == job_id:
+            redis.delete(ticker_job_key(ticker))
+        redis.publish(job_done_channel(job_id), status)
+        PREDICTION_JOBS.labels(status=status).inc()
+
+    def get(self, job_id):
+        """The job as a dict, or None if it does not exist (or expired)."""
+        fields = self.redis.hgetall(job_key(job_id))
+        if not fields:
+            return None
+        job = {_decode(key): _decode(value) for key, value in fields.items()}
+        job['job_id'] = job_id
+        for field in ('created_at', 'started_at', 'finished_at'):
+            if field in job:
+                job[field] = float(job[field])
+        if 'result' in job:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def wait(self, job_id, timeout):
+        """Like get(), but waits up to `timeout` seconds for a queued or running job to finish."""
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        # Subscribe before reading the job so a finish in between is not missed
+        pubsub.subscribe(job_done_channel(job_id))
+        try:
+            deadline = time.monotonic() + timeout
+            job = self.get(job_id)
+            while job is not None and job['status'] in ('queued', 'running'):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                pubsub.get_message(timeout=remaining)
+                job = self.get(job_id)
+            return job
+        finally:
+            pubsub.close()
+
+    def queued(self):
+        return self.redis.zcard(JOB_QUEUE_KEY)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+prediction_jobs = PredictionJobQueue()
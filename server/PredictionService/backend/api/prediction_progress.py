@@ -0,0 +1,49 @@
+import json
+import logging
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Seconds between SSE comments sent to keep idle connections (and proxies) open
+KEEPALIVE_INTERVAL = 15
+
+
+def progress_channel(ticker):
+    return f"prediction_progress:{ticker}"
+
+
+def report_progress(ticker, event, **data):
+    """
+    Publish a progress event of the prediction running for `ticker`.
+    Whoever computes the ticker reports, whichever process it runs in, and
+    every stream waiting on the ticker receives it.
+    """
+    try:
+        get_redis_connection('default').publish(progress_channel(ticker), json.dumps({'event': event, **data}))
+    except Exception as e:
+        # Progress is best effort, never fail the prediction over it
+        logger.debug("Failed to report %s progress for %s: %s", event, ticker, e)
+
+
+def subscribe(ticker):
+    pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(progress_channel(ticker))
+    return pubsub
+
+
+def next_event(pubsub, timeout):
+    """The next progress event as (event, data), or None after `timeout` seconds."""
+    message = pubsub.get_message(timeout=timeout)
+    if message is None or message['type'] != 'message':
+        return None
+    data = json.loads(message['data'])
+    return data.pop('event'), data
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def format_keepalive():
+    return ": keep-alive\n\n"
@@ -0,0 +1,235 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .market_calendar import last_close_date
+
+PRICE_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('adj_close', 'f8'),
+    ('volume', 'f8'),
+])
+
+# yfinance column name for each stored field
+YFINANCE_COLUMNS = {
+    'open': 'Open',
+    'high': 'High',
+    'low': 'Low',
+    'close': 'Close',
+    'adj_close': 'Adj Close',
+    'volume': 'Volume',
+}
+
+# Fields scaled by adj_close / close for the models, so splits and dividends do not show up as jumps
+ADJUSTED_FIELDS = ('open', 'high', 'low', 'close')
+
+
+def adjustment_factors(bars):
+    """adj_close / close of each bar, 1 where either is missing."""
+    close, adj_close = bars['close'], bars['adj_close']
+    return np.divide(adj_close, close, out=np.ones(len(bars)), where=(close > 0) & (adj_close > 0))
+
+
+def bars_to_frame(bars):
+    """
+    A structured array of bars (or a slice of one) as a DataFrame with
+    yfinance's column names, open/high/low/close adjusted for splits and
+    dividends.
+    """
+    factors = adjustment_factors(bars)
+    return pd.DataFrame(
+        {
+            column: bars[field] * factors if field in ADJUSTED_FIELDS else bars[field]
+            for field, column in YFINANCE_COLUMNS.items()
+        },
+        index=pd.DatetimeIndex(bars['date'], name='Date'),
+    )
+
+
+class PriceStore:
+    """
+    Local daily price history, one memory-mapped .npy file per ticker.
+
+    Bars are stored as downloaded (close and adj_close); bars_to_frame()
+    and windowing.price_buffer() adjust them for the models. Refreshes
+    download from the last stored date: if that overlapping bar changed, a
+    split or dividend re-adjusted the history and the whole file is
+    downloaded again. <ticker>.checked records the last close whose bar is
+    stored, so the ticker is not asked for again until the next close. When
+    the download does not have that bar yet (published late after the
+    close, a halted symbol) it is retried after PRICE_REFRESH_RETRY_INTERVAL.
+
+    Writers take an exclusive flock on the ticker and replace the file
+    atomically, so readers never need a lock: a reader that already mapped
+    the old file keeps reading it, the next one sees the new file.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, ticker):
+        return self.root / f"{ticker}.npy"
+
+    def read(self, ticker):
+        """Structured array of the stored bars (memory-mapped), or None."""
+        try:
+            return np.load(self.path(ticker), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+    def read_frame(self, ticker):
+        """The stored bars as a DataFrame with yfinance's column names."""
+        bars = self.read(ticker)
+        if bars is None:
+            return None
+        return bars_to_frame(bars)
+
+    def checked_path(self, ticker):
+        return self.root / f"{ticker}.checked"
+
+    def checked_through(self, ticker):
+        """The last close date whose bar is stored, or None."""
+        try:
+            return date.fromisoformat(self.checked_path(ticker).read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _mark_checked(self, ticker, cutoff):
+        path = self.checked_path(ticker)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(cutoff.isoformat())
+        os.replace(tmp_path, path)
+
+    def attempted_path(self, ticker):
+        return self.root / f"{ticker}.attempted"
+
+    def attempted_recently(self, ticker):
+        """Whether a download came back without the last close's bar less than a retry interval ago."""
+        try:
+            attempted_at = float(self.attempted_path(ticker).read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        return time.time() - attempted_at < settings.PRICE_REFRESH_RETRY_INTERVAL
+
+    def _mark_attempted(self, ticker):
+        path = self.attempted_path(ticker)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(repr(time.time()))
+        os.replace(tmp_path, path)
+
+    def last_date(self, ticker):
+        bars = self.read(ticker)
+        if bars is None or len(bars) == 0:
+            return None
+        return bars['date'][-1].astype(object)
+
+    def bars(self, ticker):
+        """
+        Stored bars (memory-mapped) up to the last completed session,
+        downloading only what is missing. After the nightly backfill this
+        never touches the network.
+        """
+        cutoff = last_close_date()
+        last_date = self.last_date(ticker)
+        if last_date is None or last_date < cutoff:
+            checked = self.checked_through(ticker)
+            if (checked is None or checked < cutoff) and not self.attempted_recently(ticker):
+                self.refresh(ticker)
+        return self.read(ticker)
+
+    def history(self, ticker):
+        """Like bars(), as a DataFrame with yfinance's column names."""
+        bars = self.bars(ticker)
+        if bars is None:
+            return None
+        return bars_to_frame(bars)
+
+    def refresh(self, ticker, full=False):
+        """
+        Append the bars after the last stored date, or re-download the whole
+        history when the last stored bar was re-adjusted (or with full=True).
+        Returns the number of bars written.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._write_lock(ticker):
+            # Re-read under the lock, another process may have just appended
+            existing = None if full else self.read(ticker)
+            cutoff = last_close_date()
+            if not full and (self.checked_through(ticker) or date.min) >= cutoff:
+                return 0
+            if existing is not None and len(existing):
+                start = existing['date'][-1].astype(object)
+                if start >= cutoff:
+                    self._mark_checked(ticker, cutoff)
+                    return 0
+                downloaded = self._download(ticker, start, cutoff)
+                if len(downloaded) and downloaded['date'][0] == existing['date'][-1]:
+                    if _same_prices(downloaded[0], existing[-1]):
+                        new_bars = downloaded[1:]
+                    else:
+                        existing, new_bars = None, self._download(ticker, None, cutoff)
+                else:
+                    new_bars = downloaded[downloaded['date'] > existing['date'][-1]]
+            else:
+                existing, new_bars = None, self._download(ticker, None, cutoff)
+
+            bars = existing
+            if len(new_bars):
+                bars = new_bars if existing is None else np.concatenate([existing, new_bars])
+                tmp_path = self.path(ticker).with_suffix(f".{os.getpid()}.tmp.npy")
+                np.save(tmp_path, bars)
+                os.replace(tmp_path, self.path(ticker))
+            # Failed downloads raise before this, and are retried on the next call
+            if bars is not None and len(bars) and bars['date'][-1] == np.datetime64(cutoff):
+                self._mark_checked(ticker, cutoff)
+            else:
+                self._mark_attempted(ticker)
+            return len(new_bars)
+
+    def _download(self, ticker, start, cutoff):
+        import yfinance as yf
+
+        kwargs = {'start': start.isoformat()} if start else {'period': 'max'}
+        # Both close and adj_close are stored, see bars_to_frame()
+        frame = yf.Ticker(ticker).history(auto_adjust=False, **kwargs)
+        if frame.empty:
+            return np.empty(0, dtype=PRICE_DTYPE)
+
+        dates = frame.index.tz_localize(None).normalize().values.astype('datetime64[D]')
+        # Drop the bar of a session that has not closed yet
+        keep = dates <= np.datetime64(cutoff)
+        if start:
+            keep &= dates >= np.datetime64(start)
+
+        bars = np.empty(int(keep.sum()), dtype=PRICE_DTYPE)
+        bars['date'] = dates[keep]
+        for field, column in YFINANCE_COLUMNS.items():
+            bars[field] = frame[column].to_numpy(dtype='f8')[keep]
+        return bars
+
+    @contextmanager
+    def _write_lock(self, ticker):
+        with open(self.root / f"{ticker}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _same_prices(downloaded, stored):
+    return all(np.isclose(downloaded[field], stored[field], rtol=1e-6) for field in ('close', 'adj_close'))
+
+
+price_store = PriceStore(settings.PRICE_STORE_DIR)
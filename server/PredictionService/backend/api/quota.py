@@ -0,0 +1,185 @@
+import time
+from datetime import datetime, timedelta
+
+from django_redis import get_redis_connection
+from pymongo import UpdateOne
+
+from .subscription_cache import invalidate_user_predictions
+
+FREE_DAILY_LIMIT = 5
+QUOTA_WINDOW = 60 * 60 * 24  # usage resets 24h after the first prediction of the window
+
+# Users whose usage changed since the last flush to MongoDB
+DIRTY_USERS_KEY = 'quota_dirty_users'
+# Expired premium users to switch to the free plan on the next flush
+PENDING_DOWNGRADES_KEY = 'quota_pending_downgrades'
+
+# Checks the limit and counts `cost` predictions in one atomic round trip.
+# KEYS[1] usage hash, KEYS[2] dirty set
+# ARGV: limit, window, now, user id, seed usage, seed reset time, cost
+CONSUME_QUOTA_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    -- Nothing in Redis (first use or Redis was flushed): start from MongoDB's
+    -- usage if its window is still open, otherwise from a new window
+    local seed_used = tonumber(ARGV[5])
+    local seed_reset = tonumber(ARGV[6])
+    local window = tonumber(ARGV[2])
+    if seed_used > 0 and seed_reset + window > tonumber(ARGV[3]) then
+        redis.call('HSET', KEYS[1], 'used', seed_used, 'reset_at', seed_reset)
+        redis.call('EXPIREAT', KEYS[1], math.ceil(seed_reset + window))
+    end
+end
+
+local used = tonumber(redis.call('HGET', KEYS[1], 'used') or '0')
+local limit = tonumber(ARGV[1])
+local cost = tonumber(ARGV[7])
+if limit >= 0 and used + cost > limit then
+    return {0, used}
+end
+
+used = redis.call('HINCRBY', KEYS[1], 'used', cost)
+if used == cost then
+    redis.call('HSET', KEYS[1], 'reset_at', ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+redis.call('SADD', KEYS[2], ARGV[4])
+return {1, used}
+"""
+
+
+def usage_key(user_id):
+    return f"quota_usage:{user_id}"
+
+
+def downgrade_key(user_id):
+    return f"quota_downgraded:{user_id}"
+
+
+class QuotaLedger:
+    """
+    Daily prediction quota kept in Redis and written back to the
+    user_prediction collection in batches by `manage.py flush_quota_usage`,
+    so the request path makes no MongoDB writes.
+    """
+
+    def __init__(self):
+        self._consume_script = None
+
+    @property
+    def redis(self):
+        return get_redis_connection('default')
+
+    def consume(self, user_id, daily_limit, seed_usage=0, seed_reset_date=None, cost=1):
+        """
+        Count `cost` predictions for `user_id` unless they would go over the
+        limit, in which case none is counted.
+        `seed_usage` / `seed_reset_date` are the last values flushed to
+        MongoDB, used when Redis has no usage for the user.
+        Returns (allowed, used).
+        """
+        if self._consume_script is None:
+            self._consume_script = self.redis.register_script(CONSUME_QUOTA_SCRIPT)
+        seed_reset = seed_reset_date.timestamp() if seed_reset_date else 0
+        allowed, used = self._consume_script(
+            keys=[usage_key(user_id), DIRTY_USERS_KEY],
+            args=[daily_limit, QUOTA_WINDOW, time.time(), str(user_id), seed_usage or 0, seed_reset, cost],
+        )
+        return bool(allowed), used
+
+    def downgrade(self, user_id):
+        """
+        Queue the switch of an expired premium user to the free plan.
+        Returns True only for the first call, until the switch is flushed.
+        """
+        if not self.redis.set(downgrade_key(user_id), 1, nx=True, ex=QUOTA_WINDOW):
+            return False
+        self.redis.sadd(PENDING_DOWNGRADES_KEY, str(user_id))
+        return True
+
+    def flush(self, collection, batch_size=1000):
+        """
+        Write pending usage and plan downgrades to MongoDB with one
+        bulk_write per batch. Returns the number of users written.
+        """
+        redis = self.redis
+        flushed = 0
+
+        downgrades = redis.spop(PENDING_DOWNGRADES_KEY, batch_size) or []
+        if downgrades:
+            now = datetime.now()
+            try:
+                collection.bulk_write([
+                    # Only still expired: a renewal consumed since the downgrade was queued wins
+                    UpdateOne({
+                        'user_id': _user_id(user_id),
+                        'subscription_details.subscription_plan_type': 'premium',
+                        'subscription_details.end_date': {'$lt': now},
+                    }, {'$set': {
+                        'subscription_details.subscription_plan_type': 'free',
+                        'subscription_details.daily_limit': FREE_DAILY_LIMIT,
+                    }})
+                    for user_id in downgrades
+                ], ordered=False)
+            except Exception:
+                # Put them back so the next flush retries
+                redis.sadd(PENDING_DOWNGRADES_KEY, *downgrades)
+                raise
+            redis.delete(*[downgrade_key(_user_id(user_id)) for user_id in downgrades])
+            invalidate_user_predictions([_user_id(user_id) for user_id in downgrades])
+
+        while True:
+            user_ids = redis.spop(DIRTY_USERS_KEY, batch_size)
+            if not user_ids:
+                break
+
+            pipe = redis.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.hgetall(usage_key(_user_id(user_id)))
+            usages = pipe.execute()
+
+            operations = []
+            written = []
+            for user_id, usage in zip(user_ids, usages):
+                if not usage:
+                    # The window ended before we got to it, nothing left to record
+                    continue
+                written.append(_user_id(user_id))
+                operations.append(UpdateOne(
+                    {'user_id': _user_id(user_id)},
+                    {
+                        '$set': {
+                            'prediction_usage.daily_usage': int(usage[b'used']),
+                            'prediction_usage.last_reset_date': datetime.fromtimestamp(float(usage[b'reset_at'])),
+                        },
+                        # Users seen for the first time get the default free plan
+                        '$setOnInsert': {
+                            'subscription_details': {
+                                'daily_limit': FREE_DAILY_LIMIT,
+                                'subscription_plan_type': 'free',
+                                'start_date': datetime.now(),
+                                'end_date': datetime.now() + timedelta(days=30),
+                            },
+                        },
+                    },
+                    upsert=True,
+                ))
+            if operations:
+                try:
+                    collection.bulk_write(operations, ordered=False)
+                except Exception:
+                    # Put them back so the next flush retries
+                    redis.sadd(DIRTY_USERS_KEY, *user_ids)
+                    raise
+                invalidate_user_predictions(written)
+            flushed += len(operations)
+
+        return flushed + len(downgrades)
+
+
+def _user_id(value):
+    user_id = value.decode() if isinstance(value, bytes) else value
+    # Requests without an X-User-Id header share the 'None' entry, as before
+    return None if user_id == 'None' else user_id
+
+
+quota_ledger = QuotaLedger()
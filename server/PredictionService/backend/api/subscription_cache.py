@@ -0,0 +1,46 @@
+"""
+Per-process cache of the users' user_prediction documents, so plan checks
+on the request path do not read MongoDB for active users.
+
+Writers of a document publish the user id and every process drops its copy:
+manage.py consume_kafka when a subscription changes, manage.py
+flush_quota_usage when it writes usage or a downgrade. Entries expire after
+SUBSCRIPTION_CACHE_TTL seconds in case an invalidation is missed.
+"""
+from django.conf import settings
+
+from .db_connection import get_collection
+from .local_cache import LocalCache
+from .metrics import SUBSCRIPTION_LOOKUPS
+
+SUBSCRIPTION_INVALIDATION_CHANNEL = 'subscription_cache_invalidate'
+
+# What the plan and quota checks read
+PROJECTION = {'_id': 0, 'subscription_details': 1, 'prediction_usage': 1}
+
+subscription_cache = LocalCache(
+    SUBSCRIPTION_INVALIDATION_CHANNEL,
+    max_size=settings.SUBSCRIPTION_CACHE_SIZE,
+    ttl=settings.SUBSCRIPTION_CACHE_TTL,
+)
+
+
+def get_user_prediction(user_id):
+    """The user's subscription_details and prediction_usage, {} for users without a document."""
+    # Requests without an X-User-Id header share the 'None' entry, as in the quota ledger
+    key = str(user_id)
+    user_prediction = subscription_cache.get(key)
+    if user_prediction is not None:
+        SUBSCRIPTION_LOOKUPS.labels(result='hit').inc()
+        return user_prediction
+
+    SUBSCRIPTION_LOOKUPS.labels(result='miss').inc()
+    generation = subscription_cache.generation()
+    user_prediction = get_collection('user_prediction').find_one({'user_id': user_id}, PROJECTION) or {}
+    subscription_cache.set(key, user_prediction, generation)
+    return user_prediction
+
+
+def invalidate_user_predictions(user_ids):
+    """Called after writing the user_prediction documents of `user_ids`."""
+    subscription_cache.publish_invalidation(user_ids)
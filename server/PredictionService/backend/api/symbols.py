@@ -0,0 +1,166 @@
+import csv
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .prediction_cache import get_most_requested_tickers
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_ticker(value):
+    """A requested ticker as it is checked, cached and predicted: stripped and upper case."""
+    return value.strip().upper() if value else value
+
+
+def read_symbols_file(path):
+    """Tickers from a symbol master CSV with a Symbol column."""
+    with open(path, newline='') as f:
+        return [row['Symbol'].strip() for row in csv.DictReader(f) if row.get('Symbol')]
+
+
+def load_universe(symbols=None, symbols_file=None, top=0, limit=None, stderr=None):
+    """
+    Tickers to process in bulk jobs: the explicit comma-separated `symbols`
+    if given, otherwise the `top` most requested tickers followed by the
+    symbols file. Duplicates are dropped, order is kept, `limit` caps the size.
+    """
+    if symbols:
+        tickers = [normalize_ticker(s) for s in symbols.split(',') if s.strip()]
+    else:
+        tickers = []
+        # Most requested first so a limit keeps the hottest symbols
+        if top > 0:
+            tickers.extend(get_most_requested_tickers(top))
+        if symbols_file and os.path.exists(symbols_file):
+            tickers.extend(read_symbols_file(symbols_file))
+        elif symbols_file and stderr is not None:
+            stderr.write(f"Symbols file not found: {symbols_file}")
+
+    tickers = list(dict.fromkeys(tickers))
+    if limit is not None:
+        tickers = tickers[:limit]
+    return tickers
+
+
+def add_universe_arguments(parser, top=500):
+    """Add the --symbols, --symbols-file, --top and --limit options of a bulk command."""
+    parser.add_argument('--symbols', help='Comma-separated tickers, instead of the symbols file / top requested tickers')
+    parser.add_argument('--symbols-file', default=settings.SYMBOLS_FILE,
+                        help='CSV with a Symbol column (defaults to the frontend symbol master)')
+    parser.add_argument('--top', type=int, default=top,
+                        help='Also include the N most requested tickers (0 to disable)')
+    parser.add_argument('--limit', type=int, default=None, help='Cap the number of symbols')
+
+
+def universe_from_options(options, stderr=None):
+    """load_universe() of the options added by add_universe_arguments()."""
+    return load_universe(
+        symbols=options['symbols'],
+        symbols_file=options['symbols_file'],
+        top=options['top'],
+        limit=options['limit'],
+        stderr=stderr,
+    )
+
+
+class SymbolIndex:
+    """
+    The symbol master in memory, to reject unknown tickers before any quota
+    or model work and to back prefix search.
+
+    Symbols (upper case) and security names are kept in sorted tuples
+    searched with bisect. The file's mtime is checked at most every
+    `check_interval` seconds and the index rebuilt when it changed, so a new
+    symbol master is picked up without a restart. While the file cannot be
+    read the index is empty and every ticker is accepted.
+    """
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        # (symbols, names, (lower-case name, position) pairs), replaced as a whole on reload
+        self._index = ((), (), ())
+        self._mtime = None
+        self._checked_at = None
+        self._missing = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._current()[0])
+
+    def is_known(self, ticker):
+        symbols = self._current()[0]
+        if not symbols:
+            return True
+        ticker = ticker.upper()
+        position = bisect_left(symbols, ticker)
+        return position < len(symbols) and symbols[position] == ticker
+
+    def search(self, query, limit=10):
+        """Symbols starting with `query`, then security names starting with it, as dicts."""
+        symbols, names, name_keys = self._current()
+        matches = []
+
+        prefix = query.upper()
+        position = bisect_left(symbols, prefix)
+        while position < len(symbols) and len(matches) < limit and symbols[position].startswith(prefix):
+            matches.append(position)
+            position += 1
+
+        prefix = query.lower()
+        position = bisect_left(name_keys, (prefix,))
+        while position < len(name_keys) and len(matches) < limit and name_keys[position][0].startswith(prefix):
+            if name_keys[position][1] not in matches:
+                matches.append(name_keys[position][1])
+            position += 1
+
+        return [{'symbol': symbols[match], 'name': names[match]} for match in matches]
+
+    def reload(self):
+        """Rebuild the index from the file now, whether or not it changed."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._load()
+
+    def _current(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                    self._checked_at = now
+                    self._load(only_if_changed=True)
+        return self._index
+
+    def _load(self, only_if_changed=False):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if only_if_changed and mtime == self._mtime:
+                return
+            with open(self.path, newline='') as f:
+                rows = {
+                    row['Symbol'].strip().upper(): (row.get('Security Name') or '').strip()
+                    for row in csv.DictReader(f) if row.get('Symbol')
+                }
+        except OSError as e:
+            if not self._missing:
+                logger.warning("Cannot read the symbol master %s, accepting every ticker: %s", self.path, e)
+            self._index = ((), (), ())
+            self._mtime = None
+            self._missing = True
+            return
+
+        symbols = tuple(sorted(rows))
+        names = tuple(rows[symbol] for symbol in symbols)
+        name_keys = tuple(sorted((name.lower(), position) for position, name in enumerate(names) if name))
+        self._index = (symbols, names, name_keys)
+        self._mtime = mtime
+        self._missing = False
+        logger.info("Loaded %d symbols from %s", len(symbols), self.path)
+
+
+symbol_index = SymbolIndex(settings.SYMBOLS_FILE, settings.SYMBOL_INDEX_CHECK_INTERVAL)
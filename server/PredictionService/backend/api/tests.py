@@ -1,3 +1,1132 @@
-from django.test import TestCase
+"""
+Run from the backend directory against fakeredis and mongomock:
 
-# Create your tests here.
+    python manage.py test api --settings=benchmarks.settings
+"""
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+import mongomock
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django_redis import get_redis_connection
+
+from .local_cache import LocalCache, local_prediction_cache
+from .market_calendar import is_session, last_close_date, next_close_after
+from .prediction_cache import (
+    PredictionPendingError,
+    aget_or_compute_prediction,
+    get_or_compute_prediction,
+    get_or_compute_predictions,
+    get_single_flight_metrics,
+    prediction_lock_key,
+)
+from .prediction_codec import FLAG_ZLIB, HEADER, PredictionDecodeError, decode_prediction, encode_prediction
+from .prediction_jobs import JOB_QUEUE_KEY, PredictionJobQueue, job_key, ticker_job_key
+from .price_store import PRICE_DTYPE, PriceStore
+from .quota import DIRTY_USERS_KEY, PENDING_DOWNGRADES_KEY, QUOTA_WINDOW, QuotaLedger, downgrade_key, usage_key
+from .symbols import add_universe_arguments, normalize_ticker, universe_from_options
+
+# The model code (api.ml_model) is not in the repository: tests give the hooks they need to a
+# stand-in module, as benchmarks.bench_prediction_api does
+if importlib.util.find_spec('api.ml_model') is None:
+    _package = types.ModuleType('api.ml_model')
+    _package.__path__ = []
+    _package.PredictSuperCode = types.ModuleType('api.ml_model.PredictSuperCode')
+    sys.modules['api.ml_model'] = _package
+    sys.modules['api.ml_model.PredictSuperCode'] = _package.PredictSuperCode
+
+
+@contextmanager
+def model_hooks(**hooks):
+    """Run with an api.ml_model.PredictSuperCode that has only `hooks`."""
+    from . import forecaster
+
+    module = types.ModuleType('api.ml_model.PredictSuperCode')
+    module.__dict__.update(hooks)
+    with mock.patch.object(sys.modules['api.ml_model'], 'PredictSuperCode', module), \
+            mock.patch.object(forecaster, 'PredictSuperCode', module):
+        yield module
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class MarketCalendarTests(SimpleTestCase):
+
+    def test_holidays_are_not_sessions(self):
+        self.assertFalse(is_session(date(2025, 12, 25)))
+        self.assertFalse(is_session(date(2025, 7, 4)))
+        self.assertFalse(is_session(date(2025, 7, 5)))
+        self.assertTrue(is_session(date(2025, 12, 26)))
+
+    def test_last_close_skips_holidays(self):
+        # Thanksgiving evening: the last session is the day before
+        self.assertEqual(last_close_date(utc(2025, 11, 27, 22)), date(2025, 11, 26))
+
+    def test_close_follows_daylight_saving_time(self):
+        # 16:00 New York is 20:00 UTC in summer and 21:00 UTC in winter
+        self.assertEqual(last_close_date(utc(2025, 7, 7, 20, 5)), date(2025, 7, 7))
+        self.assertEqual(last_close_date(utc(2025, 1, 6, 20, 5)), date(2025, 1, 3))
+
+    def test_early_close(self):
+        self.assertEqual(next_close_after(date(2025, 11, 26)), utc(2025, 11, 28, 18))
+        self.assertEqual(last_close_date(utc(2025, 11, 28, 18, 30)), date(2025, 11, 28))
+
+    def test_next_close_skips_holidays(self):
+        self.assertEqual(next_close_after(date(2025, 7, 3)), utc(2025, 7, 7, 20))
+        self.assertEqual(next_close_after(date(2025, 12, 24)), utc(2025, 12, 26, 21))
+
+
+def make_bars(start, count, factor=1.0):
+    bars = np.zeros(count, dtype=PRICE_DTYPE)
+    bars['date'] = np.busday_offset(np.datetime64(start), np.arange(count))
+    bars['close'] = 100 + np.arange(count)
+    bars['adj_close'] = bars['close'] * factor
+    return bars
+
+
+class PriceStoreRefreshTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.store = PriceStore(tmp_dir.name)
+        self.cutoff = date(2025, 3, 7)
+        patcher = mock.patch('api.price_store.last_close_date', side_effect=lambda: self.cutoff)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def download(self, *results):
+        return mock.patch.object(self.store, '_download', side_effect=list(results))
+
+    def test_ticker_is_checked_once_the_close_bar_is_stored(self):
+        with self.download(make_bars('2025-03-03', 5)) as download:
+            self.assertEqual(len(self.store.bars('AAPL')), 5)
+            self.store.bars('AAPL')
+            self.assertEqual(self.store.refresh('AAPL'), 0)
+            self.assertEqual(download.call_count, 1)
+        self.assertEqual(self.store.checked_through('AAPL'), self.cutoff)
+
+    def test_close_bar_not_published_yet_is_retried_after_a_backoff(self):
+        # Right after the close the download stops at the previous session
+        with self.download(make_bars('2025-03-03', 4)) as download:
+            self.assertEqual(len(self.store.bars('LATE')), 4)
+            self.store.bars('LATE')
+            self.assertEqual(download.call_count, 1)
+        self.assertIsNone(self.store.checked_through('LATE'))
+        self.assertTrue(self.store.attempted_recently('LATE'))
+
+        later = time.time() + 901
+        with mock.patch('api.price_store.time.time', return_value=later), \
+                self.download(make_bars('2025-03-03', 5)[3:]) as download:
+            self.assertFalse(self.store.attempted_recently('LATE'))
+            self.assertEqual(len(self.store.bars('LATE')), 5)
+            self.store.bars('LATE')
+            self.assertEqual(download.call_count, 1)
+        self.assertEqual(self.store.checked_through('LATE'), self.cutoff)
+
+    def test_download_returning_nothing_yet_is_not_marked_checked(self):
+        with self.download(make_bars('2025-03-03', 0)):
+            self.assertIsNone(self.store.bars('NEW'))
+        self.assertIsNone(self.store.checked_through('NEW'))
+        self.assertTrue(self.store.attempted_recently('NEW'))
+
+    def test_failed_download_is_retried(self):
+        with self.download(OSError('network')):
+            with self.assertRaises(OSError):
+                self.store.bars('FAIL')
+        self.assertIsNone(self.store.checked_through('FAIL'))
+        self.assertFalse(self.store.attempted_recently('FAIL'))
+        with self.download(make_bars('2025-03-03', 5)) as download:
+            self.assertEqual(len(self.store.bars('FAIL')), 5)
+            self.assertEqual(download.call_count, 1)
+
+    def test_full_refresh_ignores_the_marker(self):
+        with self.download(make_bars('2025-03-03', 5), make_bars('2025-03-03', 5)) as download:
+            self.store.refresh('FULL')
+            self.assertEqual(self.store.refresh('FULL'), 0)
+            self.assertEqual(self.store.refresh('FULL', full=True), 5)
+            self.assertEqual(download.call_count, 2)
+
+    def test_refresh_appends_after_an_unchanged_overlapping_bar(self):
+        self.cutoff = date(2025, 3, 5)
+        with self.download(make_bars('2025-03-03', 3)):
+            self.store.refresh('AAPL')
+        self.cutoff = date(2025, 3, 7)
+        with self.download(make_bars('2025-03-03', 5)[2:]) as download:
+            self.assertEqual(self.store.refresh('AAPL'), 2)
+        self.assertEqual(download.call_args.args[1], date(2025, 3, 5))
+        self.assertEqual(self.store.read('AAPL')['close'].tolist(), [100, 101, 102, 103, 104])
+
+    def test_readjusted_history_is_downloaded_again(self):
+        self.cutoff = date(2025, 3, 5)
+        with self.download(make_bars('2025-03-03', 3)):
+            self.store.refresh('DIV')
+        # A dividend re-adjusted every earlier bar: the overlapping one no longer matches
+        self.cutoff = date(2025, 3, 7)
+        readjusted = make_bars('2025-03-03', 5, factor=0.98)
+        with self.download(readjusted[2:], readjusted) as download:
+            self.assertEqual(self.store.refresh('DIV'), 5)
+        self.assertIsNone(download.call_args.args[1])
+        bars = self.store.read('DIV')
+        np.testing.assert_allclose(bars['adj_close'], bars['close'] * 0.98)
+
+    def test_models_get_adjusted_prices(self):
+        from .price_store import bars_to_frame
+        from .windowing import PRICE_FIELDS, price_buffer
+
+        bars = make_bars('2025-03-03', 3, factor=0.5)
+        bars['open'] = bars['close'] - 1
+        frame = bars_to_frame(bars)
+        np.testing.assert_allclose(frame['Close'], bars['adj_close'])
+        np.testing.assert_allclose(frame['Open'], (bars['close'] - 1) * 0.5)
+        np.testing.assert_allclose(frame['Volume'], bars['volume'])
+        buffer = price_buffer(bars)
+        np.testing.assert_allclose(buffer[:, PRICE_FIELDS.index('close')], bars['adj_close'])
+        np.testing.assert_allclose(buffer[:, PRICE_FIELDS.index('open')], (bars['close'] - 1) * 0.5)
+
+
+class TickerNormalizationTests(SimpleTestCase):
+
+    def test_case_variants_share_one_ticker(self):
+        self.assertEqual(normalize_ticker(' aapl '), 'AAPL')
+        self.assertEqual(normalize_ticker('brk.b'), 'BRK.B')
+        self.assertIsNone(normalize_ticker(None))
+
+    def test_lower_case_request_uses_the_upper_case_cache_key(self):
+        from django.test import Client
+
+        with mock.patch('api.views.unknown_tickers', return_value=[]), \
+                mock.patch('api.views.PredictionPriceView._check_subscription_status', return_value='premium'), \
+                mock.patch('api.views.get_or_compute_prediction', return_value={'predictions': []}) as compute:
+            response = Client().get('/api/v1/prediction/', {'ticker': 'aapl'}, HTTP_X_USER_ID='u1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(compute.call_args[0][0], 'AAPL')
+
+    def test_missing_symbols_file_fails_startup_when_required(self):
+        from django.apps import apps
+        from django.core.exceptions import ImproperlyConfigured
+
+        with override_settings(SYMBOLS_FILE_REQUIRED=True, SYMBOLS_FILE='/nonexistent/symbols.csv'):
+            with self.assertRaises(ImproperlyConfigured):
+                apps.get_app_config('api').ready()
+
+
+class AsyncBatchPredictionTests(SimpleTestCase):
+
+    def get(self, symbols):
+        import asyncio
+
+        from django.test import RequestFactory
+
+        from .views import AsyncBatchPredictionPriceView
+
+        request = RequestFactory().get('/api/v1/prediction/batch/', {'symbols': symbols}, HTTP_X_USER_ID='u1')
+        return asyncio.run(AsyncBatchPredictionPriceView.as_view()(request))
+
+    def setUp(self):
+        for patcher in (
+            mock.patch('api.views.unknown_tickers', return_value=[]),
+            mock.patch('api.views.BatchPredictionPriceView._cached_predictions',
+                       side_effect=lambda tickers: ({'AAPL': {'cached': True}}, [t for t in tickers if t != 'AAPL'])),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.quota = mock.patch('api.views.PredictionPriceView._check_subscription_status', return_value='premium')
+        self.check_subscription = self.quota.start()
+        self.addCleanup(self.quota.stop)
+
+    def test_misses_run_in_the_compute_pool(self):
+        get_redis_connection('default').flushall()
+        async def run(fn, tickers, cost=1):
+            return {ticker: {'predictions': [1.0], 'dates': ['2025-03-10'], 'mape_values': 1.0} for ticker in tickers}, {}
+
+        with mock.patch('api.views.compute_pool') as pool, mock.patch('api.views.record_prediction_requests'):
+            pool.saturated = False
+            pool.run.side_effect = run
+            response = self.get('aapl,msft,nvda')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(pool.run.call_args.args[1], ['MSFT', 'NVDA'])
+        self.assertEqual(pool.run.call_args.kwargs['cost'], 2)
+
+    def test_saturated_pool_answers_503_without_charging_the_quota(self):
+        with mock.patch('api.views.compute_pool') as pool:
+            pool.saturated = True
+            response = self.get('aapl,msft')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.check_subscription.assert_not_called()
+        pool.run.assert_not_called()
+
+
+class ComputePoolTests(SimpleTestCase):
+
+    def test_a_batch_takes_a_pending_slot_per_ticker(self):
+        import asyncio
+
+        from .compute_pool import BoundedComputePool, ComputePoolSaturated
+
+        pool = BoundedComputePool(max_workers=1, max_pending=3)
+        pool._pending = 2
+        with self.assertRaises(ComputePoolSaturated):
+            asyncio.run(pool.run(len, 'ab', cost=2))
+        self.assertEqual(pool._pending, 2)
+
+    def test_a_dead_worker_is_replaced(self):
+        import asyncio
+        import os
+        from concurrent.futures.process import BrokenProcessPool
+
+        from .compute_pool import BoundedComputePool
+
+        pool = BoundedComputePool(max_workers=1, max_pending=2)
+        self.addCleanup(lambda: pool._executor and pool._executor.shutdown())
+        first_worker = asyncio.run(pool.run(os.getpid))
+        # Like an OOM kill: the worker is gone without reporting back
+        with self.assertRaises(BrokenProcessPool):
+            asyncio.run(pool.run(os._exit, 1))
+        self.assertNotEqual(asyncio.run(pool.run(os.getpid)), first_worker)
+        self.assertEqual(pool._pending, 0)
+
+
+class QuotaLedgerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection('default')
+        self.redis.flushall()
+        self.ledger = QuotaLedger()
+        self.collection = mongomock.MongoClient().db.user_prediction
+
+    def test_limit_holds_under_concurrent_requests(self):
+        results = []
+        barrier = threading.Barrier(20)
+
+        def consume():
+            barrier.wait()
+            results.append(self.ledger.consume('u1', 5))
+
+        threads = [threading.Thread(target=consume) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(allowed for allowed, _ in results), 5)
+        self.assertEqual(int(self.redis.hget(usage_key('u1'), 'used')), 5)
+
+    def test_usage_is_seeded_from_mongodb_when_redis_lost_it(self):
+        reset = datetime.now() - timedelta(hours=1)
+        self.assertEqual(self.ledger.consume('u1', 5, seed_usage=4, seed_reset_date=reset), (True, 5))
+        self.assertEqual(self.ledger.consume('u1', 5, seed_usage=4, seed_reset_date=reset), (False, 5))
+        self.assertAlmostEqual(
+            self.redis.ttl(usage_key('u1')), QUOTA_WINDOW - 60 * 60, delta=5)
+
+    def test_expired_seed_starts_a_new_window(self):
+        reset = datetime.now() - timedelta(seconds=QUOTA_WINDOW + 60)
+        self.assertEqual(self.ledger.consume('u1', 5, seed_usage=5, seed_reset_date=reset), (True, 1))
+
+    def test_usage_resets_when_the_window_expires(self):
+        for _ in range(5):
+            self.ledger.consume('u1', 5)
+        self.assertEqual(self.ledger.consume('u1', 5), (False, 5))
+        with mock.patch('time.time', return_value=time.time() + QUOTA_WINDOW + 1):
+            self.assertEqual(self.ledger.consume('u1', 5), (True, 1))
+
+    def test_cost_over_what_is_left_is_rejected_whole(self):
+        self.assertEqual(self.ledger.consume('u1', 5, cost=3), (True, 3))
+        self.assertEqual(self.ledger.consume('u1', 5, cost=3), (False, 3))
+        self.assertEqual(self.ledger.consume('u1', 5, cost=2), (True, 5))
+        self.assertEqual(self.ledger.consume('u2', 5, cost=6), (False, 0))
+        self.assertFalse(self.redis.exists(usage_key('u2')))
+
+    def test_batch_is_charged_a_prediction_per_ticker(self):
+        from django.test import Client
+
+        with mock.patch('api.views.unknown_tickers', return_value=[]), \
+                mock.patch('api.views.get_user_prediction', return_value={}), \
+                mock.patch('api.views.BatchPredictionPriceView._get_price_predictions', return_value=({}, {})):
+            client = Client()
+            first = client.get('/api/v1/prediction/batch/', {'symbols': 'AAPL,MSFT,NVDA'}, HTTP_X_USER_ID='u1')
+            second = client.get('/api/v1/prediction/batch/', {'symbols': 'AAPL,MSFT,NVDA'}, HTTP_X_USER_ID='u1')
+            third = client.get('/api/v1/prediction/batch/', {'symbols': 'AAPL,MSFT'}, HTTP_X_USER_ID='u1')
+        self.assertEqual([first.status_code, second.status_code, third.status_code], [200, 403, 200])
+        self.assertEqual(int(self.redis.hget(usage_key('u1'), 'used')), 5)
+
+    def test_unlimited_plan(self):
+        for _ in range(10):
+            allowed, used = self.ledger.consume('u1', -1)
+        self.assertEqual((allowed, used), (True, 10))
+
+    def test_downgrade_is_queued_once_and_flushed(self):
+        self.collection.insert_one({'user_id': 'u1', 'subscription_details': {
+            'subscription_plan_type': 'premium', 'daily_limit': -1, 'end_date': datetime.now() - timedelta(days=1)}})
+        self.assertTrue(self.ledger.downgrade('u1'))
+        self.assertFalse(self.ledger.downgrade('u1'))
+
+        self.assertEqual(self.ledger.flush(self.collection), 1)
+        details = self.collection.find_one({'user_id': 'u1'})['subscription_details']
+        self.assertEqual((details['subscription_plan_type'], details['daily_limit']), ('free', 5))
+        self.assertFalse(self.redis.exists(downgrade_key('u1')))
+        self.assertEqual(self.redis.scard(PENDING_DOWNGRADES_KEY), 0)
+        # Switched: a later expiry check can queue it again
+        self.assertTrue(self.ledger.downgrade('u1'))
+
+    def test_renewal_before_the_flush_is_not_downgraded(self):
+        self.collection.insert_one({'user_id': 'u1', 'subscription_details': {
+            'subscription_plan_type': 'premium', 'daily_limit': -1, 'end_date': datetime.now() - timedelta(days=1)}})
+        self.assertTrue(self.ledger.downgrade('u1'))
+        # The Kafka consumer writes the renewal before the next flush
+        self.collection.update_one(
+            {'user_id': 'u1'}, {'$set': {'subscription_details.end_date': datetime.now() + timedelta(days=30)}})
+
+        self.ledger.flush(self.collection)
+        details = self.collection.find_one({'user_id': 'u1'})['subscription_details']
+        self.assertEqual((details['subscription_plan_type'], details['daily_limit']), ('premium', -1))
+        self.assertFalse(self.redis.exists(downgrade_key('u1')))
+
+    def test_flush_writes_usage(self):
+        self.ledger.consume('u1', 5)
+        self.ledger.consume('u1', 5)
+        self.ledger.consume('u2', 5)
+        self.assertEqual(self.ledger.flush(self.collection), 2)
+        document = self.collection.find_one({'user_id': 'u1'})
+        self.assertEqual(document['prediction_usage']['daily_usage'], 2)
+        self.assertEqual(document['subscription_details']['subscription_plan_type'], 'free')
+        self.assertEqual(self.redis.scard(DIRTY_USERS_KEY), 0)
+        self.assertEqual(self.ledger.flush(self.collection), 0)
+
+    def test_failed_flush_requeues_usage_and_downgrades(self):
+        self.ledger.consume('u1', 5)
+        self.ledger.downgrade('u2')
+        failing = mock.Mock()
+        failing.bulk_write.side_effect = OSError('mongod down')
+        with self.assertRaises(OSError):
+            self.ledger.flush(failing)
+        self.assertEqual(self.redis.smembers(PENDING_DOWNGRADES_KEY), {b'u2'})
+
+        failing.bulk_write.side_effect = [None, OSError('mongod down')]
+        with self.assertRaises(OSError):
+            self.ledger.flush(failing)
+        self.assertEqual(self.redis.smembers(DIRTY_USERS_KEY), {b'u1'})
+
+        self.assertEqual(self.ledger.flush(self.collection), 1)
+        self.assertEqual(self.collection.find_one({'user_id': 'u1'})['prediction_usage']['daily_usage'], 1)
+
+
+@override_settings(PREDICTION_LOCK_POLL_INTERVAL=0.01)
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        get_redis_connection('default').flushall()
+        local_prediction_cache.clear()
+        self.computed = []
+
+    def compute(self, ticker):
+        self.computed.append(ticker)
+        time.sleep(0.2)
+        return {'predictions': [1.0], 'dates': ['2025-03-10'], 'mape_values': 1.0}
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+        barrier = threading.Barrier(8)
+
+        def request():
+            barrier.wait()
+            results.append(get_or_compute_prediction('AAPL', self.compute))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.computed, ['AAPL'])
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result['predictions'] == [1.0] for result in results))
+        self.assertEqual(get_single_flight_metrics(), {'computed': 1, 'coalesced': 7})
+
+    def test_async_concurrent_misses_compute_once(self):
+        import asyncio
+
+        async def compute(ticker):
+            self.computed.append(ticker)
+            await asyncio.sleep(0.2)
+            return {'predictions': [1.0], 'dates': ['2025-03-10'], 'mape_values': 1.0}
+
+        async def requests():
+            return await asyncio.gather(*(aget_or_compute_prediction('AAPL', compute) for _ in range(8)))
+
+        results = asyncio.run(requests())
+        self.assertEqual(self.computed, ['AAPL'])
+        self.assertTrue(all(result['predictions'] == [1.0] for result in results))
+        self.assertEqual(get_single_flight_metrics(), {'computed': 1, 'coalesced': 7})
+
+    @override_settings(PREDICTION_LOCK_WAIT_TIMEOUT=0.1)
+    def test_waiter_times_out_while_the_holder_computes(self):
+        lock = cache.lock(prediction_lock_key('AAPL'), timeout=60)
+        self.assertTrue(lock.acquire(blocking=False))
+        with self.assertRaises(PredictionPendingError):
+            get_or_compute_prediction('AAPL', self.compute)
+        self.assertEqual(self.computed, [])
+        self.assertEqual(get_single_flight_metrics(), {'wait_timeout': 1})
+
+        # The holder gave up without a result: the next request computes it
+        lock.release()
+        self.assertEqual(get_or_compute_prediction('AAPL', self.compute)['predictions'], [1.0])
+        self.assertEqual(self.computed, ['AAPL'])
+
+    def test_waiter_timeout_answers_503(self):
+        from django.test import Client
+
+        with mock.patch('api.views.unknown_tickers', return_value=[]), \
+                mock.patch('api.views.PredictionPriceView._check_subscription_status', return_value='premium'), \
+                mock.patch('api.views.get_or_compute_prediction', side_effect=PredictionPendingError('pending')):
+            response = Client().get('/api/v1/prediction/', {'ticker': 'AAPL'}, HTTP_X_USER_ID='u1')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    def test_lock_of_a_dead_holder_is_taken_over(self):
+        # A worker that died while computing: its lock expires and a waiter computes instead
+        self.assertTrue(cache.lock(prediction_lock_key('AAPL'), timeout=0.2).acquire(blocking=False))
+        result = get_or_compute_prediction('AAPL', self.compute)
+        self.assertEqual(result['predictions'], [1.0])
+        self.assertEqual(self.computed, ['AAPL'])
+        self.assertEqual(get_single_flight_metrics(), {'computed': 1})
+
+    def compute_many(self, tickers):
+        self.computed.extend(tickers)
+        time.sleep(0.2)
+        return {ticker: {'predictions': [1.0], 'dates': ['2025-03-10'], 'mape_values': 1.0} for ticker in tickers}, {}
+
+    def test_concurrent_batches_compute_each_ticker_once(self):
+        results = []
+        barrier = threading.Barrier(6)
+
+        def request(tickers):
+            barrier.wait()
+            results.append(get_or_compute_predictions(tickers, self.compute_many))
+
+        threads = [threading.Thread(target=request, args=(tickers,))
+                   for tickers in [['AAPL', 'MSFT'], ['MSFT', 'NVDA'], ['AAPL', 'NVDA']] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(self.computed), ['AAPL', 'MSFT', 'NVDA'])
+        self.assertTrue(all(len(batch) == 2 and not errors for batch, errors in results))
+        self.assertEqual(get_single_flight_metrics(), {'computed': 3, 'coalesced': 9})
+
+    def test_async_batches_share_the_ticker_locks(self):
+        import asyncio
+
+        from .prediction_cache import aget_or_compute_predictions
+
+        async def compute(tickers):
+            return self.compute_many(tickers)
+
+        async def requests():
+            return await asyncio.gather(
+                aget_or_compute_predictions(['AAPL', 'MSFT'], compute),
+                aget_or_compute_predictions(['MSFT', 'AAPL'], compute),
+            )
+
+        results = asyncio.run(requests())
+        self.assertEqual(sorted(self.computed), ['AAPL', 'MSFT'])
+        self.assertTrue(all(set(batch) == {'AAPL', 'MSFT'} for batch, _ in results))
+
+    @override_settings(PREDICTION_LOCK_WAIT_TIMEOUT=0.1)
+    def test_batch_reports_tickers_still_computed_elsewhere(self):
+        self.assertTrue(cache.lock(prediction_lock_key('AAPL'), timeout=60).acquire(blocking=False))
+        results, errors = get_or_compute_predictions(['AAPL', 'MSFT'], self.compute_many)
+        self.assertEqual(list(results), ['MSFT'])
+        self.assertIn('still being computed', errors['AAPL'])
+        self.assertEqual(self.computed, ['MSFT'])
+        self.assertEqual(get_single_flight_metrics(), {'computed': 1, 'wait_timeout': 1})
+
+    def test_stale_copy_is_served_and_refreshed(self):
+        get_or_compute_prediction('AAPL', self.compute)
+        cache.delete_pattern('prediction_*')
+        local_prediction_cache.clear()
+        with mock.patch('api.prediction_cache.prediction_jobs') as jobs:
+            result = get_or_compute_prediction('AAPL', self.compute)
+        self.assertTrue(result['stale'])
+        jobs.enqueue.assert_called_once_with('AAPL')
+        self.assertEqual(self.computed, ['AAPL'])
+        self.assertEqual(get_single_flight_metrics(), {'computed': 1, 'stale_served': 1})
+
+
+class PredictionJobQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        get_redis_connection('default').flushall()
+        self.jobs = PredictionJobQueue()
+
+    def test_queued_ticker_is_not_enqueued_twice(self):
+        job_id, created = self.jobs.enqueue('AAPL')
+        self.assertTrue(created)
+        self.assertEqual(self.jobs.enqueue('AAPL'), (job_id, False))
+        self.assertEqual(self.jobs.enqueue('AAPL', premium=True), (job_id, False))
+        self.assertEqual(self.jobs.queued(), 1)
+        self.assertEqual(self.jobs.get(job_id)['status'], 'queued')
+
+    def test_premium_jobs_run_first(self):
+        aapl, _ = self.jobs.enqueue('AAPL')
+        msft, _ = self.jobs.enqueue('MSFT')
+        nvda, _ = self.jobs.enqueue('NVDA', premium=True)
+        # A premium request for a queued free job moves it forward, a free one never moves it back
+        self.jobs.enqueue('MSFT', premium=True)
+        self.jobs.enqueue('NVDA')
+        order = [self.jobs.pop(timeout=1) for _ in range(3)]
+        self.assertEqual(order, [(nvda, 'NVDA'), (msft, 'MSFT'), (aapl, 'AAPL')])
+
+    def test_pop_marks_the_job_running(self):
+        job_id, _ = self.jobs.enqueue('AAPL')
+        self.assertEqual(self.jobs.pop(timeout=1), (job_id, 'AAPL'))
+        self.assertEqual(self.jobs.get(job_id)['status'], 'running')
+        # Still deduplicated while it runs
+        self.assertEqual(self.jobs.enqueue('AAPL'), (job_id, False))
+        self.assertIsNone(self.jobs.pop(timeout=0.1))
+
+    def test_pop_skips_expired_jobs(self):
+        job_id, _ = self.jobs.enqueue('AAPL')
+        get_redis_connection('default').delete(job_key(job_id))
+        self.assertIsNone(self.jobs.pop(timeout=1))
+        self.assertEqual(get_redis_connection('default').zcard(JOB_QUEUE_KEY), 0)
+
+    def test_finish_stores_the_result_and_frees_the_ticker(self):
+        job_id, _ = self.jobs.enqueue('AAPL')
+        self.jobs.pop(timeout=1)
+        self.jobs.finish(job_id, 'AAPL', result={'predictions': [1.0]})
+        job = self.jobs.get(job_id)
+        self.assertEqual((job['status'], job['result']), ('done', {'predictions': [1.0]}))
+        self.assertIsNone(get_redis_connection('default').get(ticker_job_key('AAPL')))
+
+        next_id, created = self.jobs.enqueue('AAPL')
+        self.assertTrue(created)
+        self.assertNotEqual(next_id, job_id)
+
+        self.jobs.pop(timeout=1)
+        self.jobs.finish(next_id, 'AAPL', error='no data')
+        self.assertEqual(self.jobs.get(next_id)['error'], 'no data')
+        self.assertEqual(self.jobs.get(next_id)['status'], 'failed')
+
+    def test_wait_returns_the_unfinished_job_after_the_timeout(self):
+        job_id, _ = self.jobs.enqueue('AAPL')
+        started = time.monotonic()
+        self.assertEqual(self.jobs.wait(job_id, timeout=0.2)['status'], 'queued')
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertIsNone(self.jobs.wait('missing', timeout=0.2))
+
+    def test_wait_wakes_up_when_the_job_finishes(self):
+        job_id, _ = self.jobs.enqueue('AAPL')
+        self.jobs.pop(timeout=1)
+        timer = threading.Timer(0.1, self.jobs.finish, (job_id, 'AAPL'), {'result': {'predictions': []}})
+        timer.start()
+        self.addCleanup(timer.cancel)
+        started = time.monotonic()
+        self.assertEqual(self.jobs.wait(job_id, timeout=5)['status'], 'done')
+        self.assertLess(time.monotonic() - started, 5)
+
+
+def prediction(dates, predictions=None, mape=1.5):
+    predictions = predictions if predictions is not None else [100.25 + i for i in range(len(dates))]
+    return {'predictions': predictions, 'dates': list(dates), 'mape_values': mape}
+
+
+class PredictionCodecTests(SimpleTestCase):
+
+    def round_trip(self, result, compress=False):
+        decoded = decode_prediction(encode_prediction(result, compress=compress))
+        self.assertEqual(decoded, result)
+        return decoded
+
+    def test_business_days_across_weekends_and_holidays(self):
+        # Fri, Mon and the Thursday of Thanksgiving: offsets count business days, not sessions
+        self.round_trip(prediction(['2025-11-21', '2025-11-24', '2025-11-27', '2025-11-28']))
+
+    def test_weekend_dates_fall_back_to_calendar_days(self):
+        self.round_trip(prediction(['2025-03-07', '2025-03-08', '2025-03-09', '2025-03-10']))
+
+    def test_offsets_at_the_uint16_limit(self):
+        start = np.datetime64('2000-01-03')
+        last = np.busday_offset(start, 65535)
+        self.round_trip(prediction([str(start), str(last)]))
+        with self.assertRaises(ValueError):
+            encode_prediction(prediction([str(start), str(np.busday_offset(start, 65536))]))
+
+        weekend = np.datetime64('2000-01-01')
+        self.round_trip(prediction([str(weekend), str(weekend + 65535)]))
+        with self.assertRaises(ValueError):
+            encode_prediction(prediction([str(weekend), str(weekend + 65536)]))
+
+    def test_unsorted_dates_are_rejected(self):
+        with self.assertRaises(ValueError):
+            encode_prediction(prediction(['2025-03-10', '2025-03-07']))
+
+    def test_empty_predictions(self):
+        self.round_trip(prediction([]))
+        self.round_trip(prediction([]), compress=True)
+
+    def test_compressed_flag(self):
+        result = prediction(np.datetime_as_string(np.busday_offset('2025-03-10', np.arange(30))).tolist())
+        plain = encode_prediction(result)
+        compressed = encode_prediction(result, compress=True)
+        self.assertFalse(HEADER.unpack_from(plain)[1] & FLAG_ZLIB)
+        self.assertTrue(HEADER.unpack_from(compressed)[1] & FLAG_ZLIB)
+        self.assertEqual(decode_prediction(compressed), decode_prediction(plain))
+        self.round_trip(result, compress=True)
+
+    def test_float32_noise_is_rounded_away(self):
+        decoded = decode_prediction(encode_prediction(prediction(['2025-03-10'], [101.23])))
+        self.assertEqual(decoded['predictions'], [101.23])
+
+    def test_undecodable_values_raise(self):
+        encoded = encode_prediction(prediction(['2025-03-10', '2025-03-11']))
+        compressed = encode_prediction(prediction(['2025-03-10', '2025-03-11']), compress=True)
+        garbage = [
+            None,
+            'not bytes',
+            b'',
+            encoded[:HEADER.size - 1],
+            encoded[:-1],
+            encoded + b'\0',
+            bytes([99]) + encoded[1:],
+            compressed[:HEADER.size] + b'not zlib',
+            compressed[:-2],
+            b'\x80\x04\x95' + bytes(40),
+        ]
+        for data in garbage:
+            with self.subTest(data=data), self.assertRaises(PredictionDecodeError):
+                decode_prediction(data)
+
+
+class LocalCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LocalCache('test_cache_invalidate', max_size=3, ttl=60)
+        # No listener thread: invalidations are applied by the test itself
+        patcher = mock.patch.object(self.cache, '_ensure_subscribed')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_invalidation_drops_only_fills_of_its_key(self):
+        generation = self.cache.generation()
+        self.cache.invalidate(['AAPL'])
+        self.cache.set('AAPL', 'old', generation)
+        self.cache.set('MSFT', 'fresh', generation)
+        self.assertIsNone(self.cache.get('AAPL'))
+        self.assertEqual(self.cache.get('MSFT'), 'fresh')
+
+        # Read after the invalidation: cached
+        self.cache.set('AAPL', 'new', self.cache.generation())
+        self.assertEqual(self.cache.get('AAPL'), 'new')
+
+    def test_clear_drops_every_fill_in_flight(self):
+        generation = self.cache.generation()
+        self.cache.clear()
+        self.cache.set('AAPL', 'old', generation)
+        self.assertIsNone(self.cache.get('AAPL'))
+
+    def test_forgotten_invalidations_drop_older_fills(self):
+        generation = self.cache.generation()
+        self.cache.invalidate(['A', 'B', 'C', 'D'])
+        # A's invalidation no longer fits in the history, so a fill of A from before it is not trusted
+        self.cache.set('A', 'old', generation)
+        self.assertIsNone(self.cache.get('A'))
+        self.cache.set('A', 'new', self.cache.generation())
+        self.assertEqual(self.cache.get('A'), 'new')
+
+
+class UniverseOptionsTests(SimpleTestCase):
+
+    def options(self, *argv, **defaults):
+        import argparse
+
+        parser = argparse.ArgumentParser()
+        add_universe_arguments(parser, **defaults)
+        return vars(parser.parse_args(argv))
+
+    def test_defaults(self):
+        self.assertEqual(self.options()['top'], 500)
+        self.assertEqual(self.options(top=0)['top'], 0)
+
+    def test_explicit_symbols_are_deduplicated_and_limited(self):
+        options = self.options('--symbols', 'AAPL, MSFT,AAPL,NVDA', '--limit', '2')
+        self.assertEqual(universe_from_options(options), ['AAPL', 'MSFT'])
+
+    def test_explicit_symbols_are_upper_cased(self):
+        options = self.options('--symbols', 'aapl,AAPL, msft')
+        self.assertEqual(universe_from_options(options), ['AAPL', 'MSFT'])
+
+    def test_symbols_file_after_the_most_requested_tickers(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('Symbol,Security Name\nMSFT,Microsoft\nAAPL,Apple\n')
+            f.flush()
+            with mock.patch('api.symbols.get_most_requested_tickers', return_value=['AAPL']):
+                tickers = universe_from_options(self.options('--symbols-file', f.name, '--top', '1'))
+        self.assertEqual(tickers, ['AAPL', 'MSFT'])
+
+
+class CandidateTrainingTests(SimpleTestCase):
+
+    def train_candidate(self, ticker, candidate, dataset, should_stop):
+        self.trained.append((candidate, os.getpid()))
+        self.assertFalse(dataset['inputs'].flags.writeable)
+        mape = {'lstm': 0.04, 'gru': 0.02, 'tcn': 0.03}[candidate]
+        should_stop(1, mape)
+        return np.full(3, len(candidate)), ['2025-03-10'] * 3, mape, {'candidate': candidate}
+
+    def setUp(self):
+        self.trained = []
+
+    @override_settings(MODEL_TRAINING_WORKERS=4)
+    def test_workers_are_bounded(self):
+        from .candidate_training import training_workers
+
+        self.assertEqual(training_workers(['lstm', 'gru']), 2)
+        self.assertEqual(training_workers(['c%d' % i for i in range(16)]), 4)
+        with mock.patch('api.candidate_training.multiprocessing.parent_process', return_value=mock.Mock()):
+            self.assertEqual(training_workers(['lstm', 'gru']), 1)
+
+    def test_pool_worker_trains_the_candidates_in_process(self):
+        from .candidate_training import train_candidates
+
+        with model_hooks(train_candidate=self.train_candidate), \
+                mock.patch('api.candidate_training.multiprocessing.parent_process', return_value=mock.Mock()):
+            predictions, _, mape_values, artifacts = train_candidates(
+                'AAPL', {'inputs': np.zeros((4, 2)), 'lookback': 2}, ['lstm', 'gru', 'tcn'])
+        self.assertEqual(self.trained, [('lstm', os.getpid()), ('gru', os.getpid()), ('tcn', os.getpid())])
+        self.assertEqual(predictions.tolist(), [3, 3, 3])
+        self.assertEqual(mape_values, [0.04, 0.02, 0.03])
+        self.assertEqual(set(artifacts), {'lstm', 'gru', 'tcn'})
+
+
+@override_settings(MODEL_FULL_RETRAIN_DAYS=7, MODEL_FINE_TUNE_MAX_MAPE_INCREASE=0.1)
+class ForecasterTrainTests(SimpleTestCase):
+    cutoff = date(2025, 3, 10)
+
+    def setUp(self):
+        self.calls = []
+
+    def full_train(self, ticker):
+        self.calls.append('train')
+        return np.zeros(3), ['2025-03-11'] * 3, [0.05], {'lstm': b'full'}
+
+    def fine_tune(self, ticker, artifacts, previous_cutoff):
+        self.calls.append(('fine_tune', artifacts, previous_cutoff))
+        return np.ones(3), ['2025-03-11'] * 3, [0.052], {'lstm': b'tuned'}
+
+    def previous(self, full_retrain_cutoff):
+        training = {'kind': 'full', 'mape': 0.05, 'full_retrain_cutoff': full_retrain_cutoff, 'full_retrain_mape': 0.05}
+        return date(2025, 3, 7), {'lstm': b'previous'}, training
+
+    def train(self, previous):
+        from .forecaster import _train
+
+        with mock.patch('api.forecaster.model_registry.latest', return_value=previous) as latest:
+            result = _train('AAPL', self.cutoff, self.full_train)
+        self.latest = latest
+        return result
+
+    def test_recent_models_are_fine_tuned(self):
+        with model_hooks(fine_tune=self.fine_tune):
+            *_, artifacts, training = self.train(self.previous('2025-03-05'))
+        self.assertEqual(self.calls, [('fine_tune', {'lstm': b'previous'}, date(2025, 3, 7))])
+        self.latest.assert_called_once_with('AAPL', before=self.cutoff)
+        self.assertEqual(artifacts, {'lstm': b'tuned'})
+        self.assertEqual(training['kind'], 'fine_tune')
+        self.assertEqual(training['full_retrain_cutoff'], '2025-03-05')
+
+    def test_old_models_are_retrained(self):
+        with model_hooks(fine_tune=self.fine_tune):
+            *_, artifacts, training = self.train(self.previous('2025-03-03'))
+        self.assertEqual(self.calls, ['train'])
+        self.assertEqual(artifacts, {'lstm': b'full'})
+        self.assertEqual(training, {
+            'kind': 'full', 'mape': 0.05, 'full_retrain_cutoff': '2025-03-10', 'full_retrain_mape': 0.05,
+        })
+
+    def test_without_a_previous_model_the_ticker_is_retrained(self):
+        with model_hooks(fine_tune=self.fine_tune):
+            *_, training = self.train(None)
+        self.assertEqual(self.calls, ['train'])
+        self.assertEqual(training['kind'], 'full')
+
+    def test_without_a_fine_tune_hook_the_ticker_is_retrained(self):
+        with model_hooks():
+            *_, training = self.train(self.previous('2025-03-05'))
+        self.assertEqual(self.calls, ['train'])
+        self.latest.assert_not_called()
+        self.assertEqual(training['kind'], 'full')
+
+
+class ModelRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        from .model_store import ModelRegistry
+
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.registry = ModelRegistry(root.name, max_loaded=8, keep_cutoffs=2)
+
+    def artifacts(self, value):
+        import torch
+
+        return {'lstm': {'weights': torch.full((2,), float(value))}}
+
+    def test_latest_is_the_newest_cutoff_before_the_date(self):
+        for day, value in [(3, 1), (5, 2)]:
+            self.registry.save('AAPL', date(2025, 3, day), self.artifacts(value), training={'kind': 'full'})
+        cutoff, artifacts, training = self.registry.latest('AAPL', before=date(2025, 3, 10))
+        self.assertEqual(cutoff, date(2025, 3, 5))
+        self.assertEqual(artifacts['lstm']['weights'].tolist(), [2.0, 2.0])
+        self.assertEqual(training, {'kind': 'full'})
+        self.assertEqual(self.registry.latest('AAPL', before=date(2025, 3, 5))[0], date(2025, 3, 3))
+        self.assertIsNone(self.registry.latest('AAPL', before=date(2025, 3, 3)))
+        self.assertIsNone(self.registry.latest('MSFT', before=date(2025, 3, 10)))
+
+    def test_only_the_newest_cutoffs_are_kept(self):
+        for day in [7, 3, 5, 4]:
+            self.registry.save('AAPL', date(2025, 3, day), self.artifacts(day))
+        kept = sorted(path.name for path in (self.registry.root / 'AAPL').iterdir())
+        self.assertEqual(kept, ['2025-03-05', '2025-03-07'])
+
+    def test_a_failed_save_leaves_the_previous_models(self):
+        self.registry.save('AAPL', date(2025, 3, 3), self.artifacts(1))
+        with mock.patch('api.model_store.torch.save', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.registry.save('AAPL', date(2025, 3, 5), self.artifacts(2), training={'kind': 'full'})
+        self.assertEqual(self.registry.latest('AAPL', before=date(2025, 3, 10))[0], date(2025, 3, 3))
+        self.assertEqual([path.name for path in (self.registry.root / 'AAPL').iterdir()], ['2025-03-03'])
+
+    def test_saving_a_cutoff_again_replaces_its_models_and_exports(self):
+        cutoff = date(2025, 3, 5)
+        self.registry.save('AAPL', cutoff, self.artifacts(1))
+        self.registry.reject_export('AAPL', cutoff, 'lstm', 'onnx', 'diverged')
+        self.registry.save('AAPL', cutoff, self.artifacts(2))
+        self.assertFalse(self.registry.export_rejected('AAPL', cutoff, 'lstm', 'onnx'))
+        self.registry._loaded.clear()
+        self.assertEqual(self.registry.load('AAPL', cutoff)['lstm']['weights'].tolist(), [2.0, 2.0])
+        self.assertEqual([path.name for path in (self.registry.root / 'AAPL').iterdir()], ['2025-03-05'])
+
+
+class FakeKafkaMessage:
+
+    def __init__(self, offset, value):
+        self._offset = offset
+        self._value = json.dumps(value).encode()
+
+    def error(self):
+        return None
+
+    def value(self):
+        return self._value
+
+    def offset(self):
+        return self._offset
+
+
+class FakeKafkaConsumer:
+    """consume() returns the given batches, then stops the command as Ctrl-C would."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.commits = 0
+        self.closed = False
+
+    def subscribe(self, topics):
+        pass
+
+    def consume(self, num_messages, timeout):
+        if not self.batches:
+            raise KeyboardInterrupt
+        return self.batches.pop(0)
+
+    def commit(self, asynchronous=True):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+
+class ConsumeKafkaTests(SimpleTestCase):
+
+    def setUp(self):
+        from .db_connection import get_collection
+
+        get_redis_connection('default').flushall()
+        self.collection = get_collection('user_prediction')
+        self.collection.delete_many({})
+        self.offset = 0
+
+    def message(self, user_id, plan_type):
+        self.offset += 1
+        return FakeKafkaMessage(self.offset, {
+            'userId': user_id,
+            'subscriptionPlanId': f'{plan_type}-plan',
+            'subscriptionPlanType': plan_type,
+            'startDate': '2025-03-01T00:00:00',
+            'endDate': (datetime.now() + timedelta(days=30)).isoformat(),
+        })
+
+    def consume(self, *batches):
+        """Run manage.py consume_kafka over `batches`, returning the fake consumer."""
+        from django.core.management import call_command
+
+        self.consumer = FakeKafkaConsumer(batches)
+        with mock.patch('api.management.commands.consume_kafka.Consumer', return_value=self.consumer):
+            call_command('consume_kafka', report_interval=3600)
+        return self.consumer
+
+    def test_subscription_update_reaches_the_cached_plan(self):
+        from .views import PredictionPriceView
+
+        view = PredictionPriceView()
+        self.collection.insert_one({'user_id': 'u1', 'subscription_details': {'subscription_plan_type': 'free'}})
+        self.assertEqual(view._check_subscription_status('u1'), 'free')
+
+        self.consume([self.message('u1', 'premium')])
+        # The API worker's listener thread drops the cached plan when the consumer publishes
+        deadline = time.monotonic() + 5
+        while view._check_subscription_status('u1') != 'premium':
+            self.assertLess(time.monotonic(), deadline, 'the cached plan was not invalidated')
+            time.sleep(0.01)
+
+    def test_a_batch_writes_the_last_update_of_each_user(self):
+        batch = [self.message('u1', 'premium'), self.message('u2', 'premium'), self.message('u1', 'free')]
+        with mock.patch.object(type(self.collection), 'bulk_write', autospec=True,
+                               side_effect=type(self.collection).bulk_write) as bulk_write:
+            consumer = self.consume(batch)
+        self.assertEqual(bulk_write.call_count, 1)
+        self.assertEqual(len(bulk_write.call_args.args[1]), 2)
+        plans = {doc['user_id']: doc['subscription_details']['subscription_plan_type'] for doc in self.collection.find()}
+        self.assertEqual(plans, {'u1': 'free', 'u2': 'premium'})
+        self.assertEqual(consumer.commits, 1)
+
+    def test_a_failed_write_leaves_the_offsets_uncommitted(self):
+        with mock.patch.object(type(self.collection), 'bulk_write', side_effect=RuntimeError('primary stepped down')):
+            with self.assertRaises(RuntimeError):
+                self.consume([self.message('u1', 'premium')])
+        self.assertEqual(self.consumer.commits, 0)
+        self.assertTrue(self.consumer.closed)
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+
+class WindowingTests(SimpleTestCase):
+
+    def buffer(self, bars=10, features=3):
+        return np.arange(bars * features, dtype=np.float32).reshape(bars, features)
+
+    def test_window_shapes(self):
+        from .windowing import sliding_windows
+
+        inputs, targets = sliding_windows(self.buffer(), lookback=4, horizon=2)
+        self.assertEqual(inputs.shape, (5, 4, 3))
+        self.assertEqual(targets.shape, (5, 2, 3))
+        inputs, targets = sliding_windows(self.buffer(), lookback=4, horizon=2, step=2)
+        self.assertEqual(inputs.shape, (3, 4, 3))
+        self.assertEqual(sliding_windows(self.buffer(bars=5), lookback=4, horizon=2)[0].shape, (0, 4, 3))
+
+    def test_windows_are_read_only_views_of_the_buffer(self):
+        from .windowing import as_tensor, sliding_windows
+
+        buffer = self.buffer()
+        inputs, targets = sliding_windows(buffer, lookback=4, horizon=2)
+        self.assertTrue(np.shares_memory(inputs, buffer))
+        self.assertTrue(np.shares_memory(targets, buffer))
+        self.assertFalse(inputs.flags.writeable)
+        self.assertEqual(as_tensor(inputs).data_ptr(), buffer.ctypes.data)
+
+    def test_targets_follow_their_inputs(self):
+        from .windowing import sliding_windows
+
+        buffer = self.buffer()
+        inputs, targets = sliding_windows(buffer, lookback=4, horizon=2, step=3)
+        for i in range(len(inputs)):
+            start = i * 3
+            np.testing.assert_array_equal(inputs[i], buffer[start:start + 4])
+            np.testing.assert_array_equal(targets[i], buffer[start + 4:start + 6])
+
+    def test_scaling_in_place_is_seen_by_the_windows(self):
+        from .windowing import fit_min_max, scale_in_place, sliding_windows, unscale
+
+        buffer = self.buffer()
+        original = buffer.copy()
+        inputs, _ = sliding_windows(buffer, lookback=4, horizon=2)
+        low, scale = fit_min_max(buffer, rows=5)
+        self.assertIs(scale_in_place(buffer, low, scale), buffer)
+        np.testing.assert_allclose(buffer[:5].min(axis=0), 0)
+        np.testing.assert_allclose(buffer[:5].max(axis=0), 1)
+        np.testing.assert_array_equal(inputs[1], buffer[1:5])
+        np.testing.assert_allclose(unscale(buffer[:, 0], low, scale), original[:, 0], rtol=1e-6)
+
+
+@override_settings(PREDICTION_INFERENCE_MODE='torchscript', PREDICTION_EXPORT_MAX_MAPE_DRIFT=0.5)
+class ExportGuardTests(SimpleTestCase):
+    cutoff = date(2025, 3, 10)
+
+    def setUp(self):
+        import torch
+
+        from .model_store import ModelRegistry
+
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.registry = ModelRegistry(root.name, max_loaded=8, keep_cutoffs=2)
+        patcher = mock.patch('api.forecaster.model_registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        torch.manual_seed(0)
+        self.module = torch.nn.Linear(4, 1)
+        self.inputs = torch.rand(16, 4) + 1
+        with torch.no_grad():
+            self.module.bias.fill_(5.0)
+            self.targets = self.module(self.inputs) * 1.01
+        self.artifacts = {'lstm': {'weights': self.module.weight.detach().clone()}}
+        self.registry.save('AAPL', self.cutoff, self.artifacts)
+        self.built = 0
+
+    def build_models(self, ticker, artifacts):
+        self.built += 1
+        return {'lstm': (self.module, self.inputs, self.targets)}
+
+    def exported_models(self):
+        from .forecaster import _exported_models
+
+        with model_hooks(build_models=self.build_models, forecast=lambda ticker, models=None: None):
+            return _exported_models('AAPL', self.cutoff, self.artifacts)
+
+    def test_a_faithful_export_is_served(self):
+        models = self.exported_models()
+        self.assertEqual(list(models), ['lstm'])
+        self.assertFalse(isinstance(models['lstm'], type(self.module)))
+        self.assertIsNotNone(self.registry.load_exported('AAPL', self.cutoff, 'lstm', 'torchscript'))
+
+    def test_the_eager_model_is_kept_when_the_export_diverges(self):
+        from . import inference
+
+        load = inference.load
+
+        def diverging_load(data, mode):
+            model = load(data, mode)
+            return lambda inputs: model(inputs) * 1.2
+
+        with mock.patch('api.forecaster.inference.load', side_effect=diverging_load):
+            self.assertEqual(self.exported_models(), {})
+        self.assertTrue(self.registry.export_rejected('AAPL', self.cutoff, 'lstm', 'torchscript'))
+        self.assertIsNone(self.registry.load_exported('AAPL', self.cutoff, 'lstm', 'torchscript'))
+
+        # The rejection is remembered: no export is attempted again for these models
+        self.assertEqual(self.exported_models(), {})
+        self.assertEqual(self.built, 1)
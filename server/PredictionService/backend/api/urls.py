@@ -1,6 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from .views import PredictionPriceView
+from .views import (
+    AsyncBatchPredictionPriceView,
+    AsyncPredictionPriceView,
+    AsyncPredictionStreamView,
+    BatchPredictionPriceView,
+    PredictionJobStatusView,
+    PredictionJobView,
+    PredictionPriceView,
+    PredictionStreamView,
+    SymbolSearchView,
+)
+
+# Under ASGI the async view keeps slow predictions from blocking cheap requests
+prediction_view = AsyncPredictionPriceView if settings.ASGI_MODE else PredictionPriceView
+prediction_stream_view = AsyncPredictionStreamView if settings.ASGI_MODE else PredictionStreamView
+batch_prediction_view = AsyncBatchPredictionPriceView if settings.ASGI_MODE else BatchPredictionPriceView
 
 urlpatterns = [
-    path('prediction/', PredictionPriceView.as_view(), name='prediction_price'),
+    path('prediction/', prediction_view.as_view(), name='prediction_price'),
+    path('prediction/stream/', prediction_stream_view.as_view(), name='prediction_stream'),
+    path('prediction/batch/', batch_prediction_view.as_view(), name='batch_prediction_price'),
+    path('prediction/jobs/', PredictionJobView.as_view(), name='prediction_jobs'),
+    path('prediction/jobs/<str:job_id>/', PredictionJobStatusView.as_view(), name='prediction_job'),
+    path('symbols/', SymbolSearchView.as_view(), name='symbol_search'),
 ]
\ No newline at end of file
@@ -1,157 +1,605 @@
-from django.http import JsonResponse
-from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views import View
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.conf import settings
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
 
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
 
 from .models import UserPrediction
-from .ml_model.PredictSuperCode import predict
+from .compute_pool import (
+    ComputePoolSaturated,
+    cache_lookup_limit,
+    compute_pool,
+    compute_prediction,
+    compute_predictions,
+)
+from .metrics import OVERLOAD_REJECTIONS, QUOTA_REJECTIONS, UNKNOWN_TICKERS, stage
+from .prediction_jobs import prediction_jobs
+from .prediction_progress import KEEPALIVE_INTERVAL, format_event, format_keepalive, next_event, subscribe
+from .prediction_cache import (
+    PredictionPendingError,
+    aget_cached_prediction,
+    aget_or_compute_prediction,
+    aget_or_compute_predictions,
+    aget_stale_prediction,
+    build_prediction_result,
+    get_cached_prediction,
+    get_cached_predictions,
+    get_or_compute_prediction,
+    get_or_compute_predictions,
+    get_stale_predictions,
+    record_prediction_requests,
+)
+from .quota import FREE_DAILY_LIMIT, quota_ledger
+from .subscription_cache import get_user_prediction
+from .symbols import normalize_ticker, symbol_index
 
+logger = logging.getLogger(__name__)
+
+# Most results one symbol search returns
+SYMBOL_SEARCH_MAX_RESULTS = 50
 
-class PredictionPriceView(APIView):
 
-    user_prediction_collection = settings.DB['user_prediction']
+class PredictionPriceView(APIView):
 
     def get(self, request):
-        ticker = request.query_params.get('ticker', None)
+        ticker = normalize_ticker(request.query_params.get('ticker'))
         user_id = request.META.get('HTTP_X_USER_ID', None)
-        print(f"------------------###############Received request for ticker: {ticker} from user_id: {user_id}")
+        logger.debug("Received request for ticker: %s from user_id: %s", ticker, user_id)
 
         # if user_id is None:
         #     return Response({"error": "Please login to access this resource"}, status=status.HTTP_401_UNAUTHORIZED)
-        if ticker is None:
+        if not ticker:
             return Response({"error": "Ticker parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        # Typos and delisted symbols are turned away before they cost a quota unit
+        if unknown_tickers([ticker]):
+            return Response({"error": f"Unknown ticker: {ticker}"}, status=status.HTTP_404_NOT_FOUND)
         
-        subscription_check_response = self._check_subscription_status(user_id)
+        with stage('quota'):
+            subscription_check_response = self._check_subscription_status(user_id)
     
     # If the check returned a Response (i.e., an error/limit reached), return it immediately.
         if isinstance(subscription_check_response, Response):
             return subscription_check_response
+        record_prediction_requests([ticker])
         try:
             prediction_result = self._get_price_prediction(ticker)
-            print(f"Prediction result for ticker {ticker}: {prediction_result}")
-            return JsonResponse(prediction_result, safe=True)
+            with stage('serialization'):
+                return JsonResponse(prediction_result, safe=True)
+        except PredictionPendingError as e:
+            logger.info("Prediction still pending: %s", e)
+            OVERLOAD_REJECTIONS.labels(reason='pending').inc()
+            response = Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = settings.PREDICTION_RETRY_AFTER
+            return response
         except Exception as e:
-            print(f"Error occurred: {e}")
+            logger.exception("Prediction failed for ticker %s", ticker)
             return Response({"error": f"An error occurred while processing the request: {str(e)}"}, 
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
-    # def _update_subscription_to_free(user_id):
-
     def _get_price_prediction(self, ticker):
-        cache_key = f"prediction_{ticker}"
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            print("Cache hit")
-            return cached_result
+        # Concurrent misses for the same ticker are coalesced into one predict() call
+        return get_or_compute_prediction(ticker, self._compute_price_prediction)
+
+    def _compute_price_prediction(self, ticker):
+        logger.info("Cache miss, computing prediction for %s", ticker)
+        # Imported on first use: the model code pulls in torch, pandas and friends
+        from .forecaster import predict
         # Get the prediction result (NumPy array and DatetimeIndex)
         predictions, dates, mape_values = predict(ticker)
-            
-        # Convert the NumPy array to a Python list
-        predictions_list = predictions.tolist()
-            
-        # Convert DatetimeIndex to string list
-        dates_list = dates.strftime('%Y-%m-%d').tolist()
-            
-            # Create a properly formatted, serializable response
-        result = {
-            "predictions": predictions_list,
-            "dates": dates_list,
-            "mape_values": min(mape_values) * 100
-        }
-            # Cache the result for future requests for 1 day
-        print("Cache miss")
-        cache.set(cache_key, result, timeout=60*60*24)  # Cache for 1 day
-        return result
-        
-    
 
-    def _check_subscription_status(self, user_id):
-        print(f"Checking subscription status for user_id: {user_id}")
+        # Create a properly formatted, serializable response
+        return build_prediction_result(predictions, dates, mape_values)
+
+    def _check_subscription_status(self, user_id, cost=1):
+        """The user's plan, or an error Response; free users are charged `cost` predictions."""
+        logger.debug("Checking subscription status for user_id: %s", user_id)
+
+        # Usage is counted in Redis; the quota ledger writes it back to MongoDB in batches
+        user_prediction = get_user_prediction(user_id)
 
-        user_prediction = self.user_prediction_collection.find_one({'user_id': user_id})
-        
         if not user_prediction:
-            print(f"No user prediction found for user_id: {user_id}")
-            print(f"Creating new user prediction for user_id: {user_id}")
-            # Create a new user prediction with default values
-            self.user_prediction_collection.insert_one({
-                'user_id': user_id,
-                'prediction_usage': {
-                    'daily_usage': 0,
-                    'last_reset_date': datetime.now()
-                },
-                'subscription_details': {
-                    'daily_limit': 5,
-                    'subscription_plan_type': 'free',
-                    'start_date': datetime.now(),
-                    'end_date': datetime.now() + timedelta(days=30)  # Default to 30 days from now
-                }
-            })
-            print(f"New user prediction created for user_id: {user_id}")
-            user_prediction = self.user_prediction_collection.find_one({'user_id': user_id})
-
-        prediction_usage = user_prediction.get('prediction_usage')
-        subscription_details = user_prediction.get('subscription_details')
+            logger.debug("No user prediction found for user_id: %s, using the free plan", user_id)
+            user_prediction = {}
+
+        prediction_usage = user_prediction.get('prediction_usage') or {}
+        subscription_details = user_prediction.get('subscription_details') or {}
 
         daily_usage = prediction_usage.get('daily_usage', 0)
         last_reset_date = prediction_usage.get('last_reset_date')
 
-        daily_limit = subscription_details.get('daily_limit')
+        daily_limit = subscription_details.get('daily_limit', FREE_DAILY_LIMIT)
         subscription_end_date = subscription_details.get('end_date')
-        subscription_plan_type = subscription_details.get('subscription_plan_type')
+        subscription_plan_type = subscription_details.get('subscription_plan_type', 'free')
 
         current_date = datetime.now()
 
+        if subscription_plan_type == 'premium':
+            if subscription_end_date is None or current_date <= subscription_end_date:
+                logger.debug("User %s is on premium plan", user_id)
+                return subscription_plan_type
+
+            logger.info("User %s subscription has expired", user_id)
+            if quota_ledger.downgrade(user_id):
+                # The rejected request counts towards the new free plan
+                quota_ledger.consume(user_id, FREE_DAILY_LIMIT)
+                QUOTA_REJECTIONS.labels(reason='subscription_expired').inc()
+                return Response({"error": "Subscription has expired, switching to free plan"}, status=status.HTTP_403_FORBIDDEN)
+            # Downgrade not flushed to MongoDB yet
+            subscription_plan_type = 'free'
+            daily_limit = FREE_DAILY_LIMIT
+
         if subscription_plan_type == 'free':
-            print(f"User {user_id} is on free plan")
-            if current_date > last_reset_date + timedelta(hours = 24):
-                self._update_last_reset_date(user_id)
-                last_reset_date = datetime.now()
-            
-            if daily_usage >= daily_limit:
-                print(f"User {user_id} has reached the daily limit for free plan")
+            logger.debug("User %s is on free plan", user_id)
+            allowed, used = quota_ledger.consume(user_id, daily_limit, daily_usage, last_reset_date, cost=cost)
+            if not allowed:
+                logger.info("User %s has reached the daily limit for free plan", user_id)
+                QUOTA_REJECTIONS.labels(reason='daily_limit').inc()
                 return Response({"error": "Daily limit reached for free plan"}, status=status.HTTP_403_FORBIDDEN)
-            
-            self._update_daily_usage(user_id)
-        
-        
-        elif subscription_plan_type == 'premium':
-            print(f"User {user_id} is on premium plan")
-            if current_date > subscription_end_date:
-                print(f"User {user_id} subscription has expired")
-                self._update_subscription_to_free(user_id)
-                return Response({"error": "Subscription has expired, switching to free plan"}, status=status.HTTP_403_FORBIDDEN)
-    
-    def _update_last_reset_date(self, user_id):
-        print(f"Updating last reset date for user {user_id}")
-        self.user_prediction_collection.update_one(
-            {'user_id': user_id},
-            {'$set': {'prediction_usage.last_reset_date': datetime.now()}}
-        )
-        print(f"Updated last reset date for user {user_id}")
-    
-    def _update_daily_usage(self, user_id):
-        print(f"Updating daily usage for user {user_id}")
-        self.user_prediction_collection.update_one(
-            {'user_id': user_id},
-            {'$inc': {'prediction_usage.daily_usage': 1}}
-        )
-        print(f"Updated daily usage for user {user_id}")
-
-    def _update_subscription_to_free(self, user_id):
-        print(f"Updating subscription to free plan for user {user_id}")
-        self.user_prediction_collection.update_one(
-            {'user_id': user_id},
-            {'$set': {
-                'subscription_details.subscription_plan_type': 'free',
-                'subscription_details.daily_limit': 5,
-                'prediction_usage.daily_usage': 1,
-                'prediction_usage.last_reset_date': datetime.now()
-            }}
-        )
-        print(f"Updated subscription to free plan for user {user_id}")
\ No newline at end of file
+
+        return subscription_plan_type
+
+
+class BatchPredictionPriceView(PredictionPriceView):
+    """
+    Predictions for many tickers in one request, e.g. a whole portfolio:
+    GET /api/v1/prediction/batch/?symbols=AAPL,MSFT,GOOG
+
+    Every known ticker of the batch counts as one prediction of the quota,
+    charged at once: a batch that does not fit in what is left of the daily
+    limit is rejected whole. Cached tickers are read with a single MGET and
+    the misses this worker holds the compute lock of go through one
+    predict_many() call (see get_or_compute_predictions()).
+    """
+
+    def get(self, request):
+        user_id = request.META.get('HTTP_X_USER_ID', None)
+        requested = self._requested_tickers(request.query_params.get('symbols', None))
+        if isinstance(requested, Response):
+            return requested
+        tickers, unknown = requested
+
+        with stage('quota'):
+            subscription_check_response = self._check_subscription_status(user_id, cost=len(tickers))
+        if isinstance(subscription_check_response, Response):
+            return subscription_check_response
+        record_prediction_requests(tickers)
+
+        try:
+            results, errors = self._get_price_predictions(tickers)
+        except Exception as e:
+            logger.exception("Batch prediction failed for %s", tickers)
+            return Response({"error": f"An error occurred while processing the request: {str(e)}"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        with stage('serialization'):
+            return JsonResponse(self._response_body(tickers, unknown, results, errors))
+
+    def _requested_tickers(self, symbols):
+        """(tickers, unknown tickers) of the symbols parameter, or an error Response."""
+        if not symbols:
+            return Response({"error": "Symbols parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Keep the request order but drop empty entries and duplicates
+        tickers = list(dict.fromkeys(normalize_ticker(s) for s in symbols.split(',') if s.strip()))
+        if not tickers:
+            return Response({"error": "Symbols parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(tickers) > settings.PREDICTION_BATCH_MAX_SYMBOLS:
+            return Response(
+                {"error": f"At most {settings.PREDICTION_BATCH_MAX_SYMBOLS} symbols can be requested at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        unknown = unknown_tickers(tickers)
+        if unknown:
+            tickers = [ticker for ticker in tickers if ticker not in unknown]
+            if not tickers:
+                return Response({"error": f"Unknown symbols: {', '.join(unknown)}"}, status=status.HTTP_404_NOT_FOUND)
+        return tickers, unknown
+
+    def _response_body(self, tickers, unknown, results, errors):
+        # Preserve the order the symbols were requested in
+        return {
+            "results": {ticker: results[ticker] for ticker in tickers if ticker in results},
+            "errors": {**{ticker: "Unknown ticker" for ticker in unknown}, **errors},
+        }
+
+    def _get_price_predictions(self, tickers):
+        results, misses = self._cached_predictions(tickers)
+        computed, errors = get_or_compute_predictions(misses, compute_predictions)
+        results.update(computed)
+        return results, errors
+
+    def _cached_predictions(self, tickers):
+        """Fresh or stale cached results of `tickers`, and the tickers still to compute."""
+        with stage('cache_lookup'):
+            results = get_cached_predictions(tickers)
+            misses = [ticker for ticker in tickers if ticker not in results]
+            # Tickers seen before are answered from their stale copy and refreshed in the background
+            results.update(get_stale_predictions(misses))
+        misses = [ticker for ticker in tickers if ticker not in results]
+        logger.debug("Batch prediction: %d cache hits, %d cache misses", len(results), len(misses))
+        return results, misses
+
+
+class PredictionJobView(PredictionPriceView):
+    """
+    Queue a prediction instead of waiting for it:
+    POST /api/v1/prediction/jobs/ with a ticker returns a job id to poll at
+    /api/v1/prediction/jobs/<job_id>/, or the result straight away if it is
+    cached. Jobs run in `manage.py run_prediction_jobs`, premium users first.
+    """
+
+    http_method_names = ['post', 'options']
+
+    def post(self, request):
+        ticker = normalize_ticker(request.data.get('ticker') or request.query_params.get('ticker'))
+        user_id = request.META.get('HTTP_X_USER_ID', None)
+
+        if not ticker:
+            return Response({"error": "Ticker parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if unknown_tickers([ticker]):
+            return Response({"error": f"Unknown ticker: {ticker}"}, status=status.HTTP_404_NOT_FOUND)
+
+        with stage('quota'):
+            subscription_check_response = self._check_subscription_status(user_id)
+        if isinstance(subscription_check_response, Response):
+            return subscription_check_response
+        record_prediction_requests([ticker])
+
+        with stage('cache_lookup'):
+            cached_result = get_cached_prediction(ticker)
+        if cached_result:
+            return Response({"ticker": ticker, "status": "done", "result": cached_result})
+
+        job_id, created = prediction_jobs.enqueue(ticker, premium=subscription_check_response == 'premium')
+        logger.info("%s prediction job %s for %s", "Queued" if created else "Joined", job_id, ticker)
+        response = Response({"job_id": job_id, "ticker": ticker, "status": "queued"}, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = reverse('prediction_job', args=[job_id])
+        return response
+
+
+class PredictionJobStatusView(APIView):
+    """
+    GET /api/v1/prediction/jobs/<job_id>/?wait=<seconds> returns the job's
+    status, with the result once it is done. With `wait` the request is held
+    until the job finishes, for at most PREDICTION_JOB_MAX_WAIT seconds.
+    """
+
+    def get(self, request, job_id):
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), settings.PREDICTION_JOB_MAX_WAIT)
+        except ValueError:
+            return Response({"error": "wait must be a number of seconds"}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = prediction_jobs.wait(job_id, wait) if wait > 0 else prediction_jobs.get(job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+
+
+class PredictionStreamView(PredictionPriceView):
+    """
+    Server-Sent Events variant of PredictionPriceView:
+    GET /api/v1/prediction/stream/?ticker=AAPL
+
+    Streams the progress of a cold prediction (started, data_loaded,
+    training_started, and the model's own training / candidate_done events)
+    and ends with a `result` event holding the same payload as the regular
+    endpoint, or an `error` event. Keep-alive comments are sent while nothing
+    happens, so slow trainings do not hit proxy read timeouts.
+    """
+
+    def get(self, request):
+        ticker = normalize_ticker(request.query_params.get('ticker'))
+        user_id = request.META.get('HTTP_X_USER_ID', None)
+
+        if not ticker:
+            return Response({"error": "Ticker parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if unknown_tickers([ticker]):
+            return Response({"error": f"Unknown ticker: {ticker}"}, status=status.HTTP_404_NOT_FOUND)
+
+        with stage('quota'):
+            subscription_check_response = self._check_subscription_status(user_id)
+        if isinstance(subscription_check_response, Response):
+            return subscription_check_response
+        record_prediction_requests([ticker])
+
+        with stage('cache_lookup'):
+            cached_result = get_cached_prediction(ticker)
+        return event_stream_response(self._event_stream(ticker, cached_result))
+
+    def _event_stream(self, ticker, cached_result):
+        if cached_result:
+            yield format_event('result', cached_result)
+            return
+
+        # Subscribe before starting, so no event is missed
+        pubsub = subscribe(ticker)
+        try:
+            yield format_event('started', {'ticker': ticker})
+            future = Future()
+            threading.Thread(target=self._compute_into, args=(ticker, future), daemon=True).start()
+
+            last_sent = time.monotonic()
+            while not future.done():
+                event = next_event(pubsub, timeout=1)
+                if event is not None:
+                    yield format_event(*event)
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= KEEPALIVE_INTERVAL:
+                    yield format_keepalive()
+                    last_sent = time.monotonic()
+            while (event := next_event(pubsub, timeout=0)) is not None:
+                yield format_event(*event)
+            yield result_event(ticker, future)
+        finally:
+            pubsub.close()
+
+    def _compute_into(self, ticker, future):
+        # Keeps running if the client goes away, the result still lands in the cache
+        try:
+            future.set_result(self._get_price_prediction(ticker))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class AsyncPredictionPriceView(View):
+    """
+    Async version of PredictionPriceView, served when running under ASGI
+    (settings.ASGI_MODE). Cache and quota I/O run in worker threads and
+    model work in a bounded process pool, so slow cache misses do not hold
+    up cache hits. When either kind of traffic is over its limit the view
+    answers 503 with Retry-After instead of queueing.
+    """
+
+    # Reuses the quota logic of the sync view
+    subscription_view = PredictionPriceView()
+
+    async def get(self, request):
+        ticker = normalize_ticker(request.GET.get('ticker'))
+        user_id = request.META.get('HTTP_X_USER_ID', None)
+
+        if not ticker:
+            return JsonResponse({"error": "Ticker parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if unknown_tickers([ticker]):
+            return JsonResponse({"error": f"Unknown ticker: {ticker}"}, status=status.HTTP_404_NOT_FOUND)
+
+        if not cache_lookup_limit.try_acquire():
+            return self._service_unavailable("Too many requests, please retry", 'cache_concurrency')
+        try:
+            with stage('cache_lookup'):
+                cached_result = await aget_cached_prediction(ticker)
+            if not cached_result:
+                # Seen before: answer from the stale copy, refreshed in the background
+                cached_result = await aget_stale_prediction(ticker)
+
+            # Turn a miss away before charging the user's quota if there is no room to compute it
+            if not cached_result and compute_pool.saturated:
+                return self._service_unavailable("Prediction service is busy, please retry", 'compute_saturated')
+
+            with stage('quota'):
+                subscription_check_response = await sync_to_async(
+                    self.subscription_view._check_subscription_status, thread_sensitive=False
+                )(user_id)
+            if isinstance(subscription_check_response, Response):
+                return JsonResponse(subscription_check_response.data, status=subscription_check_response.status_code)
+            await sync_to_async(record_prediction_requests, thread_sensitive=False)([ticker])
+        finally:
+            cache_lookup_limit.release()
+
+        if cached_result:
+            with stage('serialization'):
+                return JsonResponse(cached_result)
+
+        try:
+            prediction_result = await aget_or_compute_prediction(ticker, self._compute_price_prediction)
+            with stage('serialization'):
+                return JsonResponse(prediction_result)
+        except ComputePoolSaturated:
+            return self._service_unavailable("Prediction service is busy, please retry", 'compute_saturated')
+        except PredictionPendingError as e:
+            return self._service_unavailable(str(e), 'pending')
+        except Exception as e:
+            logger.exception("Prediction failed for ticker %s", ticker)
+            return JsonResponse({"error": f"An error occurred while processing the request: {str(e)}"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def _compute_price_prediction(self, ticker):
+        # Stages inside the pool process are reported by that process
+        with stage('compute'):
+            return await compute_pool.run(compute_prediction, ticker)
+
+    def _service_unavailable(self, message, reason):
+        OVERLOAD_REJECTIONS.labels(reason=reason).inc()
+        response = JsonResponse({"error": message}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = settings.PREDICTION_RETRY_AFTER
+        return response
+
+
+class AsyncBatchPredictionPriceView(AsyncPredictionPriceView):
+    """
+    Async version of BatchPredictionPriceView, served under ASGI. The misses
+    this worker holds the compute lock of run as one job of the bounded
+    process pool, taking a pending slot per ticker, and the batch is
+    answered 503 when there is no room.
+    """
+
+    batch_view = BatchPredictionPriceView()
+
+    async def get(self, request):
+        user_id = request.META.get('HTTP_X_USER_ID', None)
+        requested = await sync_to_async(self.batch_view._requested_tickers, thread_sensitive=False)(
+            request.GET.get('symbols', None))
+        if isinstance(requested, Response):
+            return JsonResponse(requested.data, status=requested.status_code)
+        tickers, unknown = requested
+
+        if not cache_lookup_limit.try_acquire():
+            return self._service_unavailable("Too many requests, please retry", 'cache_concurrency')
+        try:
+            results, misses = await sync_to_async(self.batch_view._cached_predictions, thread_sensitive=False)(tickers)
+
+            # Turn the batch away before charging the user's quota if there is no room to compute it
+            if misses and compute_pool.saturated:
+                return self._service_unavailable("Prediction service is busy, please retry", 'compute_saturated')
+
+            with stage('quota'):
+                subscription_check_response = await sync_to_async(
+                    self.subscription_view._check_subscription_status, thread_sensitive=False
+                )(user_id, cost=len(tickers))
+            if isinstance(subscription_check_response, Response):
+                return JsonResponse(subscription_check_response.data, status=subscription_check_response.status_code)
+            await sync_to_async(record_prediction_requests, thread_sensitive=False)(tickers)
+        finally:
+            cache_lookup_limit.release()
+
+        errors = {}
+        if misses:
+            try:
+                computed, errors = await aget_or_compute_predictions(misses, self._compute_price_predictions)
+            except ComputePoolSaturated:
+                return self._service_unavailable("Prediction service is busy, please retry", 'compute_saturated')
+            except Exception as e:
+                logger.exception("Batch prediction failed for %s", misses)
+                return JsonResponse({"error": f"An error occurred while processing the request: {str(e)}"},
+                                    status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            results.update(computed)
+
+        with stage('serialization'):
+            return JsonResponse(self.batch_view._response_body(tickers, unknown, results, errors))
+
+    async def _compute_price_predictions(self, tickers):
+        with stage('compute'):
+            return await compute_pool.run(compute_predictions, tickers, cost=len(tickers))
+
+
+class AsyncPredictionStreamView(AsyncPredictionPriceView):
+    """Async version of PredictionStreamView, with the computation in the bounded process pool."""
+
+    async def get(self, request):
+        ticker = normalize_ticker(request.GET.get('ticker'))
+        user_id = request.META.get('HTTP_X_USER_ID', None)
+
+        if not ticker:
+            return JsonResponse({"error": "Ticker parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if unknown_tickers([ticker]):
+            return JsonResponse({"error": f"Unknown ticker: {ticker}"}, status=status.HTTP_404_NOT_FOUND)
+
+        with stage('cache_lookup'):
+            cached_result = await aget_cached_prediction(ticker)
+        if not cached_result:
+            cached_result = await aget_stale_prediction(ticker)
+        if not cached_result and compute_pool.saturated:
+            return self._service_unavailable("Prediction service is busy, please retry", 'compute_saturated')
+
+        with stage('quota'):
+            subscription_check_response = await sync_to_async(
+                self.subscription_view._check_subscription_status, thread_sensitive=False
+            )(user_id)
+        if isinstance(subscription_check_response, Response):
+            return JsonResponse(subscription_check_response.data, status=subscription_check_response.status_code)
+        await sync_to_async(record_prediction_requests, thread_sensitive=False)([ticker])
+
+        return event_stream_response(self._event_stream(ticker, cached_result))
+
+    async def _event_stream(self, ticker, cached_result):
+        if cached_result:
+            yield format_event('result', cached_result)
+            return
+
+        pubsub = await sync_to_async(subscribe, thread_sensitive=False)(ticker)
+        get_event = sync_to_async(next_event, thread_sensitive=False)
+        try:
+            yield format_event('started', {'ticker': ticker})
+            # Keeps running if the client goes away, the result still lands in the cache
+            task = asyncio.ensure_future(aget_or_compute_prediction(ticker, self._compute_price_prediction))
+
+            last_sent = time.monotonic()
+            while not task.done():
+                event = await get_event(pubsub, timeout=1)
+                if event is not None:
+                    yield format_event(*event)
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= KEEPALIVE_INTERVAL:
+                    yield format_keepalive()
+                    last_sent = time.monotonic()
+            while (event := await get_event(pubsub, timeout=0)) is not None:
+                yield format_event(*event)
+            yield result_event(ticker, task)
+        finally:
+            await sync_to_async(pubsub.close, thread_sensitive=False)()
+
+
+class SymbolSearchView(APIView):
+    """
+    GET /api/v1/symbols/?q=app&limit=10
+
+    Autocomplete over the symbol master: symbols starting with `q`, then
+    security names starting with it, answered from the in-memory index.
+    """
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "limit must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = symbol_index.search(query, min(limit, SYMBOL_SEARCH_MAX_RESULTS)) if query else []
+        response = JsonResponse({"results": results})
+        # The symbol master changes rarely, let browsers reuse answers for a while
+        response['Cache-Control'] = 'public, max-age=300'
+        return response
+
+
+def unknown_tickers(tickers):
+    """The tickers missing from the symbol master (api.symbols.symbol_index)."""
+    unknown = [ticker for ticker in tickers if not symbol_index.is_known(ticker)]
+    if unknown:
+        UNKNOWN_TICKERS.inc(len(unknown))
+    return unknown
+
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def result_event(ticker, future):
+    """The final SSE event of a stream, from a finished Future or asyncio Task."""
+    try:
+        return format_event('result', future.result())
+    except (ComputePoolSaturated, PredictionPendingError) as e:
+        return format_event('error', {
+            "error": str(e) or "Prediction service is busy, please retry",
+            "retry_after": settings.PREDICTION_RETRY_AFTER,
+        })
+    except Exception as e:
+        logger.exception("Prediction failed for ticker %s", ticker)
+        return format_event('error', {"error": f"An error occurred while processing the request: {str(e)}"})
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, aggregating all processes in multiprocess mode."""
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,119 @@
+"""
+Zero-copy preprocessing of price histories into model inputs.
+
+A ticker's history is copied once, from the price store's structured bars
+into a C-contiguous float32 buffer of shape (bars, features), which can be
+a np.memmap (memmap_buffer) for histories too long to keep in memory.
+Everything after that works on the buffer's memory:
+
+- sliding_windows() returns the input and target windows as strided views,
+  so n bars cost n * features * 4 bytes whatever the window length, instead
+  of a (windows, lookback, features) copy.
+- scale_in_place() min-max scales the buffer itself, and every window over
+  it sees the scaled values.
+- as_tensor() hands arrays to torch with torch.from_numpy, sharing memory;
+  iter_batches() only copies the windows of one shuffled batch at a time.
+
+Windows are read-only views: write to the buffer, never to a window.
+"""
+import warnings
+
+import numpy as np
+import torch
+from numpy.lib.stride_tricks import as_strided
+
+from .price_store import ADJUSTED_FIELDS, adjustment_factors
+
+# Fields of api.price_store.PRICE_DTYPE besides the date, in order
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'adj_close', 'volume')
+
+
+def price_buffer(bars, fields=PRICE_FIELDS, out=None):
+    """
+    The `fields` of a structured array of bars (see api.price_store) as a
+    C-contiguous float32 array of shape (bars, fields), written into `out`
+    (e.g. from memmap_buffer) when given. Prices are adjusted for splits and
+    dividends, like api.price_store.bars_to_frame().
+    """
+    shape = (len(bars), len(fields))
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.shape != shape or out.dtype != np.float32 or not out.flags.c_contiguous:
+        raise ValueError(f"Expected a C-contiguous float32 buffer of shape {shape}")
+    factors = None
+    for column, field in enumerate(fields):
+        out[:, column] = bars[field]
+        if field in ADJUSTED_FIELDS:
+            if factors is None:
+                factors = adjustment_factors(bars).astype(np.float32)
+            out[:, column] *= factors
+    return out
+
+
+def memmap_buffer(path, shape):
+    """A new file-backed float32 buffer of `shape`, saved as .npy and mapped read-write."""
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+
+
+def sliding_windows(buffer, lookback, horizon=0, step=1):
+    """
+    (inputs, targets) views over a (bars, features) buffer: inputs[i] holds
+    rows i * step to i * step + lookback, targets[i] the `horizon` rows after
+    them. Only windows with all their targets in the buffer are included.
+    """
+    if buffer.ndim != 2:
+        raise ValueError("Expected a (bars, features) buffer")
+    bars, features = buffer.shape
+    count = max((bars - lookback - horizon) // step + 1, 0)
+    row_stride, feature_stride = buffer.strides
+    strides = (row_stride * step, row_stride, feature_stride)
+    inputs = as_strided(buffer, (count, lookback, features), strides, writeable=False)
+    targets = as_strided(buffer[lookback:], (count, horizon, features), strides, writeable=False)
+    return inputs, targets
+
+
+def fit_min_max(buffer, rows=None):
+    """
+    Per-feature (low, scale) of the first `rows` rows of the buffer (its
+    training part, so validation bars do not leak into the scaler).
+    """
+    fitted = buffer[:rows]
+    low = fitted.min(axis=0)
+    spread = fitted.max(axis=0) - low
+    scale = np.divide(1.0, spread, out=np.ones_like(spread), where=spread > 0)
+    return low.astype(np.float32), scale.astype(np.float32)
+
+
+def scale_in_place(buffer, low, scale):
+    """Min-max scale the buffer without a temporary copy; returns it."""
+    np.subtract(buffer, low, out=buffer)
+    np.multiply(buffer, scale, out=buffer)
+    return buffer
+
+
+def unscale(values, low, scale, feature=0):
+    """Scaled values of one feature (e.g. predicted closes) back to prices."""
+    return np.asarray(values, dtype=np.float64) / scale[feature] + low[feature]
+
+
+def as_tensor(array):
+    """A tensor sharing the array's memory (strided views included)."""
+    with warnings.catch_warnings():
+        # Windows are read-only views; the model only reads its inputs
+        warnings.filterwarnings('ignore', message='The given NumPy array is not writable')
+        return torch.from_numpy(array)
+
+
+def iter_batches(inputs, targets, batch_size, shuffle=False, rng=None):
+    """
+    (inputs, targets) tensors of `batch_size` windows. In order, batches are
+    views of the windows; shuffled, only the current batch is gathered.
+    """
+    if shuffle:
+        order = (rng or np.random.default_rng()).permutation(len(inputs))
+        for i in range(0, len(order), batch_size):
+            chosen = order[i:i + batch_size]
+            yield torch.from_numpy(inputs[chosen]), torch.from_numpy(targets[chosen])
+    else:
+        for i in range(0, len(inputs), batch_size):
+            yield as_tensor(inputs[i:i + batch_size]), as_tensor(targets[i:i + batch_size])
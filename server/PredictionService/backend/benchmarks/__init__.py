@@ -0,0 +1,7 @@
+"""
+Benchmarks of the prediction service, run from the backend directory as
+python -m benchmarks.<name> (see each module for its options).
+
+Every benchmark prints its results as JSON, written to --output when given,
+with the commit it ran on, so runs can be compared across commits.
+"""
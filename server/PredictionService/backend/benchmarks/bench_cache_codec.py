@@ -0,0 +1,86 @@
+"""
+Size and speed of cached prediction results: the pickled dict django-redis
+stored before (what `cache.set` of the result dict writes) against the
+binary codec of api/prediction_codec.py, with and without zlib.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_cache_codec --horizons 7,30,90,365 --output codec.json
+"""
+import argparse
+import json
+import pickle
+import timeit
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from api.prediction_codec import decode_prediction, encode_prediction
+
+from .bench_prediction_api import git_commit
+
+
+def make_result(horizon, rng):
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, horizon)))
+    return {
+        "predictions": prices.tolist(),
+        "dates": pd.bdate_range('2025-01-02', periods=horizon).strftime('%Y-%m-%d').tolist(),
+        "mape_values": float(rng.uniform(1, 10)),
+    }
+
+
+def measure(encode, decode, result, number):
+    data = encode(result)
+    return {
+        'bytes': len(data),
+        'encode_us': round(min(timeit.repeat(lambda: encode(result), number=number, repeat=5)) / number * 1e6, 2),
+        'decode_us': round(min(timeit.repeat(lambda: decode(data), number=number, repeat=5)) / number * 1e6, 2),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--horizons', default='7,30,90,365', help='Comma-separated numbers of predicted days')
+    parser.add_argument('--number', type=int, default=2000, help='Calls per timing')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    # django-redis' default serializer
+    codecs = {
+        'pickle': (lambda result: pickle.dumps(result, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        'binary': (encode_prediction, decode_prediction),
+        'binary_zlib': (lambda result: encode_prediction(result, compress=True), decode_prediction),
+    }
+
+    rows = []
+    for horizon in (int(h) for h in args.horizons.split(',')):
+        result = make_result(horizon, rng)
+        row = {'horizon': horizon}
+        for name, (encode, decode) in codecs.items():
+            row[name] = measure(encode, decode, result, args.number)
+        decoded = decode_prediction(encode_prediction(result))
+        row['max_abs_error'] = float(np.max(np.abs(np.array(decoded['predictions']) - result['predictions'])))
+        rows.append(row)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'horizons': rows,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Accuracy and latency of the cross-ticker global model (api/global_model.py)
+against one model per ticker.
+
+The last --horizon bars of every ticker are held out. The global model is
+trained once on the rest of all tickers' histories; the per-ticker baseline
+trains the same network on each ticker alone, as a cold ticker would need.
+Both then predict the held-out bars and are scored by MAPE, next to a naive
+forecast (the last close, repeated). With --production-model the model
+module's own predict(ticker, history=...) is scored and timed too.
+
+Prices come from the local price store for --symbols, or are synthetic
+random walks sharing a market factor (--synthetic-tickers).
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_global_model --synthetic-tickers 50 --epochs 10 --output global.json
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .bench_prediction_api import git_commit, summarize
+
+
+def synthetic_bars(args):
+    """Structured price arrays of random walks with their own drift, volatility and level."""
+    from api.price_store import PRICE_DTYPE
+
+    rng = np.random.default_rng(args.seed)
+    dates = np.busday_offset(np.datetime64('2000-01-03'), np.arange(args.history_days))
+    market = rng.normal(0.0003, 0.01, args.history_days)
+    bars_by_ticker = {}
+    for i in range(args.synthetic_tickers):
+        beta = rng.uniform(0.5, 1.5)
+        returns = beta * market + rng.normal(rng.normal(0, 0.0003), rng.uniform(0.005, 0.02), args.history_days)
+        bars = np.zeros(args.history_days, dtype=PRICE_DTYPE)
+        bars['date'] = dates
+        bars['close'] = rng.uniform(5, 500) * np.exp(np.cumsum(returns))
+        bars_by_ticker[f"SYN{i:03d}"] = bars
+    return bars_by_ticker
+
+
+def stored_bars(args):
+    from api.price_store import price_store
+
+    bars_by_ticker = {}
+    for ticker in (s.strip() for s in args.symbols.split(',') if s.strip()):
+        bars = price_store.read(ticker)
+        if bars is not None and len(bars) > args.horizon:
+            bars_by_ticker[ticker] = bars[-args.history_days:] if args.history_days else bars
+    return bars_by_ticker
+
+
+def score(results, actual):
+    """MAPE in percent of each ticker's predictions against its held-out closes."""
+    return {
+        ticker: float(np.mean(np.abs(np.asarray(predictions[:len(actual[ticker])]) - actual[ticker]) / actual[ticker]) * 100)
+        for ticker, (predictions, _, _) in results.items()
+    }
+
+
+def describe(mapes, tickers):
+    values = np.array([mapes[ticker] for ticker in tickers if ticker in mapes])
+    return {
+        'tickers': len(values),
+        'mape_mean': round(float(values.mean()), 3) if len(values) else None,
+        'mape_median': round(float(np.median(values)), 3) if len(values) else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', help='Comma-separated tickers read from the price store, instead of synthetic data')
+    parser.add_argument('--synthetic-tickers', type=int, default=30, help='Number of synthetic tickers')
+    parser.add_argument('--history-days', type=int, default=1500, help='Bars per ticker (most recent ones for --symbols)')
+    parser.add_argument('--lookback', type=int, default=60, help='Bars per input window')
+    parser.add_argument('--horizon', type=int, default=30, help='Held-out business days to predict')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=1, help='Torch intra-op threads')
+    parser.add_argument('--production-model', action='store_true',
+                        help="Also score the model module's predict(ticker, history=...)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+    import torch
+
+    from api.global_model import GlobalModel, fit
+    from api.price_store import bars_to_frame
+
+    torch.set_num_threads(args.threads)
+    bars_by_ticker = stored_bars(args) if args.symbols else synthetic_bars(args)
+    training = {ticker: bars[:-args.horizon] for ticker, bars in bars_by_ticker.items()}
+    actual = {ticker: np.asarray(bars['close'][-args.horizon:]) for ticker, bars in bars_by_ticker.items()}
+    histories = {ticker: bars_to_frame(bars) for ticker, bars in training.items()}
+    fit_kwargs = {
+        'lookback': args.lookback,
+        'horizon': args.horizon,
+        'epochs': args.epochs,
+        'batch_size': args.batch_size,
+        'max_history': 0,
+        'seed': args.seed,
+    }
+
+    started = time.perf_counter()
+    global_model = GlobalModel(None, fit(training, **fit_kwargs))
+    global_train_s = time.perf_counter() - started
+    tickers = [ticker for ticker in training if global_model.covers(ticker)]
+
+    started = time.perf_counter()
+    global_results = global_model.predict({ticker: histories[ticker] for ticker in tickers})
+    batch_s = time.perf_counter() - started
+    single_durations = []
+    for ticker in tickers:
+        started = time.perf_counter()
+        global_model.predict({ticker: histories[ticker]})
+        single_durations.append(time.perf_counter() - started)
+
+    per_ticker_results, train_durations, predict_durations = {}, [], []
+    for ticker in tickers:
+        started = time.perf_counter()
+        model = GlobalModel(None, fit({ticker: training[ticker]}, **fit_kwargs))
+        train_durations.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        per_ticker_results.update(model.predict({ticker: histories[ticker]}))
+        predict_durations.append(time.perf_counter() - started)
+
+    naive_results = {
+        ticker: (np.full(args.horizon, training[ticker]['close'][-1]), None, None) for ticker in tickers
+    }
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'global': {
+            **describe(score(global_results, actual), tickers),
+            'train_s': round(global_train_s, 3),
+            'batch_predict_ms': round(batch_s * 1000, 3),
+            'batch_predict_ms_per_ticker': round(batch_s * 1000 / len(tickers), 3),
+            'single_predict': summarize(single_durations),
+        },
+        'per_ticker': {
+            **describe(score(per_ticker_results, actual), tickers),
+            'train_s': round(sum(train_durations), 3),
+            'train_per_ticker': summarize(train_durations),
+            'single_predict': summarize(predict_durations),
+        },
+        'naive': describe(score(naive_results, actual), tickers),
+    }
+
+    if args.production_model:
+        from api.forecaster import _accepts
+        from api.ml_model import PredictSuperCode
+
+        if not _accepts(PredictSuperCode.predict, 'history'):
+            raise SystemExit("--production-model needs a model whose predict() takes a history keyword argument")
+        production_results, durations = {}, []
+        for ticker in tickers:
+            started = time.perf_counter()
+            production_results[ticker] = PredictSuperCode.predict(ticker, history=histories[ticker])
+            durations.append(time.perf_counter() - started)
+        results['production'] = {
+            **describe(score(production_results, actual), tickers),
+            'train_and_predict': summarize(durations),
+        }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Latency and memory of the prediction models under each inference mode
+(eager, torchscript, quantized, onnx; see api/inference.py).
+
+By default a stand-in LSTM regressor, shaped like the production models, is
+fitted on a synthetic price series. Each mode then runs in its own spawned
+process so peak memory is measured from a clean interpreter, and reports
+per-call latency, the size of the exported model, the extra resident memory
+of loading and running it and its MAPE next to the eager model's. Modes
+that fail the accuracy guard are reported as rejected.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_inference --batch-size 1 --threads 1 --output inference.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .bench_prediction_api import git_commit, summarize
+
+
+def build_model(args):
+    import torch
+
+    class LSTMRegressor(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.lstm = torch.nn.LSTM(1, args.hidden_size, args.num_layers, batch_first=True)
+            self.head = torch.nn.Linear(args.hidden_size, 1)
+
+        def forward(self, inputs):
+            outputs, _ = self.lstm(inputs)
+            return self.head(outputs[:, -1])
+
+    return LSTMRegressor()
+
+
+def make_dataset(args):
+    """Windows of a min-max scaled random walk, and the next value of each."""
+    rng = np.random.default_rng(args.seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, args.history_days)))
+    scaled = ((prices - prices.min()) / (prices.max() - prices.min()) + 0.1).astype(np.float32)
+    windows = np.lib.stride_tricks.sliding_window_view(scaled[:-1], args.window)
+    targets = scaled[args.window:]
+    return windows[..., None].copy(), targets.copy()
+
+
+def fit(args, state_path):
+    import torch
+
+    torch.manual_seed(args.seed)
+    inputs, targets = make_dataset(args)
+    split = int(len(inputs) * 0.8)
+    model = build_model(args)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+    train_inputs, train_targets = torch.from_numpy(inputs[:split]), torch.from_numpy(targets[:split])
+    for _ in range(args.train_steps):
+        batch = torch.randint(0, split, (64,))
+        optimizer.zero_grad()
+        loss = torch.nn.functional.mse_loss(model(train_inputs[batch]).squeeze(-1), train_targets[batch])
+        loss.backward()
+        optimizer.step()
+    torch.save(model.state_dict(), state_path)
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def run_mode(args, state_path, mode):
+    """Runs in a fresh process: export, load and time one mode."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    import torch
+
+    from api import inference
+
+    inference.set_torch_threads(args.threads)
+    inputs, targets = make_dataset(args)
+    split = int(len(inputs) * 0.8)
+    validation_inputs, validation_targets = torch.from_numpy(inputs[split:]), torch.from_numpy(targets[split:])
+    batch = validation_inputs[:args.batch_size]
+
+    eager = build_model(args)
+    eager.load_state_dict(torch.load(state_path, weights_only=True))
+    eager.eval()
+
+    baseline_mb = rss_mb()
+    result = {'mode': mode}
+    if mode == 'eager':
+        model = eager
+        result['size_bytes'] = os.path.getsize(state_path)
+    else:
+        try:
+            data = inference.export(eager, validation_inputs, mode)
+            model = inference.load(data, mode)
+            eager_mape, exported_mape = inference.check_accuracy(
+                eager, model, validation_inputs, validation_targets, mode, args.max_drift)
+        except inference.AccuracyDriftError as e:
+            return {**result, 'rejected': str(e)}
+        except ImportError as e:
+            return {**result, 'skipped': str(e)}
+        result['size_bytes'] = len(data)
+
+    with torch.inference_mode():
+        for _ in range(args.warmup):
+            model(batch)
+        durations = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            model(batch)
+            durations.append(time.perf_counter() - started)
+        result['mape'] = round(inference.mape(model(validation_inputs), validation_targets), 4)
+
+    result['latency'] = summarize(durations)
+    result['rss_delta_mb'] = round(rss_mb() - baseline_mb, 2)
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='eager,torchscript,quantized,onnx', help='Comma-separated inference modes')
+    parser.add_argument('--batch-size', type=int, default=1, help='Windows per forward pass')
+    parser.add_argument('--iterations', type=int, default=500, help='Timed forward passes per mode')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=1, help='Torch intra-op threads')
+    parser.add_argument('--window', type=int, default=60, help='Days per input window')
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--num-layers', type=int, default=2)
+    parser.add_argument('--history-days', type=int, default=2500, help='Length of the synthetic price series')
+    parser.add_argument('--train-steps', type=int, default=300, help='Optimizer steps for the stand-in model')
+    parser.add_argument('--max-drift', type=float, default=0.5, help='Accuracy guard, in MAPE percentage points')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_path = os.path.join(tmp_dir, 'model.pt')
+        fit(args, state_path)
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            runs = [pool.apply(run_mode, (args, state_path, mode)) for mode in modes]
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'modes': runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
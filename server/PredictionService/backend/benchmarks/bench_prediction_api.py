@@ -0,0 +1,276 @@
+"""
+Load test for GET /api/v1/prediction/ against local stand-ins.
+
+Boots the Django app in-process with fakeredis and mongomock (or a real
+mongod via BENCH_MONGO_URI) and a deterministic stub in place of the
+model, then drives the endpoint from a thread pool through the WSGI
+stack, or with --server asgi from concurrent httpx clients through the
+ASGI app and its async views (needs httpx). --hit-ratio picks how many
+requests go to already cached tickers, from 1.0 (all hits) to 0.0 (every
+request is a new ticker); --distribution zipf concentrates the hits on a
+few popular tickers instead of spreading them evenly.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_prediction_api --requests 2000 --concurrency 16 \\
+        --hit-ratio 0.9 --output bench.json
+    python -m benchmarks.bench_prediction_api --server asgi --distribution zipf --output asgi.json
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+class StageTimer:
+    """Thread-safe collection of durations per stage."""
+
+    def __init__(self):
+        self._durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._durations[stage].append(seconds)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+    def awrap(self, stage, fn):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+    def summary(self):
+        with self._lock:
+            return {stage: summarize(durations) for stage, durations in self._durations.items()}
+
+
+def summarize(durations):
+    values = np.array(durations) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+
+def install_stub_model(latency_ms, horizon):
+    """Register a deterministic api.ml_model.PredictSuperCode that sleeps instead of training."""
+    def predict(ticker):
+        time.sleep(latency_ms / 1000)
+        seed = sum(ticker.encode())
+        predictions = np.linspace(100, 110, horizon) + seed % 10
+        dates = pd.bdate_range('2025-01-02', periods=horizon)
+        return predictions, dates, [0.05, 0.03, 0.04]
+
+    module = types.ModuleType('api.ml_model.PredictSuperCode')
+    module.predict = predict
+    package = types.ModuleType('api.ml_model')
+    package.__path__ = []
+    package.PredictSuperCode = module
+    sys.modules['api.ml_model'] = package
+    sys.modules['api.ml_model.PredictSuperCode'] = module
+
+
+def init_stub_worker(latency_ms, horizon):
+    """Compute pool initializer: the pool's workers predict with the stub too."""
+    install_stub_model(latency_ms, horizon)
+    from api.compute_pool import init_worker
+    init_worker()
+
+
+def zipf_chooser(rng, values, s):
+    """Draw from `values` with the k-th one weighted 1 / k ** s."""
+    cum_weights = list(itertools.accumulate(1 / rank ** s for rank in range(1, len(values) + 1)))
+    return lambda: rng.choices(values, cum_weights=cum_weights)[0]
+
+
+def drive_wsgi(plan, concurrency, timer, statuses):
+    from django.test import Client
+
+    status_lock = threading.Lock()
+    local = threading.local()
+
+    def send(request):
+        ticker, user_id = request
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        started = time.perf_counter()
+        response = local.client.get('/api/v1/prediction/', {'ticker': ticker}, HTTP_X_USER_ID=user_id)
+        timer.record('total', time.perf_counter() - started)
+        with status_lock:
+            statuses[response.status_code] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, plan))
+
+
+async def drive_asgi(plan, concurrency, timer, statuses):
+    import httpx
+
+    from cfehome.asgi import application
+
+    requests = iter(plan)
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url='http://testserver', timeout=None) as client:
+        async def send():
+            # Each client sends its next request once the previous one is answered
+            for ticker, user_id in requests:
+                started = time.perf_counter()
+                response = await client.get('/api/v1/prediction/', params={'ticker': ticker},
+                                            headers={'X-User-Id': user_id})
+                timer.record('total', time.perf_counter() - started)
+                statuses[response.status_code] += 1
+
+        await asyncio.gather(*(send() for _ in range(concurrency)))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help='Total number of requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--hit-ratio', type=float, default=0.9,
+                        help='Share of requests for pre-cached tickers (1.0 all hits, 0.0 all misses)')
+    parser.add_argument('--hot-tickers', type=int, default=50, help='Number of pre-cached tickers')
+    parser.add_argument('--distribution', choices=['uniform', 'zipf'], default='uniform',
+                        help='How requests for pre-cached tickers spread over them')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='Exponent of the zipf distribution')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi',
+                        help='Send requests through the WSGI views or the ASGI app and its async views')
+    parser.add_argument('--users', type=int, default=100, help='Number of distinct users sending requests')
+    parser.add_argument('--predict', choices=['stub', 'real'], default='stub',
+                        help='Use a deterministic stub or the real model package')
+    parser.add_argument('--stub-latency-ms', type=float, default=50.0, help='Time the stub spends per prediction')
+    parser.add_argument('--horizon', type=int, default=30, help='Days predicted by the stub')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    # Per-request INFO logs would bury the results; LOG_LEVEL=INFO brings them back
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.server == 'asgi':
+        # Routes the prediction URL to the async view, as under uvicorn
+        os.environ['ASGI_MODE'] = 'true'
+    if args.predict == 'stub':
+        install_stub_model(args.stub_latency_ms, args.horizon)
+
+    import django
+    django.setup()
+
+    from datetime import datetime, timedelta
+
+    from django_redis.cache import RedisCache
+
+    from api import compute_pool, views
+    from api.db_connection import get_collection
+    from api.forecaster import predict
+    from api.prediction_cache import build_prediction_result, set_cached_predictions
+
+    timer = StageTimer()
+    views.PredictionPriceView._check_subscription_status = timer.wrap(
+        'quota', views.PredictionPriceView._check_subscription_status)
+    views.PredictionPriceView._compute_price_prediction = timer.wrap(
+        'compute', views.PredictionPriceView._compute_price_prediction)
+    views.AsyncPredictionPriceView._compute_price_prediction = timer.awrap(
+        'compute', views.AsyncPredictionPriceView._compute_price_prediction)
+    RedisCache.get = timer.wrap('cache_get', RedisCache.get)
+    RedisCache.set_many = timer.wrap('cache_set', RedisCache.set_many)
+
+    # Users with a limit that is never reached, so the quota path runs without rejections
+    get_collection('user_prediction').insert_many([{
+        'user_id': f'bench-user-{i}',
+        'prediction_usage': {'daily_usage': 0, 'last_reset_date': datetime.now()},
+        'subscription_details': {
+            'daily_limit': 10 ** 9,
+            'subscription_plan_type': 'free',
+            'start_date': datetime.now(),
+            'end_date': datetime.now() + timedelta(days=30),
+        },
+    } for i in range(args.users)])
+
+    hot_tickers = [f'HOT{i}' for i in range(args.hot_tickers)]
+    set_cached_predictions({ticker: build_prediction_result(*predict(ticker)) for ticker in hot_tickers})
+
+    if args.predict == 'stub':
+        # Misses under ASGI are computed in the pool's worker processes
+        compute_pool.init_worker = functools.partial(init_stub_worker, args.stub_latency_ms, args.horizon)
+
+    rng = random.Random(args.seed)
+    if args.distribution == 'zipf':
+        choose_hot = zipf_chooser(rng, hot_tickers, args.zipf_s)
+    else:
+        choose_hot = functools.partial(rng.choice, hot_tickers)
+    plan = []
+    for i in range(args.requests):
+        if rng.random() < args.hit_ratio and hot_tickers:
+            ticker = choose_hot()
+        else:
+            # Never requested before, so always a miss
+            ticker = f'COLD{i}'
+        plan.append((ticker, f'bench-user-{rng.randrange(args.users)}'))
+
+    statuses = Counter()
+    started = time.perf_counter()
+    if args.server == 'asgi':
+        asyncio.run(drive_asgi(plan, args.concurrency, timer, statuses))
+    else:
+        drive_wsgi(plan, args.concurrency, timer, statuses)
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(args.requests / elapsed, 2),
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'stages': timer.summary(),
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Startup time and memory of the service's processes.
+
+Each target is started in a fresh interpreter, --repeat times, and reports
+the time to get ready (Django set up and the target's modules imported),
+the wall time of the whole process including interpreter start, its peak
+RSS, and which heavy ML libraries ended up imported. A web worker or the
+Kafka consumer importing torch again shows up here straight away.
+
+Nothing connects to MongoDB or Redis: the settings only need the
+environment variables, which default to local addresses.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_startup --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Only the standard library above: the children run this module too, and must not pay for numpy/pandas here
+
+HEAVY_MODULES = ['numpy', 'pandas', 'torch', 'sklearn', 'yfinance']
+
+
+def _web():
+    # What a worker imports before serving its first request
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def _command(name):
+    def load():
+        from django.core.management import load_command_class
+        load_command_class('api', name)
+    return load
+
+
+def _mongo_client():
+    from api.db_connection import get_client
+    get_client()
+
+
+TARGETS = {
+    'settings': lambda: None,
+    'web': _web,
+    'consume_kafka': _command('consume_kafka'),
+    'flush_quota_usage': _command('flush_quota_usage'),
+    'run_prediction_jobs': _command('run_prediction_jobs'),
+    'mongo_client': _mongo_client,
+}
+
+
+def run_child(target):
+    started = time.perf_counter()
+    import django
+    django.setup()
+    TARGETS[target]()
+    ready = time.perf_counter() - started
+    print(json.dumps({
+        'ready_s': ready,
+        # kilobytes on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'heavy_modules': [module for module in HEAVY_MODULES if module in sys.modules],
+    }))
+
+
+def measure(target, repeat):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'cfehome.settings')
+    env.setdefault('MONGO_DB_ATLAS_URI', 'mongodb://localhost:27017')
+    env.setdefault('MONGO_DB_NAME', 'stocksmith_bench')
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.bench_startup', '--child', target], env=env, text=True)
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process_s'] = time.perf_counter() - started
+        runs.append(run)
+
+    def median(field):
+        return round(statistics.median(run[field] for run in runs), 3)
+
+    return {
+        'ready_s': median('ready_s'),
+        'process_s': median('process_s'),
+        'max_rss_mb': median('max_rss_mb'),
+        'heavy_modules': runs[-1]['heavy_modules'],
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=','.join(TARGETS), help='Comma-separated targets to start')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh processes per target (the median is reported)')
+    parser.add_argument('--child', choices=list(TARGETS), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_child(args.child)
+        return
+
+    from .bench_prediction_api import git_commit
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'targets': {target: measure(target, args.repeat) for target in args.targets.split(',')},
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Memory and time of turning a price history into training tensors, for
+histories of 1 to 30 years.
+
+Two pipelines run on the same memory-mapped bars (synthetic, in the price
+store's format):
+
+- dataframe: a DataFrame of the history, a scaled float64 copy, a window
+  list stacked with np.array and copied into float32 tensors, as a typical
+  per-request pipeline does.
+- strided: api/windowing.py, one float32 buffer scaled in place, strided
+  window views and torch.from_numpy. With --memmap the buffer itself is a
+  file-backed memmap.
+
+Each (pipeline, years) pair runs in its own spawned process so peak memory
+is measured from a clean interpreter. Reported are the preprocessing time,
+the time of one pass over shuffled batches, and the extra peak RSS.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_windowing --years 1,5,10,30 --output windowing.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .bench_inference import rss_mb
+from .bench_prediction_api import git_commit
+
+BARS_PER_YEAR = 252
+
+
+def write_bars(path, bars_count, seed):
+    """Synthetic bars saved like an api.price_store file."""
+    from api.price_store import PRICE_DTYPE
+
+    rng = np.random.default_rng(seed)
+    bars = np.zeros(bars_count, dtype=PRICE_DTYPE)
+    bars['date'] = np.busday_offset(np.datetime64('1990-01-02'), np.arange(bars_count))
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars_count)))
+    for field in ('open', 'high', 'low', 'close', 'adj_close'):
+        bars[field] = close * rng.uniform(0.99, 1.01, bars_count)
+    bars['volume'] = rng.uniform(1e5, 1e7, bars_count)
+    np.save(path, bars)
+
+
+def dataframe_pipeline(bars, args, tmp_dir):
+    import torch
+
+    from api.price_store import bars_to_frame
+
+    frame = bars_to_frame(bars)
+    values = frame[['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']].values
+    split = int(len(values) * 0.8)
+    low, high = values[:split].min(axis=0), values[:split].max(axis=0)
+    scaled = (values - low) / (high - low)
+    inputs = np.array([scaled[i:i + args.lookback] for i in range(len(scaled) - args.lookback - args.horizon + 1)])
+    targets = np.array([
+        scaled[i + args.lookback:i + args.lookback + args.horizon, 3]
+        for i in range(len(scaled) - args.lookback - args.horizon + 1)
+    ])
+    return torch.tensor(inputs, dtype=torch.float32), torch.tensor(targets, dtype=torch.float32)
+
+
+def strided_pipeline(bars, args, tmp_dir):
+    from api import windowing
+
+    out = None
+    if args.memmap:
+        out = windowing.memmap_buffer(os.path.join(tmp_dir, 'buffer.npy'), (len(bars), len(windowing.PRICE_FIELDS)))
+    buffer = windowing.price_buffer(bars, out=out)
+    low, scale = windowing.fit_min_max(buffer, int(len(buffer) * 0.8))
+    windowing.scale_in_place(buffer, low, scale)
+    inputs, targets = windowing.sliding_windows(buffer, args.lookback, args.horizon)
+    return windowing.as_tensor(inputs), windowing.as_tensor(targets[..., 3])
+
+
+def storage_mb(*tensors):
+    storages = {tensor.untyped_storage().data_ptr(): tensor.untyped_storage().nbytes() for tensor in tensors}
+    return sum(storages.values()) / 2 ** 20
+
+
+PIPELINES = {'dataframe': dataframe_pipeline, 'strided': strided_pipeline}
+
+
+def run(args, pipeline, years):
+    """Runs in a fresh process: build the tensors of one history and go over them once."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    import torch
+
+    torch.set_num_threads(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'bars.npy')
+        write_bars(path, years * BARS_PER_YEAR, args.seed)
+        bars = np.load(path, mmap_mode='r')
+
+        baseline_mb = rss_mb()
+        started = time.perf_counter()
+        inputs, targets = PIPELINES[pipeline](bars, args, tmp_dir)
+        preprocess_s = time.perf_counter() - started
+
+        # One epoch of shuffled batches, touching every window once
+        order = torch.from_numpy(np.random.default_rng(args.seed).permutation(len(inputs)))
+        started = time.perf_counter()
+        total = 0.0
+        for i in range(0, len(order), args.batch_size):
+            chosen = order[i:i + args.batch_size]
+            total += float(inputs[chosen].sum() + targets[chosen].sum())
+        epoch_s = time.perf_counter() - started
+
+        return {
+            'pipeline': pipeline + ('+memmap' if pipeline == 'strided' and args.memmap else ''),
+            'years': years,
+            'bars': len(bars),
+            'windows': len(inputs),
+            'preprocess_ms': round(preprocess_s * 1000, 3),
+            'epoch_ms': round(epoch_s * 1000, 3),
+            # Memory behind the tensors: the windows copied, or the one buffer they share
+            'tensor_storage_mb': round(storage_mb(inputs, targets), 2),
+            'peak_rss_delta_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline_mb, 2),
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', default='1,2,5,10,20,30', help='Comma-separated history lengths in years')
+    parser.add_argument('--pipelines', default='dataframe,strided', help='Comma-separated pipelines')
+    parser.add_argument('--lookback', type=int, default=60, help='Bars per input window')
+    parser.add_argument('--horizon', type=int, default=30, help='Bars per target window')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--memmap', action='store_true', help='Back the strided pipeline with a file-backed memmap')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pipelines = [pipeline.strip() for pipeline in args.pipelines.split(',') if pipeline.strip()]
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for years in (int(y) for y in args.years.split(',')):
+            for pipeline in pipelines:
+                runs.append(pool.apply(run, (args, pipeline, years)))
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'runs': runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Settings for the benchmarks: the regular settings with Redis replaced by
+fakeredis and MongoDB by mongomock, unless BENCH_MONGO_URI points at a
+real mongod.
+"""
+import os
+
+os.environ.setdefault('MONGO_DB_ATLAS_URI', os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017'))
+os.environ.setdefault('MONGO_DB_NAME', 'stocksmith_bench')
+
+from cfehome.settings import *  # noqa: E402,F401,F403
+
+import fakeredis  # noqa: E402
+import mongomock  # noqa: E402
+
+if not os.getenv('BENCH_MONGO_URI'):
+    MONGO_CLIENT_OPTIONS = {**MONGO_CLIENT_OPTIONS, 'mongo_client_class': mongomock.MongoClient}  # noqa: F405
+
+_fake_redis_server = fakeredis.FakeServer()
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://localhost:6379/1",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_KWARGS": {
+                "connection_class": fakeredis.FakeConnection,
+                "server": _fake_redis_server,
+            },
+        },
+    }
+}
+
+ALLOWED_HOSTS = ['*']
+
+# The benchmarks request synthetic tickers (HOT0, COLD1, ...): without a
+# symbol master the index accepts every ticker instead of answering 404
+SYMBOLS_FILE = os.getenv('BENCH_SYMBOLS_FILE', '')
+
@@ -12,9 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
-from pymongo import MongoClient
 from dotenv import load_dotenv
-from mongoengine import connect
 # Load environment variables from .env file
 load_dotenv('.env')
 
@@ -26,28 +24,119 @@ CONNECTION_STRING = os.getenv('MONGO_DB_ATLAS_URI')
 if not CONNECTION_STRING:
     raise ValueError("MONGO_DB_ATLAS_URI environment variable is not set")
 
-# Connect to MongoDB using mongoengine
-client = connect(host=CONNECTION_STRING)
 DB_NAME = os.getenv('MONGO_DB_NAME')
 
 if not DB_NAME:
     raise ValueError("MONGO_DB_NAME environment variable is not set")
 
-DB = client[DB_NAME]
-
-# PyMongo client for direct database access if needed
-MONGO_CLIENT = MongoClient(CONNECTION_STRING)
+# One pooled client per process, shared by mongoengine and pymongo and only
+# created on first use (api/db_connection.py). Workers run queries from a
+# thread pool, background commands need a connection or two.
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '20')),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+    'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '60000')),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    'connect': False,
+}
 
 KAFKA_DEVELOPMENT_SERVER = os.getenv('KAFKA_BROKERS_DEV', 'localhost:29092') # Default for local dev
 KAFKA_PRODUCTION_SERVER = os.getenv('KAFKA_BROKERS_PROD', 'kafka:9092') # Example for Docker Compose
 
 IS_PRODUCTION = os.getenv('IS_PRODUCTION', 'false').lower() == 'true' # Better boolean conversion
 
+# Set when served by uvicorn (see supervisord.conf) to route predictions to the async view
+ASGI_MODE = os.getenv('ASGI_MODE', 'false').lower() == 'true'
+
 KAFKA_BOOTSTRAP_SERVERS = KAFKA_PRODUCTION_SERVER if IS_PRODUCTION else KAFKA_DEVELOPMENT_SERVER
 
 KAFKA_PREDICTION_TOPIC = os.getenv('KAFKA_PREDICTION_TOPIC')
 KAFKA_CONSUMER_GROUP_ID = os.getenv('KAFKA_CONSUMER_GROUP_ID')
 
+# Upper bound on the number of symbols accepted by the batch prediction endpoint
+PREDICTION_BATCH_MAX_SYMBOLS = int(os.getenv('PREDICTION_BATCH_MAX_SYMBOLS', '50'))
+
+# Part of every prediction cache key: bump it when deploying a new model to stop serving the old one's predictions
+PREDICTION_MODEL_VERSION = os.getenv('PREDICTION_MODEL_VERSION', '1')
+# zlib-compress cached predictions (api/prediction_codec.py); saves little on short horizons
+PREDICTION_CACHE_COMPRESS = os.getenv('PREDICTION_CACHE_COMPRESS', 'false').lower() == 'true'
+
+# Per-process cache of user_prediction documents for plan checks (api/subscription_cache.py), 0 disables it.
+# Invalidated over Redis pub/sub by consume_kafka and flush_quota_usage, the TTL bounds a missed invalidation
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv('SUBSCRIPTION_CACHE_SIZE', '10000'))
+SUBSCRIPTION_CACHE_TTL = float(os.getenv('SUBSCRIPTION_CACHE_TTL', '300'))
+
+# Per-process LRU of decoded predictions in front of Redis (api/local_cache.py), 0 disables it
+PREDICTION_LOCAL_CACHE_SIZE = int(os.getenv('PREDICTION_LOCAL_CACHE_SIZE', '1024'))
+PREDICTION_LOCAL_CACHE_TTL = float(os.getenv('PREDICTION_LOCAL_CACHE_TTL', '300'))  # bounds staleness if an invalidation is missed
+
+# Single-flight coalescing of prediction cache misses (seconds)
+PREDICTION_LOCK_TIMEOUT = int(os.getenv('PREDICTION_LOCK_TIMEOUT', '600'))  # max time one worker may hold the compute lock
+PREDICTION_LOCK_WAIT_TIMEOUT = int(os.getenv('PREDICTION_LOCK_WAIT_TIMEOUT', '120'))  # how long other callers wait for it
+PREDICTION_LOCK_POLL_INTERVAL = float(os.getenv('PREDICTION_LOCK_POLL_INTERVAL', '0.25'))
+PREDICTION_RETRY_AFTER = int(os.getenv('PREDICTION_RETRY_AFTER', '30'))
+
+# Backpressure for the async prediction view (per server process)
+PREDICTION_COMPUTE_WORKERS = int(os.getenv('PREDICTION_COMPUTE_WORKERS', '2'))  # model processes
+PREDICTION_COMPUTE_MAX_PENDING = int(os.getenv('PREDICTION_COMPUTE_MAX_PENDING', '8'))  # running + queued predictions
+PREDICTION_CACHE_MAX_CONCURRENCY = int(os.getenv('PREDICTION_CACHE_MAX_CONCURRENCY', '200'))  # concurrent cache/quota lookups
+
+# Symbol master shared with the frontend (frontend1/public/merged_symbols.csv, which
+# docker-compose.yml mounts into the container and points SYMBOLS_FILE at)
+SYMBOLS_FILE = os.getenv('SYMBOLS_FILE', str(BASE_DIR.parent.parent.parent / 'frontend1' / 'public' / 'merged_symbols.csv'))
+# Requests for tickers missing from it are rejected (api/symbols.py); the file is re-read when it changes
+SYMBOL_INDEX_CHECK_INTERVAL = float(os.getenv('SYMBOL_INDEX_CHECK_INTERVAL', '60'))  # seconds between mtime checks
+# Refuse to start without the file instead of accepting every ticker (on by default in production)
+SYMBOLS_FILE_REQUIRED = os.getenv('SYMBOLS_FILE_REQUIRED', str(IS_PRODUCTION)).lower() == 'true'
+
+# Queued predictions (POST /api/v1/prediction/jobs/, manage.py run_prediction_jobs)
+PREDICTION_JOB_WORKERS = int(os.getenv('PREDICTION_JOB_WORKERS', '2'))
+PREDICTION_JOB_TTL = int(os.getenv('PREDICTION_JOB_TTL', '86400'))  # how long finished jobs can be polled
+PREDICTION_JOB_MAX_WAIT = float(os.getenv('PREDICTION_JOB_MAX_WAIT', '30'))  # longest long-poll
+
+# Nightly cache pre-warming (manage.py prewarm_predictions)
+PREWARM_CHECKPOINT_FILE = os.getenv('PREWARM_CHECKPOINT_FILE', str(BASE_DIR / 'prewarm_checkpoint.json'))
+
+# Trained model artifacts, keyed by ticker, data cutoff date and model type
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', str(BASE_DIR / 'model_registry'))
+MODEL_REGISTRY_CACHE_SIZE = int(os.getenv('MODEL_REGISTRY_CACHE_SIZE', '64'))  # artifacts kept loaded per worker
+MODEL_REGISTRY_KEEP_CUTOFFS = int(os.getenv('MODEL_REGISTRY_KEEP_CUTOFFS', '2'))  # cutoff dates kept on disk per ticker
+
+# Models are fine-tuned on the new bars from the previous cutoff's weights, with a full retrain
+# every MODEL_FULL_RETRAIN_DAYS or when the validation MAPE gets more than
+# MODEL_FINE_TUNE_MAX_MAPE_INCREASE (relative) worse than at the last full retrain
+MODEL_FINE_TUNE_EPOCHS = int(os.getenv('MODEL_FINE_TUNE_EPOCHS', '3'))
+MODEL_FULL_RETRAIN_DAYS = int(os.getenv('MODEL_FULL_RETRAIN_DAYS', '7'))
+MODEL_FINE_TUNE_MAX_MAPE_INCREASE = float(os.getenv('MODEL_FINE_TUNE_MAX_MAPE_INCREASE', '0.1'))
+
+# Full retrains train the candidate models in parallel (api/candidate_training.py), in at most this many
+# processes; inside a pool worker (compute pool, jobs, prewarm) they are trained one after the other.
+# Candidates stop at the budget (seconds per ticker), or once their validation MAPE is more than
+# MODEL_CANDIDATE_PRUNE_RATIO times the best candidate's after MODEL_CANDIDATE_MIN_EPOCHS
+MODEL_TRAINING_WORKERS = int(os.getenv('MODEL_TRAINING_WORKERS', '4'))
+MODEL_TRAINING_BUDGET = float(os.getenv('MODEL_TRAINING_BUDGET', '300'))
+MODEL_CANDIDATE_MIN_EPOCHS = int(os.getenv('MODEL_CANDIDATE_MIN_EPOCHS', '5'))
+MODEL_CANDIDATE_PRUNE_RATIO = float(os.getenv('MODEL_CANDIDATE_PRUNE_RATIO', '1.5'))
+
+# Serve the tickers covered by the cross-ticker model of `manage.py train_global_model` from it
+# (api/global_model.py) instead of their own models; bump PREDICTION_MODEL_VERSION when switching
+PREDICTION_GLOBAL_MODEL = os.getenv('PREDICTION_GLOBAL_MODEL', 'false').lower() == 'true'
+GLOBAL_MODEL_LOOKBACK = int(os.getenv('GLOBAL_MODEL_LOOKBACK', '60'))  # bars per input window
+GLOBAL_MODEL_HORIZON = int(os.getenv('GLOBAL_MODEL_HORIZON', '30'))  # business days predicted
+GLOBAL_MODEL_MAX_AGE_DAYS = int(os.getenv('GLOBAL_MODEL_MAX_AGE_DAYS', '7'))  # older global models are not served
+
+# eager, torchscript, quantized (dynamic int8) or onnx (needs onnx and onnxruntime), see api/inference.py
+PREDICTION_INFERENCE_MODE = os.getenv('PREDICTION_INFERENCE_MODE', 'eager')
+# Largest MAPE difference, in percentage points, allowed between an exported model and the eager one
+PREDICTION_EXPORT_MAX_MAPE_DRIFT = float(os.getenv('PREDICTION_EXPORT_MAX_MAPE_DRIFT', '0.5'))
+# Intra-op threads per process; each compute pool worker runs one prediction at a time
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '1'))
+
+# Local daily price history, one memory-mapped .npy file per ticker
+PRICE_STORE_DIR = os.getenv('PRICE_STORE_DIR', str(BASE_DIR / 'price_store'))
+# Seconds before retrying a download that did not have the last close's bar yet (published late)
+PRICE_REFRESH_RETRY_INTERVAL = int(os.getenv('PRICE_REFRESH_RETRY_INTERVAL', '900'))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
@@ -80,6 +169,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
 MIDDLEWARE = [
+    'api.middleware.server_timing_middleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -172,4 +262,24 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
-}
\ No newline at end of file
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {
+            'format': '%(asctime)s %(levelname)s %(process)d %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'default',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv('LOG_LEVEL', 'INFO'),
+    },
+}